@@ -0,0 +1,239 @@
+"""
+Computer opponent for ASCII Battle.
+
+search_policy(budget_ms) makes a policy (see policies.py) that plays a turn
+within a time budget. Units act one after another, each gets an equal share
+of what is left of the budget. For a unit it tries candidate actions, a
+cell to move to (or staying put) followed by each target it could then
+shoot at, on clones of the engine (Engine.clone), lets the enemy
+answer with greedy_policy and scores the outcome with evaluate(). Attacks
+and the answer depend on the dice, so while time is left candidates are
+played again with other rolls and the best average wins: a flat Monte
+Carlo search, one ply deep per unit.
+
+Candidates are tried best guess first (the cell greedy_policy would pick,
+then the farthest the unit gets along Pathfinder.route to the nearest
+enemy, staying put when there is already something to shoot; targets by the share
+of their hit points the attack is expected to take), so with a tiny
+budget the opponent plays like greedy_policy and a bigger one only makes it
+better. Budgets of a few ms suit batch simulations, a few hundred an
+interactive opponent. Because the budget is wall time, two runs with the
+same seed can differ when the machine is busy.
+
+evaluate() scores a match for one player: for both sides the hit points of
+living units, worth more in cover and under armor the enemy weapons can't
+get through, plus their firepower (weapons with ammo left) against the
+enemy's armor; minus the route cost from each of the player's units to
+the nearest enemy (Pathfinder.route_costs), so it keeps closing in, and
+around water rather than up to its bank.
+Firepower and armor are rated with the expected damage of the rules'
+combat table (engine.COMBAT), in the open and on level ground.
+
+The search respects fog of war: it only knows about the enemy units its
+side has spotted. Candidate cells, the threat map and evaluate() leave the
+others out, and in the enemy's answer they hold still and don't shoot.
+"""
+
+import random
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from engine import COMBAT
+from policies import enemy_distance, enemy_distances, greedy_policy, own_units, weakest
+
+DEFAULT_BUDGET_MS = 300
+MAX_CELLS = 16          # cells tried per unit, best guesses first
+COVER_WEIGHT = 0.25     # extra worth of a hit point per cover level
+FIRE_WEIGHT = 1.0       # worth of a point of expected damage per attack
+APPROACH_WEIGHT = 0.05  # cost of a move point on the route from a unit to the nearest enemy
+WIN_SCORE = 1000
+
+
+def expected(ws, arm):
+    # Expected damage of one attack with weapon system `ws` on armor `arm`,
+    # in the open and on level ground
+    return COMBAT.expected[COMBAT.index(ws, arm, 0, 0)]
+
+
+def penetration(ws, arm):
+    # Share of a weapon's damage that is left against armor `arm`
+    full = expected(ws, 0)
+    return expected(ws, arm) / full if full else 0.0
+
+
+def loaded(unit):
+    # Weapon systems of a unit that have ammo left
+    return tuple(ws for ws, ammo in ((unit.ws1, unit.ws1_ammo), (unit.ws2, unit.ws2_ammo)) if ammo > 0)
+
+
+@lru_cache(maxsize=None)
+def firepower(weapons, armors):
+    # Expected damage per attack of a unit with these loaded weapons, its best
+    # one averaged over the enemy armor values (unarmored with none spotted)
+    armors = armors or (0,)
+    return max((sum(expected(ws, a) for a in armors) / len(armors) for ws in weapons), default=0.0)
+
+
+@lru_cache(maxsize=None)
+def exposure(arm, arsenals):
+    # Share of enemy fire that gets through armor `arm`, over the loaded
+    # weapons of each enemy unit, each with its best one against it
+    if not arsenals:
+        return 1.0
+    shares = [max((penetration(ws, arm) for ws in weapons), default=0.0) for weapons in arsenals]
+    return max(0.1, sum(shares) / len(shares))
+
+
+def spotted_enemies(engine, player):
+    # Living enemy units `player` has spotted, all the search may know about
+    enemy = 2 if player == 1 else 1
+    return [e for e in engine.units.alive(enemy) if engine.is_spotted(player, e.x, e.y)]
+
+
+def side_score(engine, units, enemies):
+    cover = engine.layers.cover
+    armors = tuple(sorted(e.arm for e in enemies))
+    arsenals = tuple(sorted(loaded(e) for e in enemies))
+    score = 0.0
+    for u in units:
+        hp = u.hp
+        score += hp * (1 + COVER_WEIGHT * cover[u.y, u.x]) / exposure(u.arm, arsenals)
+        score += FIRE_WEIGHT * firepower(loaded(u), armors) * hp / u.max_hp
+    return score
+
+
+def evaluate(engine, player):
+    # How good the match looks for `player`, higher is better
+    winner = engine.check_victory()
+    if winner is not None:
+        return WIN_SCORE if winner == player else -WIN_SCORE
+    mine = engine.units.alive(player)
+    theirs = spotted_enemies(engine, player)
+    score = side_score(engine, mine, theirs) - side_score(engine, theirs, mine)
+    if theirs:
+        for u in mine:
+            score -= APPROACH_WEIGHT * enemy_distance(engine, u, theirs)
+    return score
+
+
+def candidate_cells(engine, unit, threat):
+    # Cells to try moving to, best guess first; None stays put
+    cells = sorted(engine.reachable(unit).cells)
+    enemies = spotted_enemies(engine, unit.owner)
+    goals = [e for e in enemies if engine.pathfinder.connected(unit, e.x, e.y)] or enemies
+    if cells and goals:
+        cx, cy = np.array(cells).T
+        dist = enemy_distances(engine, unit, cx, cy, goals)
+        cells = [cells[i] for i in np.lexsort((threat[cy, cx], dist))[:MAX_CELLS].tolist()]
+        # Plus as far as it gets along the route to the nearest one, right after the best guess
+        graph = engine.pathfinder.route_graph(unit)
+        goal = min(goals, key=lambda e: graph.distances(e.x, e.y).at(unit.x, unit.y))
+        step = engine.pathfinder.advance(unit, goal.x, goal.y)
+        if step is not None and step not in cells:
+            cells.insert(1, step)
+            del cells[MAX_CELLS:]
+    if engine.targets(unit):
+        return [None] + cells
+    return cells + [None]
+
+
+def play_out(engine, player):
+    # Let the enemy answer and score what's left. Enemy units `player`
+    # hasn't spotted sit the answer out, as if they weren't there
+    if engine.check_victory() is None:
+        hidden = [e.index for e in engine.units.alive(2 if player == 1 else 1)
+                  if not engine.is_spotted(player, e.x, e.y)]
+        engine.end_turn()
+        for i in hidden:
+            u = engine.units[i]
+            u.moved = u.acted = True
+        greedy_policy(engine)
+    return evaluate(engine, player)
+
+
+class Candidate:
+    __slots__ = ('cell', 'target', 'total', 'runs')
+
+    def __init__(self, cell, target):
+        self.cell = cell        # (x, y) to move to, None to stay
+        self.target = target    # index of the unit to attack, None for no attack
+        self.total = 0.0
+        self.runs = 0
+
+    def mean(self):
+        return self.total / self.runs
+
+
+def act(engine, unit, cand):
+    # Play a candidate with the engine's own handles
+    if cand.cell is not None:
+        engine.move(unit, *cand.cell)
+    if cand.target is not None:
+        engine.attack(unit, engine.units[cand.target])
+
+
+def search_unit(engine, unit, threat, deadline, rng):
+    # Best candidate action of `unit` found before `deadline`
+    player = engine.turn
+    candidates = []
+    cells = candidate_cells(engine, unit, threat)
+
+    # First pass: find out what can be shot from each cell, score every option once
+    for cell in cells:
+        moved = engine.clone()
+        if cell is not None:
+            moved.move(moved.units[unit.index], *cell)
+        mu = moved.units[unit.index]
+        targets = moved.targets(mu)
+        # Holding fire never helps, so with targets in range every option shoots;
+        # the biggest expected bite out of a target's hit points first
+        share = dict(zip(targets, (moved.expected_damage(mu, targets) / [t.hp for t in targets]).tolist()))
+        options = [t.index for t in sorted(targets, key=lambda t: (-share[t], t.hp, t.x, t.y))] or [None]
+        for target in options:
+            cand = Candidate(cell, target)
+            trial = moved.clone()
+            trial.dice.seed(rng.getrandbits(32))
+            act(trial, trial.units[unit.index], cand)
+            cand.total += play_out(trial, player)
+            cand.runs += 1
+            candidates.append(cand)
+            if time.perf_counter() >= deadline:
+                return max(candidates, key=Candidate.mean)
+
+    # Then replay them with other rolls while time is left
+    while len(candidates) > 1 and time.perf_counter() < deadline:
+        for cand in candidates:
+            trial = engine.clone()
+            trial.dice.seed(rng.getrandbits(32))
+            act(trial, trial.units[unit.index], cand)
+            cand.total += play_out(trial, player)
+            cand.runs += 1
+            if time.perf_counter() >= deadline:
+                break
+    return max(candidates, key=Candidate.mean)
+
+
+def search_policy(budget_ms=DEFAULT_BUDGET_MS):
+    def policy(engine):
+        start = time.perf_counter()
+        end = start + budget_ms / 1000
+        # Rolls for the look-ahead come from the match's RNG, so the search is
+        # seeded like the rest of the match
+        rng = random.Random(engine.rng.getrandbits(32))
+        threat = engine.threat_map(engine.turn, enemies=spotted_enemies(engine, engine.turn))
+        units = own_units(engine)
+        for k, u in enumerate(units):
+            if engine.check_victory() is not None:
+                return
+            now = time.perf_counter()
+            deadline = now + (end - now) / (len(units) - k)
+            cand = search_unit(engine, u, threat, deadline, rng)
+            act(engine, u, cand)
+            # Shoot anyway if the move opened up a target the search didn't get to try
+            if not u.acted:
+                targets = engine.targets(u)
+                if targets:
+                    engine.attack(u, weakest(targets))
+    return policy
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Deck library (the armoury of the GDD) for ASCII Battle.
+
+A deck is a named army list for one side (nation): up to DECK_SIZE unit
+kinds that together cost at most ARMY_POINTS (see UNIT_TYPES cost). Decks
+are kept in one SQLite file, one row per deck, with B-tree indexes on the
+name and on (side, cost), so finding a deck by name and listing the decks
+of a side or of a point range are index lookups however big the library
+gets.
+
+Listing is lazy: decks() yields decks a page at a time and every page
+continues from the last (cost, name) seen instead of counting rows with
+OFFSET, so a library of tens of thousands of decks opens at once. `list
+--page N` finds where its page starts by stepping over the (cost, name)
+index entries before it, without reading those decks.
+
+    python3 armoury.py add "Blitz" GER ">TTO"     (new deck, checked against UNIT_TYPES)
+    python3 armoury.py list --side GER --max-cost 20
+    python3 armoury.py show Blitz
+    python3 armoury.py delete Blitz
+    python3 armoury.py export decks.json          (all decks, or filtered like list)
+    python3 armoury.py import decks.json
+    python3 ascii_battle.py --deck1 Blitz --deck2 "Iron Wall"
+
+Export files are JSON lists of {"name", "side", "units"} objects, units
+as a string of unit kinds; import checks every deck like add does.
+"""
+
+import argparse
+import json
+import sqlite3
+
+from engine import ARMY_POINTS, START_POSITIONS_P1, START_POSITIONS_P2, UNIT_TYPES
+
+DEFAULT_DB = "armoury.db"
+# Sides a deck can belong to, as in the C++ armoury
+NATIONS = ("USA", "RUS", "GER", "CHI", "FIN", "GBR", "FRA", "POL", "IRN", "JAP")
+DECK_SIZE = min(len(START_POSITIONS_P1), len(START_POSITIONS_P2))
+NAME_LENGTH = 30
+PAGE_SIZE = 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS decks (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    side TEXT NOT NULL,
+    cost INTEGER NOT NULL,
+    units TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS decks_side_cost ON decks (side, cost, name);
+CREATE INDEX IF NOT EXISTS decks_cost ON decks (cost, name);
+"""
+
+
+class DeckError(Exception):
+    pass
+
+
+def army_cost(units):
+    return sum(UNIT_TYPES[kind]['cost'] for kind in units)
+
+
+def deck_problems(name, side, units):
+    # Reasons a deck can't be kept, [] if none
+    problems = []
+    if not name.strip() or len(name) > NAME_LENGTH:
+        problems.append(f"Deck names have 1 to {NAME_LENGTH} characters.")
+    if side not in NATIONS:
+        problems.append(f"Unknown side {side!r} (choose from {', '.join(NATIONS)}).")
+    unknown = sorted(set(units) - set(UNIT_TYPES))
+    if unknown:
+        problems.append(f"Unknown unit types: {' '.join(unknown)}.")
+    if not units:
+        problems.append("A deck needs at least one unit.")
+    elif len(units) > DECK_SIZE:
+        problems.append(f"{len(units)} units but only {DECK_SIZE} start positions.")
+    elif not unknown and army_cost(units) > ARMY_POINTS:
+        problems.append(f"Costs {army_cost(units)} points, the limit is {ARMY_POINTS}.")
+    return problems
+
+
+def deck_filter(side=None, min_cost=None, max_cost=None, prefix=None, after=None):
+    # WHERE clause (with a leading space, "" for none) and its arguments
+    where, args = [], []
+    if side is not None:
+        where.append("side = ?")
+        args.append(side)
+    if min_cost is not None:
+        where.append("cost >= ?")
+        args.append(min_cost)
+    if max_cost is not None:
+        where.append("cost <= ?")
+        args.append(max_cost)
+    if prefix:
+        # A range on the name, which the index can use (LIKE can't, it ignores case)
+        where.append("name >= ? AND name < ?")
+        args += [prefix, prefix + "\U0010ffff"]
+    if after is not None:
+        # Row values, so SQLite seeks the index to it
+        where.append("(cost, name) > (?, ?)")
+        args += list(after)
+    return (" WHERE " + " AND ".join(where) if where else ""), args
+
+
+class Deck:
+    def __init__(self, name, side, units, id=None, cost=None):
+        self.id = id
+        self.name = name
+        self.side = side
+        self.units = list(units)
+        # Cost stored in the armoury, None for a deck that isn't in it yet
+        self.stored_cost = cost
+
+    @property
+    def cost(self):
+        # Stored decks keep the cost they are listed (and paged) by, even
+        # after unit costs changed
+        if self.stored_cost is not None:
+            return self.stored_cost
+        return army_cost(self.units)
+
+    def problems(self):
+        # Reasons the deck can't be played with today's unit types, [] if none
+        return deck_problems(self.name, self.side, self.units)
+
+    def to_json(self):
+        return {'name': self.name, 'side': self.side, 'units': "".join(self.units)}
+
+    def describe(self):
+        line = f"{self.name:<{NAME_LENGTH}} {self.side}  {len(self.units)} units {self.cost:>3} pts  {''.join(self.units)}"
+        return line + ("  (invalid)" if self.problems() else "")
+
+
+class Armoury:
+    def __init__(self, path=DEFAULT_DB):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute("SELECT count(*) FROM decks").fetchone()[0]
+
+    def add(self, deck):
+        with self.db:
+            return self.insert(deck)
+
+    def insert(self, deck):
+        # add() without committing, for adding many decks in one transaction
+        problems = deck.problems()
+        if problems:
+            raise DeckError(f"{deck.name}: " + " ".join(problems))
+        try:
+            cur = self.db.execute("INSERT INTO decks (name, side, cost, units) VALUES (?, ?, ?, ?)",
+                                  (deck.name, deck.side, deck.cost, "".join(deck.units)))
+        except sqlite3.IntegrityError:
+            raise DeckError(f"There is already a deck called {deck.name}.") from None
+        deck.id = cur.lastrowid
+        deck.stored_cost = deck.cost
+        return deck
+
+    def get(self, name):
+        # Deck called `name`, None if there is none
+        row = self.db.execute("SELECT id, name, side, units, cost FROM decks WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        id, name, side, units, cost = row
+        return Deck(name, side, units, id, cost)
+
+    def delete(self, name):
+        # False if there was no such deck
+        with self.db:
+            return self.db.execute("DELETE FROM decks WHERE name = ?", (name,)).rowcount > 0
+
+    def page(self, side=None, min_cost=None, max_cost=None, prefix=None, after=None, size=PAGE_SIZE):
+        # Up to `size` decks ordered by (cost, name), starting after the
+        # (cost, name) `after` (None: from the start)
+        where, args = deck_filter(side, min_cost, max_cost, prefix, after)
+        sql = "SELECT id, name, side, units, cost FROM decks" + where + " ORDER BY cost, name LIMIT ?"
+        rows = self.db.execute(sql, args + [size]).fetchall()
+        return [Deck(name, side, units, id, cost) for id, name, side, units, cost in rows]
+
+    def key_at(self, position, side=None, min_cost=None, max_cost=None, prefix=None):
+        # (cost, name) of the deck at `position` (from 0) of the listing,
+        # None if there are fewer decks. Only the (cost, name) index is read
+        where, args = deck_filter(side, min_cost, max_cost, prefix)
+        sql = "SELECT cost, name FROM decks" + where + " ORDER BY cost, name LIMIT 1 OFFSET ?"
+        return self.db.execute(sql, args + [position]).fetchone()
+
+    def decks(self, side=None, min_cost=None, max_cost=None, prefix=None, page_size=PAGE_SIZE):
+        # All matching decks, fetched a page at a time as they are used
+        after = None
+        while True:
+            page = self.page(side, min_cost, max_cost, prefix, after, page_size)
+            yield from page
+            if len(page) < page_size:
+                return
+            after = (page[-1].cost, page[-1].name)
+
+    def export_file(self, path, **filters):
+        decks = [deck.to_json() for deck in self.decks(**filters, page_size=1000)]
+        with open(path, 'w') as f:
+            json.dump(decks, f, indent=1)
+        return len(decks)
+
+    def import_file(self, path):
+        # Add the decks of an export file, (number added, problems of the others)
+        with open(path) as f:
+            entries = json.load(f)
+        if not isinstance(entries, list):
+            raise DeckError(f"{path}: not a deck list")
+        added, problems = 0, []
+        with self.db:
+            for i, entry in enumerate(entries):
+                try:
+                    deck = Deck(str(entry['name']), str(entry['side']), str(entry['units']))
+                except (KeyError, TypeError):
+                    problems.append(f"Entry {i}: needs a name, side and units.")
+                    continue
+                try:
+                    self.insert(deck)
+                    added += 1
+                except DeckError as e:
+                    problems.append(str(e))
+        return added, problems
+
+
+def army(armoury, name):
+    # Unit kinds of the deck `name`, for Engine. Decks are checked again as
+    # unit types and ARMY_POINTS may have changed since they were added
+    deck = armoury.get(name)
+    if deck is None:
+        raise DeckError(f"No deck called {name} in the armoury.")
+    problems = deck.problems()
+    if problems:
+        raise DeckError(f"{deck.name}: " + " ".join(problems))
+    return deck.units
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep the decks (army lists) of ASCII Battle.")
+    parser.add_argument("--db", default=DEFAULT_DB, help="armoury file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    listing = commands.add_parser("list", help="list decks, cheapest first")
+    listing.add_argument("--side", choices=NATIONS)
+    listing.add_argument("--min-cost", type=int)
+    listing.add_argument("--max-cost", type=int)
+    listing.add_argument("--name", help="names starting with this")
+    listing.add_argument("--page", type=int, default=1, help=f"page of {PAGE_SIZE} decks")
+    show = commands.add_parser("show", help="show a deck's units")
+    show.add_argument("name")
+    add = commands.add_parser("add", help="add a deck")
+    add.add_argument("name")
+    add.add_argument("side", choices=NATIONS)
+    add.add_argument("units", help=f"unit kinds, e.g. '>XOTmR' (one of {''.join(UNIT_TYPES)} each)")
+    delete = commands.add_parser("delete", help="delete a deck")
+    delete.add_argument("name")
+    export = commands.add_parser("export", help="write decks to a JSON file")
+    export.add_argument("file")
+    export.add_argument("--side", choices=NATIONS)
+    importing = commands.add_parser("import", help="add the decks of a JSON file")
+    importing.add_argument("file")
+    args = parser.parse_args(argv)
+
+    armoury = Armoury(args.db)
+    try:
+        if args.command == "list":
+            filters = dict(side=args.side, min_cost=args.min_cost, max_cost=args.max_cost, prefix=args.name)
+            decks = []
+            if args.page == 1:
+                decks = armoury.page(**filters)
+            elif args.page > 1:
+                # Seek to the deck just before the page, then list on from it
+                after = armoury.key_at((args.page - 1) * PAGE_SIZE - 1, **filters)
+                if after is not None:
+                    decks = armoury.page(**filters, after=after)
+            for deck in decks:
+                print(deck.describe())
+            if not decks:
+                print("No decks.")
+        elif args.command == "show":
+            deck = armoury.get(args.name)
+            if deck is None:
+                parser.exit(1, f"No deck called {args.name}.\n")
+            print(deck.describe())
+            for kind in deck.units:
+                un = UNIT_TYPES.get(kind)
+                if un is None:
+                    print(f"  [{kind}] unknown unit type")
+                    continue
+                print(f"  [{kind}] {un['name']:<12} {un['cost']} pts  hp {un['hp']}  armor {un['arm']}  move {un['move']}")
+            for problem in deck.problems():
+                print(f"  invalid: {problem}")
+        elif args.command == "add":
+            armoury.add(Deck(args.name, args.side, args.units))
+            print(f"Added {args.name} ({army_cost(args.units)} of {ARMY_POINTS} points).")
+        elif args.command == "delete":
+            if not armoury.delete(args.name):
+                parser.exit(1, f"No deck called {args.name}.\n")
+            print(f"Deleted {args.name}.")
+        elif args.command == "export":
+            n = armoury.export_file(args.file, side=args.side)
+            print(f"Wrote {n} decks to {args.file}.")
+        elif args.command == "import":
+            added, problems = armoury.import_file(args.file)
+            print(f"Added {added} decks from {args.file}.")
+            for problem in problems:
+                print(f"  skipped: {problem}")
+    except (DeckError, OSError, ValueError) as e:
+        parser.exit(1, f"{e}\n")
+    finally:
+        armoury.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,29 +1,58 @@
 #!/usr/bin/env python3
 """
 Small hot-seat 2-player ASCII turn-based battle game using curses.
-Save as ascii_battle.py and run with `python3 ascii_battle.py`.
+Save as ascii_battle.py and run with
+`python3 ascii_battle.py [--ai] [--record FILE] [--load SAVE] [--deck1 NAME] [--deck2 NAME] [map [elevation]]`
+(a compiled .map file needs no elevation file). With --ai the computer
+(ai.py) plays player 2, --record logs the match for replay.py, --load
+continues a match saved with s (savegame.py) and --deck1/--deck2 field
+decks from the armoury (armoury.py) instead of the default armies.
 
 Controls (hot-seat):
  - Arrow keys: move cursor
  - Enter/Space: select/deselect a unit
- - m: move selected unit to cursor (if legal)
- - a: attack an adjacent enemy from selected unit to the cursor cell
+ - m: move selected unit to cursor (if legal), dropping its order if any
+ - o: order the selected unit to the cursor, however far: it moves along
+   the route (Pathfinder.route) as far as it gets now and at the start of
+   each of your turns until it is there or can't get any closer
+ - a: attack the enemy under the cursor with the selected unit (the info
+   panel shows the chance to hit and the damage, see combat.py)
  - e: end turn
+ - u: take back the last move, attack or (against --ai) turn
+ - s / l: quicksave to / quickload from QUICKSAVE
  - q: quit
 
 Notes:
  - Player 1 units are shown as uppercase letters and use color pair 1.
  - Player 2 units are shown as lowercase letters and use color pair 2.
- - This is intentionally small and self-contained.
+ - The rules live in engine.py, this file is only the curses front end.
+ - Maps larger than the terminal scroll with the cursor; terrain is baked
+   in chunks around the camera (see chunks.py), so drawing costs follow
+   the terminal size. The rules' map layers still cover the whole map.
 """
 
+import argparse
 import curses
-import random
 import sys
 
+import numpy as np
+
+import savegame
+from ai import search_policy
+from armoury import DEFAULT_DB, Armoury, DeckError, army
+from chunks import CHUNK_SIZE, ChunkCache
+from engine import (ARMY_P1, ARMY_P2, COMBAT, Battlefield, Engine, TERRAIN_TYPES, WEAPON_SYSTEM_TYPES,
+                    COLOR_WATER, COLOR_GRASS, COLOR_FOREST, COLOR_ROAD, COLOR_BUILDING, COLOR_SHRUB)
+from renderer import Renderer
+from replay import ReplayLog
+
 # Game settings
-WIDTH = 35
-HEIGHT = 15
+MAP_FILE = "map3.txt"
+ELEV_FILE = "elevation2.txt"
+FOG_OF_WAR = True
+AI_BUDGET_MS = 300      # thinking time per turn of the --ai opponent
+UNDO_DEPTH = 100        # actions that can be taken back
+QUICKSAVE = "quicksave" + savegame.SAVE_EXT
 
 # Colors (indices for curses)
 COLOR_P1 = 1
@@ -32,121 +61,56 @@ COLOR_CURSOR = 3
 COLOR_HIGHLIGHT = 4
 COLOR_ERROR = 99
 
-# Terrain color indices (+ NUMBER OF ELEVATION LEVELS (5))
-COLOR_WATER = 5
-COLOR_GRASS = 10
-COLOR_FOREST = 15
-COLOR_ROAD = 20
-COLOR_FIELD = 25
-COLOR_BUILDING = 30
-COLOR_SHRUB = 35
-
 # Elevation levels:
 COLOR_L0 = 110
 COLOR_L1 = 111
 COLOR_L2 = 112
 COLOR_L3 = 113
 COLOR_L4 = 114
-
-
-# Unit definitions
-"""
-size: 1-10 ? (relevant for transport cargo/troops and spotting via optics)
-arm: armor
-optics: range 1-3 (bad-medium-good)
-ws1 & ws2: weapon systems index (look at WEAPON_SYSTEM_TYPES)
-"""
-UNIT_TYPES = {
-    'X': { 'name': 'Infantry',      'size':2,   'hp': 6, 'arm': 0,   'move': 2,  'flying': False,  'amph': False, 'ws1': 1, 'ws2': 2, 'ws1_ammo': 0, 'ws2_ammo': 0, 'optics': 1 },
-    'T': { 'name': 'Tank',          'size':5,   'hp': 6, 'arm': 4,   'move': 2,  'flying': False,  'amph': False, 'ws1': 5, 'ws2': 3, 'ws1_ammo': 0, 'ws2_ammo': 0, 'optics': 1  },
-    '>': { 'name': 'Atk. Helo',     'size':7,   'hp': 5, 'arm': 1,   'move': 4,  'flying': True,   'amph': False, 'ws1': 4, 'ws2': 0, 'ws1_ammo': 0, 'ws2_ammo': 0, 'optics': 3  },
-    'O': { 'name': 'APC',           'size':5,   'hp': 6, 'arm': 2,   'move': 3,  'flying': False,  'amph': True , 'ws1': 4, 'ws2': 0, 'ws1_ammo': 0, 'ws2_ammo': 0, 'optics': 1 },
-    'R': { 'name': 'Recon',         'size':1,   'hp': 4, 'arm': 0,   'move': 3,  'flying': False,  'amph': False, 'ws1': 1, 'ws2': 2, 'ws1_ammo': 0, 'ws2_ammo': 0, 'optics': 3  },
-    'm': { 'name': 'Mortar',        'size':3,   'hp': 4, 'arm': 0,   'move': 1,  'flying': False,  'amph': False, 'ws1': 6, 'ws2': 0, 'ws1_ammo': 0, 'ws2_ammo': 0, 'optics': 2 },    # lahko dodamo radio operaterja kasneje k mortarju doda optics + range
-    'C': { 'name': 'Cargo Truck',   'size':4,   'hp': 4, 'arm': 0,   'move': 3,  'flying': False,  'amph': False, 'ws1': 0, 'ws2': 0, 'ws1_ammo': 0, 'ws2_ammo': 0, 'optics': 1  },
-    'A': { 'name': 'AA Gun',        'size':5,   'hp': 5, 'arm': 2,   'move': 2,  'flying': False,  'amph': False, 'ws1': 7, 'ws2': 7, 'ws1_ammo': 0, 'ws2_ammo': 0, 'optics': 2  },
-}
-
-# Weapon systems definitions
-WEAPON_SYSTEM_TYPES = {
-    0 : { 'name': '/',              'arm_pen': 0,  'dmg_val': 0, 'att_range': 0,   'ammo': 0,  'antiair': False },
-    1 : { 'name': 'Small Arms',     'arm_pen': 1,  'dmg_val': 2, 'att_range': 2,   'ammo': 5,  'antiair': False },
-    2 : { 'name': 'AT Rocket',      'arm_pen': 5,  'dmg_val': 3, 'att_range': 2,   'ammo': 1,  'antiair': False },
-    3 : { 'name': 'Light MG',       'arm_pen': 1,  'dmg_val': 2, 'att_range': 3,   'ammo': 4,  'antiair': False },
-    4 : { 'name': 'Heavy MG',       'arm_pen': 2,  'dmg_val': 3, 'att_range': 4,   'ammo': 4,  'antiair': False },
-    5 : { 'name': 'Cannon',         'arm_pen': 5,  'dmg_val': 3, 'att_range': 5,   'ammo': 4,  'antiair': False },
-    6 : { 'name': 'Heavy Mortar',   'arm_pen': 4,  'dmg_val': 6, 'att_range': 10,  'ammo': 3,  'antiair': False }, 
-    7 : { 'name': 'MANPADS',        'arm_pen': 4,  'dmg_val': 5, 'att_range': 10,  'ammo': 3,  'antiair': True }, 
+ELEVATION_LEVELS = 5
+
+# (foreground, background) per terrain color, background None = elevation shade
+TERRAIN_FG = {
+    COLOR_GRASS:    (22, None),
+    COLOR_FOREST:   (22, None),
+    COLOR_ROAD:     (142, None),
+    COLOR_SHRUB:    (22, None),
+    COLOR_WATER:    (28, 39),
+    COLOR_BUILDING: (52, 130),
 }
-
-# Terrain definitions
-TERRAIN_TYPES = {
-    '.': { 'name': 'Open terrain',  'cover_lvl': 0, 'conceal': 0, 'mov_cost': 1, 'el_height': 0,  'pass': True,   'los': True },
-    'f': { 'name': 'Light Woods',   'cover_lvl': 1, 'conceal': 2, 'mov_cost': 2, 'el_height': 1,  'pass': True,   'los': False },
-    '+': { 'name': 'Road',          'cover_lvl': 0, 'conceal': 0, 'mov_cost': 1, 'el_height': 0,  'pass': True,   'los': True },
-    '~': { 'name': 'Water',         'cover_lvl': 0, 'conceal': 0, 'mov_cost': 0, 'el_height': 0,  'pass': False,  'los': True },
-    'F': { 'name': 'Heavy Woods',   'cover_lvl': 2, 'conceal': 3, 'mov_cost': 2, 'el_height': 1,  'pass': True,   'los': False },
-    'H': { 'name': 'House',         'cover_lvl': 2, 'conceal': 4, 'mov_cost': 2, 'el_height': 1,  'pass': True,   'los': False },
-    '*': { 'name': 'Shrubbery',     'cover_lvl': 0, 'conceal': 1, 'mov_cost': 1, 'el_height': 0,  'pass': True,   'los': False },
-}
-
-# Army starting positions
-START_POSITIONS_P1 = [(1,1),(1,3),(1,5),(2,2),(2,4),(2,7)]
-START_POSITIONS_P2 = [(WIDTH-2,HEIGHT-2),(WIDTH-2,HEIGHT-4),(WIDTH-2,2),(WIDTH-3,3),(WIDTH-3,5),(WIDTH-3,1)]
-
-ARMY_P1 = [">","X","O","T","m","R"]
-ARMY_P2 = ["X","X","T","O","X","X"]
-
-
-class Unit:
-    def __init__(self, x, y, owner, kind):
-        un = UNIT_TYPES[kind]
-        self.x = x
-        self.y = y
-        self.owner = owner  # 1 or 2
-        self.kind = kind   # character symbol
-        self.name = un['name']
-        self.max_hp = un['hp'] 
-        self.hp = self.max_hp
-        self.arm = un['arm']
-
-        self.move_range = un['move']
-        self.amph = un['amph']
-        self.flying = un['flying']
-
-        self.ws1 = un['ws1']
-        self.ws2 = un['ws2']
-        self.ws1_ammo = WEAPON_SYSTEM_TYPES[self.ws1]['ammo']
-        self.ws2_ammo = WEAPON_SYSTEM_TYPES[self.ws2]['ammo']
-       
-        # At some point se lahko doda action points system in cost-per-action/movement
-        self.moved = False
-        self.acted = False
-
-    def is_alive(self):
-        return self.hp > 0
-
-    def distance_to(self, x, y):
-        return abs(self.x - x) + abs(self.y - y)
-    
-    def display_ammo(self, ws_ammo):
-        ammo = ""
-        for i in range(ws_ammo):
-            ammo+="|"
-        return ammo
+ELEVATION_BG = [46, 40, 34, 28, 22]
 
 
 class Game:
-    def __init__(self, stdscr):
+    def __init__(self, stdscr, field, ai=None, record=None, engine=None, armies=(ARMY_P1, ARMY_P2)):
         self.stdscr = stdscr
+        self.engine = engine or Engine(field, *armies)
+        self.ai = ai    # policy playing player 2, None for hot-seat
+        self.record = record
+        # (engine clone, replay log position, orders) before each action, for take-back
+        self.undo = []
+        self.orders = {}    # unit index -> (x, y) it is heading for over several turns
+        if record and not engine:
+            # A restart starts the log over
+            ReplayLog(record, self.engine)
         self.cursor_x = 0
         self.cursor_y = 0
-        self.turn = 1
-        self.units = []
         self.selected = None
         self.message = "Welcome to ASCII Battle!"
         self.init_colors()
-        self.populate_units()
+        self.pairs = {}
+        self.terrain_chunks = ChunkCache(self.bake_chunk)
+        self.renderer = Renderer(stdscr, self.engine.width, self.engine.height,
+                                 curses.color_pair(COLOR_CURSOR), curses.color_pair(COLOR_HIGHLIGHT))
+
+    @property
+    def turn(self):
+        return self.engine.turn
+
+    @property
+    def viewer(self):
+        # Player whose view of the map is drawn and whose units can be selected
+        return self.engine.turn
 
     def init_colors(self):
         curses.start_color()
@@ -162,243 +126,152 @@ class Game:
         curses.init_pair(COLOR_P2, 0, 6)
 
         # Elevation colors
-        curses.init_pair(COLOR_L0, -1, 46)
-        curses.init_pair(COLOR_L1, -1, 40)
-        curses.init_pair(COLOR_L2, -1, 34)
-        curses.init_pair(COLOR_L3, -1, 28)
-        curses.init_pair(COLOR_L4, -1, 22)
-
-        # Terrain colors
-        curses.init_pair(COLOR_GRASS, 22, -1)
-        curses.init_pair(COLOR_FOREST, 22, -1)
-        curses.init_pair(COLOR_ROAD, 142, -1)
-        curses.init_pair(COLOR_WATER, 28, 39)
-        curses.init_pair(COLOR_BUILDING, 52, 130)
-
-        # Init color combinations (terrain + elevation)
-        curses.init_pair(COLOR_L0+COLOR_GRASS, 22, 46)
-        curses.init_pair(COLOR_L1+COLOR_GRASS, 22, 40)
-        curses.init_pair(COLOR_L2+COLOR_GRASS, 22, 34)
-        curses.init_pair(COLOR_L3+COLOR_GRASS, 22, 28)
-        curses.init_pair(COLOR_L4+COLOR_GRASS, 22, 22)
-        curses.init_pair(COLOR_L0+COLOR_FOREST, 22, 46)
-        curses.init_pair(COLOR_L1+COLOR_FOREST, 22, 40)
-        curses.init_pair(COLOR_L2+COLOR_FOREST, 22, 34)
-        curses.init_pair(COLOR_L3+COLOR_FOREST, 22, 28)
-        curses.init_pair(COLOR_L4+COLOR_FOREST, 22, 22)
-        curses.init_pair(COLOR_L0+COLOR_ROAD, 142, 46)
-        curses.init_pair(COLOR_L1+COLOR_ROAD, 142, 40)
-        curses.init_pair(COLOR_L2+COLOR_ROAD, 142, 34)
-        curses.init_pair(COLOR_L3+COLOR_ROAD, 142, 28)
-        curses.init_pair(COLOR_L4+COLOR_ROAD, 142, 22)
-        curses.init_pair(COLOR_L0+COLOR_SHRUB, 22, 46)
-        curses.init_pair(COLOR_L1+COLOR_SHRUB, 22, 40)
-        curses.init_pair(COLOR_L2+COLOR_SHRUB, 22, 34)
-        curses.init_pair(COLOR_L3+COLOR_SHRUB, 22, 28)
-        curses.init_pair(COLOR_L4+COLOR_SHRUB, 22, 22)
-
-
-    def populate_units(self):
-        # Place units for each side: P1 on left, P2 on right
-        i = 0
-        for x,y in START_POSITIONS_P1:
-            self.units.append(Unit(x,y,1,ARMY_P1[i]))
-            i+=1
-        i = 0
-        for x,y in START_POSITIONS_P2:
-            self.units.append(Unit(x,y,2,ARMY_P2[i]))
-            i=i+1
+        for level, bg in enumerate(ELEVATION_BG):
+            curses.init_pair(COLOR_L0+level, -1, bg)
+
+        # Terrain colors + color combinations (terrain + elevation)
+        for color, (fg, bg) in TERRAIN_FG.items():
+            curses.init_pair(color, fg, -1 if bg is None else bg)
+            if bg is None:
+                for level, elev_bg in enumerate(ELEVATION_BG):
+                    curses.init_pair(COLOR_L0+level+color, fg, elev_bg)
+
+    def bake_chunk(self, cx, cy):
+        # Resolve every cell of a map chunk to its (char, attr) once, draw() only indexes this
+        field = self.engine.field
+        rows = slice(cy*CHUNK_SIZE, (cy+1)*CHUNK_SIZE)
+        cols = slice(cx*CHUNK_SIZE, (cx+1)*CHUNK_SIZE)
+        terrain = field.terrain[rows, cols]
+        colors = terrain_colors(terrain, field.elevation[rows, cols])
+        for n in set(colors.ravel().tolist()) - self.pairs.keys():
+            self.pairs[n] = curses.color_pair(n)
+        pairs = self.pairs
+        return [[(chr(c), pairs[n]) for c, n in zip(t_row, c_row)]
+                for t_row, c_row in zip(terrain.tolist(), colors.tolist())]
 
     def unit_at(self, x, y):
-        for u in self.units:
-            if u.is_alive() and u.x == x and u.y == y:
-                return u
-        return None
+        return self.engine.unit_at(x, y)
+
+    def visible_unit_at(self, x, y):
+        # Like unit_at, but enemy units the current player has not spotted stay hidden
+        u = self.engine.unit_at(x, y)
+        if u and u.owner != self.viewer and FOG_OF_WAR and not self.engine.is_spotted(self.viewer, x, y):
+            return None
+        return u
 
     def draw(self):
-        self.stdscr.clear()
-        # Draw border
-        for y in range(HEIGHT+2):
-            for x in range(WIDTH+2):
-                if y==0 or y==HEIGHT+1:
-                    ch = '-'
-                elif x==0 or x==WIDTH+1:
-                    ch = '|'
-                else:
-                    ch = ' '
-                self.stdscr.addch(y, x, ch)
-
-        # Draw terrain features and/or units
-        for y in range(HEIGHT):
-            for x in range(WIDTH):
-                screen_x = x+1
-                screen_y = y+1
-                u = self.unit_at(x,y)
-                
-                # Unit layer
-                if u and u.is_alive():
-                    if u.owner == 1:
-                        attr = curses.color_pair(COLOR_P1)
-                    else:
-                        attr = curses.color_pair(COLOR_P2)
-                    ch = u.kind
-                    self.stdscr.addch(screen_y, screen_x, ch, attr)
-                    
-                # Terrain layer
-                else:
-                    #self.stdscr.addch(screen_y, screen_x, map[y][x])
-                    if map[y][x] == '.' and elev[y][x] == '0':
-                        attr = curses.color_pair(COLOR_GRASS+COLOR_L0)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-                    elif map[y][x] == '.' and elev[y][x] == '1':
-                        attr = curses.color_pair(COLOR_GRASS+COLOR_L1)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-                    elif map[y][x] == '.' and elev[y][x] == '2':
-                        attr = curses.color_pair(COLOR_GRASS+COLOR_L2)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-                    elif map[y][x] == '.' and elev[y][x] == '3':
-                        attr = curses.color_pair(COLOR_GRASS+COLOR_L3)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-                    elif map[y][x] == '.' and elev[y][x] == '4':
-                        attr = curses.color_pair(COLOR_GRASS+COLOR_L4)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-
-
-                    elif (map[y][x] == 'f' or map[y][x] == 'F') and elev[y][x] == '0':
-                        attr = curses.color_pair(COLOR_FOREST+COLOR_L0)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-                    elif (map[y][x] == 'f' or map[y][x] == 'F') and elev[y][x] == '1':
-                        attr = curses.color_pair(COLOR_FOREST+COLOR_L1)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-                    elif (map[y][x] == 'f' or map[y][x] == 'F') and elev[y][x] == '2':
-                        attr = curses.color_pair(COLOR_FOREST+COLOR_L2)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-                    elif (map[y][x] == 'f' or map[y][x] == 'F') and elev[y][x] == '3':
-                        attr = curses.color_pair(COLOR_FOREST+COLOR_L3)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-                    elif (map[y][x] == 'f' or map[y][x] == 'F') and elev[y][x] == '4':
-                        attr = curses.color_pair(COLOR_FOREST+COLOR_L4)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-
-                    elif map[y][x] == '+' and elev[y][x] == '0':
-                        attr = curses.color_pair(COLOR_ROAD+COLOR_L0)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-                    elif map[y][x] == '+' and elev[y][x] == '1':
-                        attr = curses.color_pair(COLOR_ROAD+COLOR_L1)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-                    elif map[y][x] == '+' and elev[y][x] == '2':
-                        attr = curses.color_pair(COLOR_ROAD+COLOR_L2)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-                    elif map[y][x] == '+' and elev[y][x] == '3':
-                        attr = curses.color_pair(COLOR_ROAD+COLOR_L3)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-                    elif map[y][x] == '+' and elev[y][x] == '4':
-                        attr = curses.color_pair(COLOR_ROAD+COLOR_L4)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-
-                    elif map[y][x] == '*' and elev[y][x] == '0':
-                        attr = curses.color_pair(COLOR_SHRUB+COLOR_L0)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-                    elif map[y][x] == '*' and elev[y][x] == '1':
-                        attr = curses.color_pair(COLOR_SHRUB+COLOR_L1)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-                    elif map[y][x] == '*' and elev[y][x] == '2':
-                        attr = curses.color_pair(COLOR_SHRUB+COLOR_L2)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-                    elif map[y][x] == '*' and elev[y][x] == '3':
-                        attr = curses.color_pair(COLOR_SHRUB+COLOR_L3)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-                    elif map[y][x] == '*' and elev[y][x] == '4':
-                        attr = curses.color_pair(COLOR_SHRUB+COLOR_L4)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-
-                    elif map[y][x] == '"':
-                        attr = curses.color_pair(COLOR_FIELD)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-                    elif map[y][x] == 'H':
-                        attr = curses.color_pair(COLOR_BUILDING)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-                    elif map[y][x] == '~':
-                        attr = curses.color_pair(COLOR_WATER)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-
-                    else:
-                        attr = curses.color_pair(COLOR_ERROR)
-                        self.stdscr.addch(screen_y, screen_x, map[y][x], attr)
-        
-        # Highlight selected unit's possible moves
-        if self.selected:
-            for y in range(HEIGHT):
-                for x in range(WIDTH):
-                    if self.selected.distance_to(x,y) <= self.selected.move_range:
-                        # Skip occupied by other unit
-                        if not self.unit_at(x,y):
-                            sx = x+1; sy = y+1
-                            try:
-                                self.stdscr.addch(sy,sx,'x', curses.color_pair(COLOR_HIGHLIGHT))
-                            except curses.error:
-                                pass
-
-        # Draw cursor (invert cell)
-        cx = self.cursor_x+1
-        cy = self.cursor_y+1
-        try:
-            ch = chr(self.stdscr.inch(cy, cx) & 0xFF)
-        except curses.error:
-            ch = ' '
-        self.stdscr.addch(cy, cx, ch, curses.color_pair(COLOR_CURSOR))
-
-        # Info panel
-        info_y = 0
-        info_x = WIDTH + 4
-        self.stdscr.addstr(info_y, info_x, f"Turn: Player {self.turn}")
-        self.stdscr.addstr(info_y+1, info_x, f"Cursor: ({self.cursor_x},{self.cursor_y})")
-        self.stdscr.addstr(info_y+2, info_x, f"Terrain: {TERRAIN_TYPES[map[self.cursor_y][self.cursor_x]]['name']}")
-        self.stdscr.addstr(info_y+3, info_x, f"Elevation: {elev[self.cursor_y][self.cursor_x]} (+{TERRAIN_TYPES[map[self.cursor_y][self.cursor_x]]['el_height']} per terrain)" )
-        self.stdscr.addstr(info_y+4, info_x, f"------------------------------------")
-        u = self.unit_at(self.cursor_x, self.cursor_y)
+        e = self.engine
+        for x, y in e.dirty:
+            self.renderer.mark(x, y)
+        e.dirty.clear()
+        for i in e.visibility.take_changed(self.viewer):
+            self.renderer.mark(i % e.width, i // e.width)
+        self.renderer.draw(self)
+
+    def cell_look(self, x, y):
+        # (char, attr) of a map cell without cursor/highlight overlays
+        e = self.engine
+        i = y*e.width + x
+        u = e.occupancy.cells.get(i)
+
+        # Unit layer, enemies only once spotted
+        viewer = self.viewer
+        if u and (u.owner == viewer or not FOG_OF_WAR or e.visibility.spotted[viewer][i]):
+            if u.owner == 1:
+                attr = curses.color_pair(COLOR_P1)
+            else:
+                attr = curses.color_pair(COLOR_P2)
+            return u.kind, attr
+
+        # Terrain layer, dimmed where the current player can't see
+        ch, attr = self.terrain_chunks.get(x, y)
+        if FOG_OF_WAR and not e.visibility.seen[viewer][i]:
+            attr |= curses.A_DIM
+        return ch, attr
+
+    def overlay(self):
+        # Selected unit's reachable cells, plus the route to the cursor if it is one of them
+        # and the cell its order is heading for
+        u = self.selected
+        if not u:
+            return {}
+        cells = {}
+        if not u.moved:
+            reach = self.engine.reachable(u)
+            cells = dict.fromkeys(reach.cells, 'x')
+            if reach.can_reach(self.cursor_x, self.cursor_y):
+                for cell in reach.path_to(self.cursor_x, self.cursor_y):
+                    cells[cell] = 'o'
+        order = self.orders.get(u.index)
+        if order:
+            cells[order] = '*'
+        return cells
+
+    def info_lines(self):
+        lines = [
+            f"Turn: Player {self.turn}",
+            f"Cursor: ({self.cursor_x},{self.cursor_y})",
+            f"Terrain: {TERRAIN_TYPES[self.engine.field.terrain_at(self.cursor_x, self.cursor_y)]['name']}",
+            f"Elevation: {self.engine.elevation[self.cursor_y, self.cursor_x]} (+{TERRAIN_TYPES[self.engine.field.terrain_at(self.cursor_x, self.cursor_y)]['el_height']} per terrain)",
+            f"------------------------------------",
+        ]
+        u = self.visible_unit_at(self.cursor_x, self.cursor_y)
 
         if u:
-            self.stdscr.addstr(info_y+5, info_x, f"Unit: {'Player1' if u.owner==1 else 'Player2'} [ {u.kind} ] ({u.name})")
-            self.stdscr.addstr(info_y+6, info_x, f"HP: {u.hp}/{u.max_hp}    ARMOR: {u.arm}")
-            self.stdscr.addstr(info_y+7, info_x, f"MOVEMENT: {u.move_range}")
-            self.stdscr.addstr(info_y+8, info_x, f"------------------------------------")
-            self.stdscr.addstr(info_y+9, info_x, f"[1. WPN]: {WEAPON_SYSTEM_TYPES[u.ws1]['name']} (range: {WEAPON_SYSTEM_TYPES[u.ws1]['att_range']})")
-            self.stdscr.addstr(info_y+10, info_x, f"[stats]: DMG: {WEAPON_SYSTEM_TYPES[u.ws1]['dmg_val']} (Arm. Pen. = {WEAPON_SYSTEM_TYPES[u.ws1]['arm_pen']})")
-            self.stdscr.addstr(info_y+11, info_x, f"[ammo]: {u.display_ammo(u.ws1_ammo)}")
-            self.stdscr.addstr(info_y+12, info_x, f" ")
-            self.stdscr.addstr(info_y+13, info_x, f"[2. WPN]: {WEAPON_SYSTEM_TYPES[u.ws2]['name']} (range: {WEAPON_SYSTEM_TYPES[u.ws2]['att_range']})")             # tle naredi tko da če 2.wpn ne obstaja sploh ne izpisuj
-            self.stdscr.addstr(info_y+14, info_x, f"[stats]: DMG: {WEAPON_SYSTEM_TYPES[u.ws2]['dmg_val']} (Arm. Pen. = {WEAPON_SYSTEM_TYPES[u.ws2]['arm_pen']})")
-            self.stdscr.addstr(info_y+15, info_x, f"[ammo]: {u.display_ammo(u.ws2_ammo)}")
-            self.stdscr.addstr(info_y+16, info_x, f"------------------------------------")
-            self.stdscr.addstr(info_y+17, info_x, f"Moved: {u.moved}")
-            self.stdscr.addstr(info_y+18, info_x, f"Acted: {u.acted}")
+            lines += [
+                f"Unit: {'Player1' if u.owner==1 else 'Player2'} [ {u.kind} ] ({u.name})",
+                f"HP: {u.hp}/{u.max_hp}    ARMOR: {u.arm}",
+                f"MOVEMENT: {u.move_range}",
+                f"------------------------------------",
+                f"[1. WPN]: {WEAPON_SYSTEM_TYPES[u.ws1]['name']} (range: {WEAPON_SYSTEM_TYPES[u.ws1]['att_range']})",
+                f"[stats]: DMG: {WEAPON_SYSTEM_TYPES[u.ws1]['dmg_val']} (Arm. Pen. = {WEAPON_SYSTEM_TYPES[u.ws1]['arm_pen']})",
+                f"[ammo]: {u.display_ammo(u.ws1_ammo)}",
+                f" ",
+                f"[2. WPN]: {WEAPON_SYSTEM_TYPES[u.ws2]['name']} (range: {WEAPON_SYSTEM_TYPES[u.ws2]['att_range']})",             # tle naredi tko da če 2.wpn ne obstaja sploh ne izpisuj
+                f"[stats]: DMG: {WEAPON_SYSTEM_TYPES[u.ws2]['dmg_val']} (Arm. Pen. = {WEAPON_SYSTEM_TYPES[u.ws2]['arm_pen']})",
+                f"[ammo]: {u.display_ammo(u.ws2_ammo)}",
+                f"------------------------------------",
+                f"Moved: {u.moved}",
+                f"Acted: {u.acted}",
+            ]
+            order = self.orders.get(u.index) if u.owner == self.viewer else None
+            if order:
+                lines.append(f"Order: to ({order[0]},{order[1]})")
         else:
-            self.stdscr.addstr(info_y+5, info_x, "Empty")
+            lines.append("Empty")
 
         # Selected unit info
         if self.selected:
-            self.stdscr.addstr(info_y+19, info_x, f"Selected: {self.selected.name} at ({self.cursor_x},{self.cursor_y})")
-
-        # Message
-        self.stdscr.addstr(HEIGHT+3, 0, self.message[:curses.COLS-1])
-
-        # Objectives
-        ins_y = HEIGHT+5
-        self.stdscr.addstr(ins_y, 0, "[OBJECTIVE]: eliminate enemy forces")
-        self.stdscr.refresh()
-
-        # Turn instructions
-        ins_y = HEIGHT+8
-        self.stdscr.addstr(ins_y, 0, "KEYBINDS: move cursor  Enter: select  m:move  a:attack  e:end turn  q:quit")
-        self.stdscr.refresh()
+            lines += [""] * (19 - len(lines))
+            lines.append(f"Selected: {self.selected.name} at ({self.cursor_x},{self.cursor_y})")
+            if u and u.owner != self.viewer:
+                lines.append(self.odds_line(self.selected, u))
+        return lines
+
+    def odds_line(self, unit, target):
+        # Chance and damage of `unit` attacking `target` from where it stands
+        slot = self.engine.weapon_for(unit, target)
+        if slot is None:
+            return "Attack: out of range, ammo or armor"
+        i = self.engine.attack_index(unit, target, slot)
+        return f"Attack: {COMBAT.hit[i]}% to hit for {COMBAT.low[i]}-{COMBAT.high[i]} dmg"
+
+    def message_lines(self):
+        return [
+            self.message,
+            "",
+            "[OBJECTIVE]: eliminate enemy forces",
+            "",
+            "",
+            "KEYBINDS: move cursor  Enter: select  m:move  o:order  a:attack  e:end turn  u:undo  s/l:save/load  q:quit",
+        ]
 
     def select_unit(self):
         u = self.unit_at(self.cursor_x, self.cursor_y)
         if not u:
             self.message = "No unit here to select."
             return
-        if u.owner != self.turn:
+        if u.owner != self.viewer:
             self.message = "Cannot select enemy unit."
             return
         if u.moved and u.acted:
@@ -415,79 +288,139 @@ class Game:
         if not self.selected:
             self.message = "No unit selected."
             return
-        if self.selected.owner != self.turn:
-            self.message = "Selected unit does not belong to you."
-            return
-        if self.selected.moved:
-            self.message = "Selected unit already moved this turn."
+        self.checkpoint()
+        if self.engine.move(self.selected, self.cursor_x, self.cursor_y):
+            self.orders.pop(self.selected.index, None)
+        else:
+            self.undo.pop()
+        self.message = self.engine.message
+
+    def order_selected(self):
+        # Multi-turn move to the cursor, see follow_order()
+        if not self.selected:
+            self.message = "No unit selected."
             return
-        dist = self.selected.distance_to(self.cursor_x, self.cursor_y)
-        if dist > self.selected.move_range:
-            self.message = f"Target too far (dist: {dist})."
+        u = self.selected
+        x, y = self.cursor_x, self.cursor_y
+        route = self.engine.pathfinder.route(u, x, y)
+        if route is None:
+            self.message = "This unit can never get there."
             return
-        if self.unit_at(self.cursor_x, self.cursor_y):
-            self.message = "Target cell is occupied."
+        if route.cost == 0:
+            self.message = "Unit is already there."
             return
-        # perform move
-        self.selected.x = self.cursor_x
-        self.selected.y = self.cursor_y
-        self.selected.moved = True
-        self.message = f"Moved to ({self.cursor_x},{self.cursor_y})."
-
+        self.checkpoint()
+        self.orders[u.index] = (x, y)
+        self.message = f"Ordered to ({x},{y}), {route.cost} move points away."
+        if not u.moved and self.follow_order(u):
+            self.message += " " + self.engine.message
+
+    def follow_order(self, unit):
+        # Move a unit as far as it gets this turn along the route to its
+        # order's cell (Pathfinder.advance); True if it moved. The order is
+        # done once the unit is there.
+        x, y = self.orders[unit.index]
+        cell = self.engine.pathfinder.advance(unit, x, y)
+        moved = cell is not None and self.engine.move(unit, *cell)
+        if (unit.x, unit.y) == (x, y):
+            del self.orders[unit.index]
+        return moved
+
+    def follow_orders(self):
+        # Units of the player whose turn starts carry on with their orders;
+        # one that can't get any closer drops it. Returns how many moved.
+        units = self.engine.units
+        self.orders = {i: cell for i, cell in self.orders.items() if units[i].is_alive()}
+        moved = 0
+        for i in [i for i in self.orders if units[i].owner == self.turn]:
+            if self.follow_order(units[i]):
+                moved += 1
+            else:
+                self.orders.pop(i, None)
+        return moved
 
-    # NEEDS MAJOF FIXING
-    # funkcijo je treba prilagodit z novimi formulami za izračun napada:
-    # upoštevat elevation, LOS, hit chance, armor pen, cover ...
     def attack_with_selected(self):
         if not self.selected:
             self.message = "No unit selected."
             return
-        if self.selected.owner != self.turn:
-            self.message = "Selected unit does not belong to you."
+        target = self.visible_unit_at(self.cursor_x, self.cursor_y)
+        self.checkpoint()
+        if not self.engine.attack(self.selected, target):
+            self.undo.pop()
+        self.message = self.engine.message
+
+    def checkpoint(self):
+        # Remember the match before an action; a clone only copies the units
+        log = self.engine.log
+        self.undo.append((self.engine.clone(), log.mark() if log else None, dict(self.orders)))
+        del self.undo[:-UNDO_DEPTH]
+
+    def take_back(self):
+        if not self.undo:
+            self.message = "Nothing to take back."
             return
-        if self.selected.acted:
-            self.message = "Selected unit already acted this turn."
-            return
-        target = self.unit_at(self.cursor_x, self.cursor_y)
-        if not target or target.owner == self.selected.owner:
-            self.message = "No enemy at target to attack."
-            return
-        dist = self.selected.distance_to(target.x, target.y)
-        if dist > self.selected.att_range:
-            self.message = "Target out of range!"
-            return
-        # perform attack
-        dmg = random.randint(max(1,self.selected.atk-2), self.selected.atk+1)
-        target.hp -= dmg
-        self.selected.acted = True
-        self.message = f"Attacked enemy for {dmg} dmg."
-        if target.hp <= 0:
-            self.message += " Enemy died!"
+        engine, pos, self.orders = self.undo.pop()
+        if self.engine.log:
+            self.engine.log.truncate(pos)
+        engine.log = self.engine.log
+        self.switch_engine(engine)
+        self.message = "Took back the last action."
+
+    def switch_engine(self, engine):
+        # Continue with another engine of the same map (take-back, quickload)
+        self.engine = engine
+        self.selected = None
+        self.renderer.invalidate()
 
-    # TREBA DODAT FUNKCIJO ZA LOS: concealment (+elevation) VS optics range
+    def quicksave(self):
+        try:
+            savegame.save(self.engine, QUICKSAVE)
+        except (OSError, ValueError) as e:
+            self.message = f"Can't save: {e}"
+            return
+        self.message = f"Saved to {QUICKSAVE}."
 
+    def quickload(self):
+        try:
+            engine = savegame.load(QUICKSAVE, self.engine.field)
+        except (OSError, ValueError) as e:
+            self.message = f"Can't load: {e}"
+            return
+        if self.engine.log:
+            # The log can't jump to another state, it ends here
+            self.engine.log.close()
+        self.undo = []
+        self.orders = {}
+        self.switch_engine(engine)
+        self.message = f"Loaded {QUICKSAVE}."
 
     def end_turn(self):
-        # reset moved/acted flags for next player's units
-        for u in self.units:
-            if u.owner == self.turn:
-                u.moved = False
-                u.acted = False
-        # swap turn
-        self.turn = 2 if self.turn == 1 else 1
         self.selected = None
-        self.message = f"Player {self.turn}'s turn."
+        if self.ai:
+            self.checkpoint()
+        else:
+            # The next player mustn't take back what the previous one did
+            self.undo = []
+        if self.ai and not self.check_victory():
+            # The computer plays its turn in one go, the map stays in the human player's view
+            self.message = "Player 2 is thinking..."
+            self.draw()
+            self.engine.end_turn()
+            self.ai(self.engine)
+            self.engine.end_turn()
+        else:
+            self.engine.end_turn()
+        if FOG_OF_WAR and not self.ai:
+            # Whole map changes perspective
+            self.renderer.invalidate()
+        self.message = self.engine.message
+        if self.check_victory() is None:
+            moved = self.follow_orders()
+            if moved:
+                self.message += f" {moved} unit(s) followed their orders."
 
     def check_victory(self):
-        p1_alive = any(u.is_alive() and u.owner==1 for u in self.units)
-        p2_alive = any(u.is_alive() and u.owner==2 for u in self.units)
-        if not p1_alive:
-            return 2
-        if not p2_alive:
-            return 1
-        return None
-    
-        # ADD OBJECTIVES...
+        return self.engine.check_victory()
 
     def game_loop(self):
         curses.curs_set(0)
@@ -503,73 +436,119 @@ class Game:
                 if c in (ord('q'), ord('Q')):
                     return
                 if c in (ord('r'), ord('R')):
-                    self.__init__(self.stdscr)
+                    if self.engine.log:
+                        self.engine.log.close()
+                    self.__init__(self.stdscr, self.engine.field, self.ai, self.record,
+                                  armies=self.engine.armies)
                     continue
                 continue
 
-            c = self.stdscr.getch()
-            if c == curses.KEY_UP:
-                self.cursor_y = max(0, self.cursor_y-1)
-            elif c == curses.KEY_DOWN:
-                self.cursor_y = min(HEIGHT-1, self.cursor_y+1)
-            elif c == curses.KEY_LEFT:
-                self.cursor_x = max(0, self.cursor_x-1)
-            elif c == curses.KEY_RIGHT:
-                self.cursor_x = min(WIDTH-1, self.cursor_x+1)
-            elif c in (ord('\n'), ord(' ')):
-                # select/deselect
-                u = self.unit_at(self.cursor_x, self.cursor_y)
-                if self.selected and self.selected.x == self.cursor_x and self.selected.y == self.cursor_y:
-                    # toggle deselect
-                    self.deselect()
-                elif u and u.owner == self.turn:
-                    self.select_unit()
-                else:
-                    self.message = "No friendly unit here to select."
-            elif c in (ord('m'), ord('M')):
-                self.move_selected()
-            elif c in (ord('a'), ord('A')):
-                self.attack_with_selected()
-            elif c in (ord('e'), ord('E')):
-                self.end_turn()
-            elif c in (ord('q'), ord('Q')):
+            if not self.handle_key(self.stdscr.getch()):
                 return
-            elif c in (ord('h'), ord('H')):
-                self.message = "Hints: select your unit, move with m, attack adjacent enemy with a. End turn with e."
+
+    def handle_key(self, c):
+        # False when the player quits
+        if c == curses.KEY_UP:
+            self.cursor_y = max(0, self.cursor_y-1)
+        elif c == curses.KEY_DOWN:
+            self.cursor_y = min(self.engine.height-1, self.cursor_y+1)
+        elif c == curses.KEY_LEFT:
+            self.cursor_x = max(0, self.cursor_x-1)
+        elif c == curses.KEY_RIGHT:
+            self.cursor_x = min(self.engine.width-1, self.cursor_x+1)
+        elif c in (ord('\n'), ord(' ')):
+            # select/deselect
+            u = self.unit_at(self.cursor_x, self.cursor_y)
+            if self.selected and self.selected.x == self.cursor_x and self.selected.y == self.cursor_y:
+                # toggle deselect
+                self.deselect()
+            elif u and u.owner == self.viewer:
+                self.select_unit()
             else:
-                # ignore
-                pass
-
-def load_map(filename):
-    grid = []
-    with open(filename, "r") as f:
-        for line in f:
-            row = list(line.rstrip("\n"))
-            grid.append(row)
-    return grid
-
-def load_elev(filename):
-    grid = []
-    with open(filename, "r") as f:
-        for line in f:
-            row = (line.rstrip("\n")).split(",")
-            grid.append(row)
-    return grid
-
-def main(stdscr):
-    g = Game(stdscr)
-    g.game_loop()
+                self.message = "No friendly unit here to select."
+        elif c in (ord('m'), ord('M')):
+            self.move_selected()
+        elif c in (ord('o'), ord('O')):
+            self.order_selected()
+        elif c in (ord('a'), ord('A')):
+            self.attack_with_selected()
+        elif c in (ord('e'), ord('E')):
+            self.end_turn()
+        elif c in (ord('u'), ord('U')):
+            self.take_back()
+        elif c in (ord('s'), ord('S')):
+            self.quicksave()
+        elif c in (ord('l'), ord('L')):
+            self.quickload()
+        elif c in (ord('q'), ord('Q')):
+            return False
+        elif c == curses.KEY_RESIZE:
+            self.renderer.resize()
+        elif c in (ord('h'), ord('H')):
+            self.message = "Hints: select your unit, move with m, attack adjacent enemy with a. End turn with e."
+        # anything else is ignored
+        return True
+
+def terrain_colors(terrain, elevation):
+    # Color pair index per cell of a terrain (character codes) and elevation array,
+    # shaded terrain gets its elevation level's background
+    color = np.full(256, COLOR_ERROR)
+    shaded = np.zeros(256, bool)
+    for ch, t in TERRAIN_TYPES.items():
+        color[ord(ch)] = t['color']
+        shaded[ord(ch)] = t['shaded']
+    shade = shaded[terrain]
+    colors = np.where(shade, color[terrain] + COLOR_L0 + elevation, color[terrain])
+    colors[shade & ((elevation < 0) | (elevation >= ELEVATION_LEVELS))] = COLOR_ERROR
+    return colors
+
+def main(stdscr, field, ai, record, engine=None, armies=(ARMY_P1, ARMY_P2)):
+    g = Game(stdscr, field, ai, record, engine, armies)
+    try:
+        g.game_loop()
+    finally:
+        if g.engine.log:
+            g.engine.log.close()
 
 if __name__ == '__main__':
-
-    map = load_map("map3.txt")
-    #print(map)
-    elev = load_elev("elevation2.txt")
-    #print(elev)
-    #print(elev[4][7])
-
+    parser = argparse.ArgumentParser(description="Hot-seat ASCII Battle in the terminal.")
+    parser.add_argument("map", nargs="?", default=MAP_FILE, help="text map, or a compiled .map")
+    parser.add_argument("elev", nargs="?", default=ELEV_FILE, help="elevation CSV, not needed for a .map")
+    parser.add_argument("--ai", action="store_true", help="the computer plays player 2")
+    parser.add_argument("--record", metavar="FILE", help="log the match to FILE for replay.py")
+    parser.add_argument("--load", metavar="SAVE", help="continue a saved match (its map, not the arguments')")
+    parser.add_argument("--deck1", metavar="NAME", help="army of player 1 from the armoury")
+    parser.add_argument("--deck2", metavar="NAME", help="army of player 2 from the armoury")
+    parser.add_argument("--armoury", default=DEFAULT_DB, help="deck library for --deck1/--deck2")
+    args = parser.parse_args()
+    if args.load and args.record:
+        parser.error("a loaded match can't be recorded, replay logs start at turn 1")
+    armies = [ARMY_P1, ARMY_P2]
+    if args.deck1 or args.deck2:
+        armoury = Armoury(args.armoury)
+        try:
+            for i, name in enumerate((args.deck1, args.deck2)):
+                if name:
+                    armies[i] = army(armoury, name)
+        except DeckError as e:
+            sys.exit(str(e))
+        finally:
+            armoury.close()
+    ai = search_policy(AI_BUDGET_MS) if args.ai else None
+    engine = None
+    if args.load:
+        try:
+            engine = savegame.load(args.load)
+        except (OSError, ValueError) as e:
+            sys.exit(f"Can't load {args.load}: {e}")
+        field = engine.field
+    else:
+        field = Battlefield.from_files(args.map, args.elev)
+        problems = field.problems()
+        if problems:
+            sys.exit(f"{args.map} can't be played:\n" + "\n".join(problems))
     try:
-        curses.wrapper(main)
+        curses.wrapper(main, field, ai, args.record, engine, armies)
     except KeyboardInterrupt:
         print('\nGoodbye.')
         sys.exit(0)
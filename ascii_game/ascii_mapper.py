@@ -29,6 +29,10 @@ import os.path
 import json
 import sys
 
+import mapsave
+from journal import Journal
+from mapdoc import MapDoc, data_size, line_cells
+
 if sys.version_info.major >= 3:
 	from tkinter import *
 	from tkinter import ttk
@@ -48,29 +52,15 @@ Version: 1.0.1 (15 Oct 2021)
 License: MIT
 """
 
-map_width = 25
-map_height = 25
 map_filename = None
 modified = False
+version = 0		# bumped on every change, tells if a save is still current
 
-map_tiles = [[None for i in range(map_width)] for i in range(map_height)]
-
-def map_data(canvas, tiles):
-	return ["".join(canvas.itemcget(i, "text") for i in j) for j in tiles]
-
-def set_map_data(canvas, data):
-	for y in range(len(map_tiles)):
-		if y < len(data):
-			for x in range(len(map_tiles[y])):
-				t = map_tiles[y][x]
-				if x < len(data[y]):
-					char = data[y][x]
-				else:
-					char = filler
-				canvas.itemconfigure(t, text=char)
-		else:
-			for t in map_tiles[y]:
-				canvas.itemconfigure(t, text=filler)
+AUTOSAVE_MS = 30000
+autosave_rows = {"terrain": set(), "elevation": set()}	# changed since the last autosave
+autosave_all = False	# next autosave writes the whole map
+autosave_file = None	# sidecar written to so far
+autosave_bytes = 0	# written to it since it was last compacted
 
 zoom = 3
 scale = zoom * 8
@@ -80,34 +70,87 @@ map_font = "courier " + str(scale * 3 // 4) + " bold"
 
 brush = "#"
 filler = "."
+brushes = {"terrain": "#", "elevation": "1"}	# last brush used per layer
 dragging = False
+last_cell = None
+drag_start = None
+
+# The map is two aligned layers: terrain characters and elevation levels,
+# the latter as the digits 0-4 (the game's ELEVATION_LEVELS) so both are
+# edited the same way. The canvas only shows the cells currently in view,
+# using text items (and elevation shades behind them) from a pool moved
+# around as the view scrolls
+ELEVATION_LEVELS = 5
+ELEVATION_CHARS = "0123456789"[:ELEVATION_LEVELS]
+ELEVATION_SHADES = ["#e6f5e6", "#bee3be", "#96d196", "#6ebf6e", "#46ad46"]
+terrain = MapDoc(25, 25, filler)
+elevation = MapDoc(25, 25, "0")
+doc = terrain		# the layer being edited
+journal = Journal()
+terrain.journal = journal
+elevation.journal = journal
+shown = {}		# (x, y) -> (text item, shade item) showing that cell
+spare_tiles = []	# hidden item pairs, ready for reuse
+dirty_cells = set()	# changed cells not redrawn yet
+flush_pending = False
+tile_color = "black"
+grid_color = ""
+
+def map_data():
+	return terrain.data()
+
+def set_map_data(data, elevation_data=()):
+	terrain.load(data, filler)
+	elevation.load(elevation_data, "0")
+	redraw_map(viewport, True)
+
+def layer_of(d):
+	return "elevation" if d is elevation else "terrain"
+
+def layer_filler():
+	return "0" if doc is elevation else filler
 
 top = Tk()
 top.title("ASCII Mapper")
 
 grid_shown = BooleanVar() # Can only be used after calling Tk().
-
-def redraw_grid(canvas):
-	color = canvas.itemcget("grid", "fill")
+shading_shown = BooleanVar()
+tool = StringVar()
+tool.set("pencil")
+layer = StringVar()
+layer.set("terrain")
+
+def visible_cells(canvas):
+	# Map columns x0..x1-1 and rows y0..y1-1 at least partly inside the canvas window
+	left = canvas.canvasx(0)
+	upper = canvas.canvasy(0)
+	right = left + canvas.winfo_width()
+	lower = upper + canvas.winfo_height()
+	x0 = max(0, int((left - offset) // scale))
+	x1 = min(doc.width, int((right - offset) // scale) + 1)
+	y0 = max(0, int((upper - offset) // scale))
+	y1 = min(doc.height, int((lower - offset) // scale) + 1)
+	return x0, x1, y0, y1
+
+def redraw_grid(canvas, x0, x1, y0, y1):
+	# Grid lines only across the visible part of the map
 	canvas.delete("grid")
-	y1 = offset
-	y2 = offset + map_width * scale
-	for x in range(map_width + 1):
-		x1 = offset + x * scale
-		x2 = x1
+	if x0 >= x1 or y0 >= y1:
+		return
+	for x in range(x0, x1 + 1):
+		lx = offset + x * scale
 		canvas.create_line(
-			x1, y1, x2, y2,
+			lx, offset + y0 * scale, lx, offset + y1 * scale,
 			dash=".", tags="grid")
-	x1 = offset
-	x2 = offset + map_height * scale
-	for y in range(map_height + 1):
-		y1 = offset + y * scale
-		y2 = y1
+	for y in range(y0, y1 + 1):
+		ly = offset + y * scale
 		canvas.create_line(
-			x1, y1, x2, y2,
+			offset + x0 * scale, ly, offset + x1 * scale, ly,
 			dash=".", tags="grid")
-	if color != "":
-		canvas.itemconfigure("grid", fill=color)
+	if grid_color != "":
+		canvas.itemconfigure("grid", fill=grid_color)
+	canvas.tag_lower("grid")
+	set_grid_by_state(canvas)
 
 def set_grid_by_state(canvas):
 	if not grid_shown.get():
@@ -115,26 +158,99 @@ def set_grid_by_state(canvas):
 	else:
 		canvas.itemconfigure("grid", state="normal")
 
-def toggle_tile(t):
-	def do_toggle(event):
-		global modified
-		if event.widget.itemcget(t, "text") != brush:
-			event.widget.itemconfigure(t, text=brush)
-		else:
-			event.widget.itemconfigure(t, text=filler)
-		modified = True
-	return do_toggle
-
-def redraw_map(canvas):
-	canvas.delete("tile")
-	for y in range(map_height):
-		for x in range(map_width):
-			tx = offset + x * scale + scale // 2
-			ty = offset + y * scale
-			t = canvas.create_text(tx, ty, text=filler,
-				font=map_font, anchor="n", tags="tile")
-			canvas.tag_bind(t, "<1>", toggle_tile(t))
-			map_tiles[y][x] = t
+def shade_of(x, y):
+	# Background of a cell with the elevation overlay on, "" for none
+	if not shading_shown.get():
+		return ""
+	level = elevation.get(x, y)
+	if level in ELEVATION_CHARS:
+		return ELEVATION_SHADES[int(level)]
+	return ""
+
+def redraw_map(canvas, full=False):
+	# Show the visible cells. Items of cells that stay in view are left
+	# alone, the others are recycled for cells that scrolled in. Use
+	# full=True when every cell may have changed (zoom, open, resize...)
+	global shown
+	x0, x1, y0, y1 = visible_cells(canvas)
+	if full:
+		freed = list(shown.values())
+		shown = {}
+	else:
+		freed = []
+		for (x, y) in list(shown):
+			if not (x0 <= x < x1 and y0 <= y < y1):
+				freed.append(shown.pop((x, y)))
+	for y in range(y0, y1):
+		ty = offset + y * scale
+		for x in range(x0, x1):
+			if (x, y) in shown:
+				continue
+			if freed:
+				t, r = freed.pop()
+			elif spare_tiles:
+				t, r = spare_tiles.pop()
+			else:
+				r = canvas.create_rectangle(0, 0, 0, 0, width=0, tags="shade")
+				t = canvas.create_text(0, 0, font=map_font,
+					fill=tile_color, anchor="n", tags="tile")
+			tx = offset + x * scale
+			canvas.coords(t, tx + scale // 2, ty)
+			canvas.itemconfigure(t, text=doc.get(x, y), state="normal")
+			canvas.coords(r, tx, ty, tx + scale, ty + scale)
+			canvas.itemconfigure(r, fill=shade_of(x, y), state="normal")
+			shown[x, y] = (t, r)
+	for t, r in freed:
+		canvas.itemconfigure(t, state="hidden")
+		canvas.itemconfigure(r, state="hidden")
+		spare_tiles.append((t, r))
+	redraw_grid(canvas, x0, x1, y0, y1)
+	canvas.tag_lower("shade")
+
+def update_cell(canvas, x, y):
+	items = shown.get((x, y))
+	if items is not None:
+		canvas.itemconfigure(items[0], text=doc.get(x, y))
+		canvas.itemconfigure(items[1], fill=shade_of(x, y))
+
+def map_changed(rows=None, name="terrain"):
+	# rows: the rows of layer name that changed, None if it could be any
+	# row of any layer
+	global modified, version, autosave_all
+	modified = True
+	version += 1
+	if rows is None:
+		autosave_all = True
+	else:
+		autosave_rows[name].update(rows)
+
+def cells_changed(cells):
+	# Edits only touch the map; the canvas catches up once per idle
+	# callback, however many motion events came in meanwhile
+	global flush_pending
+	if len(cells) == 0:
+		return
+	map_changed([y for x, y in cells], layer_of(doc))
+	dirty_cells.update(cells)
+	if not flush_pending:
+		flush_pending = True
+		top.after_idle(flush_cells)
+
+def flush_cells():
+	global flush_pending
+	flush_pending = False
+	if len(dirty_cells) > len(shown):
+		for x, y in shown:
+			update_cell(viewport, x, y)
+	else:
+		for x, y in dirty_cells:
+			update_cell(viewport, x, y)
+	dirty_cells.clear()
+
+def set_scrollregion(canvas):
+	w = doc.width * scale + offset * 2
+	h = doc.height * scale + offset * 2
+	canvas["scrollregion"] = (0, 0, w, h)
 
 def set_zoom(canvas, z):
 	global zoom, scale, offset, map_font
@@ -142,23 +258,11 @@ def set_zoom(canvas, z):
 	zoom = max(int(z), 1)
 	scale = zoom * 8
 	offset = scale
-
-	w = map_width * scale + offset * 2
-	h = map_height * scale + offset * 2
-	canvas["scrollregion"] = (0, 0, w, h)
+	set_scrollregion(canvas)
 
 	map_font = "courier " + str(scale * 3 // 4) + " bold"
 	canvas.itemconfigure("tile", font=map_font)
-	
-	for y in range(map_height):
-		for x in range(map_width):
-			tx = offset + x * scale + scale // 2
-			ty = offset + y * scale
-			t = map_tiles[y][x]
-			canvas.coords(t, tx, ty)
-	
-	redraw_grid(canvas)
-	set_grid_by_state(canvas)
+	redraw_map(canvas, True)
 	
 	status["text"] = "Zoom level set to " + str(zoom) + "."
 
@@ -174,42 +278,95 @@ work_area = ttk.Frame(top)
 work_area.columnconfigure(0, weight=1)
 work_area.rowconfigure(0, weight=1)
 
-viewport = Canvas(work_area, scrollregion="0 0 650 650")
+viewport = Canvas(work_area)
 viewport.grid(row=0, column=0, sticky="nsew")
+set_scrollregion(viewport)
+
+def scroll_view(view):
+	# Scrollbar command that also brings the newly visible cells in
+	def do_scroll(*args):
+		view(*args)
+		redraw_map(viewport)
+	return do_scroll
 
-v_scroll = ttk.Scrollbar(work_area, orient=VERTICAL, command=viewport.yview)
+v_scroll = ttk.Scrollbar(work_area, orient=VERTICAL, command=scroll_view(viewport.yview))
 viewport["yscrollcommand"] = v_scroll.set
 v_scroll.grid(row=0, column=1, sticky="ns")
 
-h_scroll = ttk.Scrollbar(work_area, orient=HORIZONTAL, command=viewport.xview)
+h_scroll = ttk.Scrollbar(work_area, orient=HORIZONTAL, command=scroll_view(viewport.xview))
 viewport["xscrollcommand"] = h_scroll.set
 h_scroll.grid(row=1, column=0, sticky="ew")
 
-def start_dragging():
-	global dragging
+viewport.bind("<Configure>", lambda e: redraw_map(viewport))
+
+def cell_at(event):
+	# Map cell under the mouse, may be outside the map
+	x = int((event.widget.canvasx(event.x) - offset) // scale)
+	y = int((event.widget.canvasy(event.y) - offset) // scale)
+	return x, y
+
+def show_selection(canvas, a, b):
+	canvas.delete("selection")
+	canvas.create_rectangle(
+		offset + min(a[0], b[0]) * scale, offset + min(a[1], b[1]) * scale,
+		offset + (max(a[0], b[0]) + 1) * scale, offset + (max(a[1], b[1]) + 1) * scale,
+		outline="red", dash=".", tags="selection")
+
+def press_tile(event):
+	# Pencil: toggle the cell between brush and filler, then paint while
+	# dragging. Rectangle: drag out the area to fill. Fill: flood fill.
+	global dragging, last_cell, drag_start
+	x, y = cell_at(event)
+	if not doc.in_bounds(x, y):
+		return
+	journal.begin()
+	if tool.get() == "fill":
+		cells_changed(doc.flood_fill(x, y, brush))
+		journal.end()
+		return
 	dragging = True
+	last_cell = (x, y)
+	if tool.get() == "rect":
+		drag_start = (x, y)
+		show_selection(event.widget, drag_start, last_cell)
+	else:
+		char = layer_filler() if doc.get(x, y) == brush else brush
+		cells_changed(doc.paint([(x, y)], char))
 
 def paint_tiles(event):
-	global modified
+	global last_cell
+	if not dragging:
+		return
+	cell = cell_at(event)
+	if cell == last_cell:
+		return
+	if drag_start is not None:
+		show_selection(event.widget, drag_start, cell)
+	else:
+		# Motion events skip cells on fast strokes, paint the whole line
+		line = line_cells(last_cell[0], last_cell[1], cell[0], cell[1])
+		cells_changed(doc.paint(line[1:], brush))
+	last_cell = cell
+
+def stop_dragging(event):
+	global dragging, drag_start
+	if drag_start is not None:
+		event.widget.delete("selection")
+		x, y = cell_at(event)
+		cells_changed(doc.fill_rect(drag_start[0], drag_start[1], x, y, brush))
 	if dragging:
-		x = event.widget.canvasx(event.x)
-		y = event.widget.canvasy(event.y)
-		t = event.widget.find("closest", x, y)
-		event.widget.itemconfigure(t, text=brush)
-		modified = True
-
-def stop_dragging():
-	global dragging
+		journal.end()
 	dragging = False
+	drag_start = None
 
-viewport.bind("<ButtonPress-1>", lambda e: start_dragging())
+viewport.bind("<ButtonPress-1>", press_tile)
 viewport.bind("<Motion>", paint_tiles)
-viewport.bind("<ButtonRelease-1>", lambda e: stop_dragging())
+viewport.bind("<ButtonRelease-1>", stop_dragging)
 
 user_width = IntVar()
-user_width.set(25)
+user_width.set(doc.width)
 user_height = IntVar()
-user_height.set(25)
+user_height.set(doc.height)
 
 props_dlg = Toplevel(top)
 props_dlg.transient(top)
@@ -220,26 +377,53 @@ props_dlg.resizable(FALSE, FALSE)
 props_dlg.withdraw()
 
 def resize_map():
-	global map_width, map_height, map_tiles, modified
-	
-	data = map_data(viewport, map_tiles)
-	map_width = user_width.get()
-	map_height = user_height.get()
-	map_tiles = [[None for i in range(map_width)]
-		for i in range(map_height)]
-	redraw_map(viewport)
-	set_map_data(viewport, data)
-	modified = True
-	redraw_grid(viewport)
-	set_grid_by_state(viewport)
-	w = map_width * scale + offset * 2
-	h = map_height * scale + offset * 2
-	viewport["scrollregion"] = (0, 0, w, h)
+	# Both layers at once, as one step of undo
+	journal.begin()
+	terrain.resize(user_width.get(), user_height.get(), filler)
+	elevation.resize(user_width.get(), user_height.get(), "0")
+	journal.end()
+	map_changed()
+	set_scrollregion(viewport)
+	redraw_map(viewport, True)
 	props_dlg.withdraw()
 
+def edit_applied(edit):
+	# Show the map after an undo or redo, on the layer that changed
+	docs = edit.docs()
+	if doc not in docs:
+		layer.set(layer_of(docs[-1]))
+		switch_layer()
+	if edit.resized():
+		user_width.set(doc.width)
+		user_height.set(doc.height)
+		set_scrollregion(viewport)
+		map_changed()
+	elif edit.cell_count(doc) <= len(shown):
+		cells_changed(edit.cells(doc))
+		return
+	else:
+		map_changed(edit.rows(doc), layer_of(doc))
+	redraw_map(viewport, True)
+
+def undo_command():
+	edit = journal.undo()
+	if edit is None:
+		status["text"] = "Nothing to undo."
+	else:
+		edit_applied(edit)
+		status["text"] = "Undone."
+
+def redo_command():
+	edit = journal.redo()
+	if edit is None:
+		status["text"] = "Nothing to redo."
+	else:
+		edit_applied(edit)
+		status["text"] = "Redone."
+
 def cancel_resize():
-	user_width.set(map_width)
-	user_height.set(map_height)
+	user_width.set(doc.width)
+	user_height.set(doc.height)
 	props_dlg.withdraw()
 
 filename_label = ttk.Label(props_dlg, text="Filename: (untitled)")
@@ -266,7 +450,7 @@ ttk.Label(props_dlg,
 		padx=4, pady=4,
 		sticky="w")
 Spinbox(props_dlg,
-	from_=5, to=100, increment=1,
+	from_=5, to=1000, increment=1,
 	width=3,
 	textvariable=user_width).grid(row=3, column=1, padx=4, pady=4)
 ttk.Label(props_dlg,
@@ -276,7 +460,7 @@ ttk.Label(props_dlg,
 		padx=4, pady=4,
 		sticky="w")
 Spinbox(props_dlg,
-	from_=5, to=100, increment=1,
+	from_=5, to=1000, increment=1,
 	width=3,
 	textvariable=user_height).grid(row=4, column=1, padx=4, pady=4)
 
@@ -295,22 +479,55 @@ ttk.Button(
 	underline=0).pack(side=RIGHT, padx=4, pady=4)
 props_bar.grid(row=5, column=0, columnspan=2)
 
+def read_compiled(full_path):
+	# Terrain and elevation lines of a .map file, through the memory
+	# mapped arrays the game uses. Levels outside 0-4 are clamped.
+	import numpy # Only needed for compiled maps
+	import mapfile
+	codes, levels = mapfile.read_map(full_path)
+	digits = (numpy.clip(levels, 0, ELEVATION_LEVELS - 1) + ord("0")).astype(numpy.uint8)
+	data = [row.tobytes().decode("ascii") for row in codes]
+	elevation_data = [row.tobytes().decode("ascii") for row in digits]
+	return data, elevation_data
+
+def forget_autosaved():
+	global autosave_all
+	autosave_all = False
+	for rows in autosave_rows.values():
+		rows.clear()
+
 def load_file(full_path):
-	global modified
+	global modified, autosave_file
 	
 	fn = os.path.basename(full_path)
 	name, ext = os.path.splitext(fn)
 	try:
-		with open(full_path) as f:
-			if ext == ".json":
-				data = json.load(f)
-			else:
-				data = [line for line in f]
-		set_map_data(viewport, data)
+		if ext == ".map":
+			data, elevation_data = read_compiled(full_path)
+		else:
+			with open(full_path) as f:
+				if ext == ".json":
+					data = json.load(f)
+				else:
+					data = [line for line in f]
+			elevation_data = []
+		# The map takes the size of the file
+		width, height = data_size(data)
+		if width > 0 and height > 0:
+			terrain.resize(width, height, filler)
+			elevation.resize(width, height, "0")
+			user_width.set(width)
+			user_height.set(height)
+			set_scrollregion(viewport)
+		set_map_data(data, elevation_data)
+		journal.clear()
 		modified = False
+		forget_autosaved()
+		autosave_file = mapsave.autosave_path(full_path)
 		status["text"] = "Opened " + fn
 		filename_label["text"] = "Map name: " + name
 		top.title(fn + " | ASCII Mapper")
+		recover_autosave(full_path)
 		return True
 	except OSError as e:
 		showerror("Error opening file", str(e), parent=top)
@@ -318,32 +535,132 @@ def load_file(full_path):
 	except IOError as e: # For Python 2.7
 		showerror("Error opening file", str(e), parent=top)
 		return False
+	except ImportError as e:
+		showerror("Error opening file", "Compiled maps need NumPy: " + str(e), parent=top)
+		return False
+	except ValueError as e:
+		showerror("Error opening file", str(e), parent=top)
+		return False
+
+def recover_autosave(map_path):
+	# Offer the changes autosaved after the last save, if any
+	path = mapsave.autosave_path(map_path)
+	saved = mapsave.read_autosave(path)
+	if saved is None:
+		return False
+	do_recover = askyesno(
+		title="Recover changes?",
+		message="This map has autosaved changes that were never saved. Recover them?",
+		icon="question",
+		parent=top)
+	if not do_recover:
+		mapsave.discard(path)
+		return False
+	width, height, rows, elevation_rows = saved
+	terrain.resize(width, height, filler)
+	elevation.resize(width, height, "0")
+	for y in rows:
+		terrain.rows[y] = list(rows[y])
+	for y in elevation_rows:
+		elevation.rows[y] = list(elevation_rows[y])
+	user_width.set(width)
+	user_height.set(height)
+	set_scrollregion(viewport)
+	redraw_map(viewport, True)
+	map_changed()
+	status["text"] = "Recovered autosaved changes."
+	return True
+
+def poll_saves():
+	# Hand finished background saves back to the Tk thread
+	saver.poll()
+	if saver.pending > 0:
+		top.after(100, poll_saves)
+
+def start_job(job, done):
+	if saver.pending == 0:
+		top.after(100, poll_saves)
+	saver.submit(job, done)
 
 def save_file(full_path):
-	global modified
-	
+	# The map is written in the background; the title and the modified
+	# flag are only updated once it is safely on disk. Only .map files
+	# keep the elevation, so saving hills to .txt or .json leaves the map
+	# modified and its autosave in place
 	fn = os.path.basename(full_path)
 	name, ext = os.path.splitext(fn)
-	data = map_data(viewport, map_tiles)
-	try:
-		with open(full_path, "w") as f:
-			if ext == ".json":
-				json.dump(data, f)
-			else:
-				f.write("\n".join(data))
-				f.write("\n")
-			f.flush()
-		modified = False
-		status["text"] = "Saved " + fn
+	data = map_data()
+	elevation_data = elevation.data()
+	saved_version = version
+	flat = elevation_data == ["0" * elevation.width] * elevation.height
+	complete = ext == ".map" or flat
+	if not complete:
+		do_save = askyesno(
+			title="Save without elevation?",
+			message=fn + " only keeps the terrain, the elevation will not be saved (save as .map to keep it). Save anyway?",
+			icon="warning",
+			parent=top)
+		if not do_save:
+			status["text"] = "Save canceled."
+			return False
+	
+	def done(result, error):
+		global modified, autosave_all, autosave_file
+		if error is not None:
+			status["text"] = "Saving " + fn + " failed."
+			showerror("Error saving file", str(error), parent=top)
+			return
+		if complete:
+			status["text"] = "Saved " + fn
+		else:
+			status["text"] = "Saved " + fn + " (terrain only, save as .map to keep the elevation)"
+		if map_filename != full_path:
+			# Another map was opened meanwhile
+			return
+		if complete and version == saved_version:
+			modified = False
+			stale = autosave_file
+			if stale is not None:
+				start_job(lambda: mapsave.discard(stale), None)
+			forget_autosaved()
+			autosave_file = mapsave.autosave_path(full_path)
+		elif version != saved_version:
+			# Changed while saving, the sidecar must cover those changes too
+			autosave_all = True
 		filename_label["text"] = "Map name: " + name
 		top.title(fn + " | ASCII Mapper")
-		return True
-	except OSError as e:
-		showerror("Error saving file", str(e), parent=top)
-		return False
-	except IOError as e: # For Python 2.7
-		showerror("Error saving file", str(e), parent=top)
-		return False
+	
+	status["text"] = "Saving " + fn + "..."
+	start_job(lambda: mapsave.save_map(full_path, data, elevation_data), done)
+	return True
+
+def autosave():
+	# Periodically append the changed rows to the sidecar, or the whole map
+	# when starting a new sidecar or when it has grown too big
+	global autosave_file, autosave_bytes
+	top.after(AUTOSAVE_MS, autosave)
+	changed = autosave_rows["terrain"] or autosave_rows["elevation"]
+	if not autosave_all and not changed:
+		return
+	path = mapsave.autosave_path(map_filename)
+	compact = (autosave_all or path != autosave_file
+		or autosave_bytes > 8 * doc.width * doc.height)
+	rows = {}
+	for name, d in (("terrain", terrain), ("elevation", elevation)):
+		ys = range(d.height) if compact else autosave_rows[name]
+		rows[name] = dict((y, "".join(d.rows[y])) for y in ys if y < d.height)
+	text = mapsave.rows_text(doc.width, doc.height, rows["terrain"], rows["elevation"])
+	forget_autosaved()
+	autosave_file = path
+	autosave_bytes = len(text) if compact else autosave_bytes + len(text)
+	
+	def done(result, error):
+		global autosave_all
+		if error is not None:
+			autosave_all = True
+			status["text"] = "Autosave failed: " + str(error)
+	
+	start_job(lambda: mapsave.write_rows(path, text, compact), done)
 
 def new_command():
 	global map_filename, modified
@@ -357,11 +674,13 @@ def new_command():
 		if not do_new:
 			status["text"] = "New map canceled."
 			return
-	for y in range(map_height):
-		for x in range(map_width):
-			viewport.itemconfigure(map_tiles[y][x], text=filler)
+	terrain.fill(filler)
+	elevation.fill("0")
+	journal.clear()
+	redraw_map(viewport, True)
 	map_filename = None
 	modified = False
+	forget_autosaved()
 
 def open_command():
 	global map_filename
@@ -377,7 +696,7 @@ def open_command():
 			return
 	choice = askopenfilename(
 		title="Open existing map",
-		filetypes=('"ASCII maps" {.json .txt}', ("All files", ".*")),
+		filetypes=('"ASCII maps" {.json .txt .map}', ("All files", ".*")),
 		parent=top)
 	if len(choice) == 0:
 		status["text"] = "File opening canceled."
@@ -399,13 +718,31 @@ def saveas_command():
 	
 	choice = asksaveasfilename(
 		title="Save map as...",
-		filetypes=(("ASCII maps", ".json"), ("Plain text", ".txt")),
+		filetypes=(("ASCII maps", ".json"), ("Plain text", ".txt"), ("Compiled maps", ".map")),
 		parent=top)
 	if len(choice) == 0:
 		status["text"] = "Save canceled."
 	elif save_file(choice):
 		map_filename = choice
 
+def export_command():
+	# Copy of both layers as a compiled .map for the game, the map keeps its name
+	choice = asksaveasfilename(
+		title="Export compiled map...",
+		filetypes=(("Compiled maps", ".map"),),
+		defaultextension=".map",
+		parent=top)
+	if len(choice) == 0:
+		status["text"] = "Export canceled."
+		return
+	try:
+		mapsave.save_map(choice, map_data(), elevation.data())
+		status["text"] = "Exported " + os.path.basename(choice)
+	except ImportError as e:
+		showerror("Error exporting map", "Compiled maps need NumPy: " + str(e), parent=top)
+	except (OSError, ValueError) as e:
+		showerror("Error exporting map", str(e), parent=top)
+
 def reload_command():
 	if map_filename == None:
 		showinfo("Oops!", "The map was never saved.", parent=top)
@@ -434,6 +771,10 @@ def confirm_quit():
 	else:
 		do_quit = True
 	if do_quit:
+		saver.wait()
+		if modified and autosave_file is not None:
+			# Changes thrown away on purpose, don't offer them back
+			mapsave.discard(autosave_file)
 		top.destroy()
 	else:
 		status["text"] = "Quit canceled."
@@ -445,6 +786,15 @@ brush_view = ttk.Label(
 	toolbar, width=2, font=map_font, text=brush, anchor="center")
 brush_view.pack(side=LEFT)
 
+for label, name in (("Pencil", "pencil"), ("Rectangle", "rect"), ("Fill", "fill")):
+	ttk.Radiobutton(toolbar, text=label, variable=tool, value=name).pack(side=LEFT)
+
+ttk.Separator(toolbar, orient=VERTICAL).pack(side=LEFT, padx=4)
+
+for label, name in (("Terrain", "terrain"), ("Elevation", "elevation")):
+	ttk.Radiobutton(toolbar, text=label, variable=layer, value=name,
+		command=lambda: switch_layer()).pack(side=LEFT)
+
 ttk.Separator(toolbar, orient=VERTICAL).pack(side=LEFT, padx=4)
 
 def toolbutt(txt, under=None, cmd=None):
@@ -456,14 +806,30 @@ toolbutt("Save", 0, save_command).pack(side=LEFT)
 
 ttk.Separator(toolbar, orient=VERTICAL).pack(side=LEFT, padx=4)
 
+toolbutt("Undo", 0, undo_command).pack(side=LEFT)
+toolbutt("Redo", 2, redo_command).pack(side=LEFT)
+
+ttk.Separator(toolbar, orient=VERTICAL).pack(side=LEFT, padx=4)
+
 toolbutt("Save as", 5, saveas_command).pack(side=LEFT)
 toolbutt("Reload", 0, reload_command).pack(side=LEFT)
+toolbutt("Export", 0, export_command).pack(side=LEFT)
 
 ttk.Separator(toolbar, orient=VERTICAL).pack(side=LEFT, padx=4)
 
 toolbutt("Properties", 0, props_dlg.deiconify).pack(side=LEFT)
 toolbutt("About", 1, show_about).pack(side=LEFT)
 
+def switch_layer():
+	# Edit the layer picked in the toolbar, each keeps its own brush
+	global doc, brush
+	brushes[layer_of(doc)] = brush
+	doc = terrain if layer.get() == "terrain" else elevation
+	brush = brushes[layer.get()]
+	brush_view["text"] = brush
+	redraw_map(viewport, True)
+	status["text"] = "Editing the " + layer.get() + " layer."
+
 def pick_background():
 	color = askcolor(initialcolor=viewport["background"])
 	if color[1] != None:
@@ -471,14 +837,18 @@ def pick_background():
 		brush_view["background"] = color[1]
 
 def pick_foreground():
-	color = askcolor(initialcolor=viewport.itemcget("tile", "fill"))
+	global tile_color
+	color = askcolor(initialcolor=tile_color)
 	if color[1] != None:
+		tile_color = color[1]
 		viewport.itemconfigure("tile", fill=color[1])
 		brush_view["foreground"] = color[1]
 
 def pick_grid_color():
+	global grid_color
 	color = askcolor(initialcolor=viewport.itemcget("grid", "fill"))
 	if color[1] != None:
+		grid_color = color[1]
 		viewport.itemconfigure("grid", fill=color[1])
 
 view_menu = Menu(top, tearoff=0)
@@ -497,6 +867,14 @@ view_menu.add_checkbutton(
 	onvalue=True,
 	offvalue=False,
 	command=lambda: set_grid_by_state(viewport))
+view_menu.add_checkbutton(
+	label="Elevation shading",
+	underline=0,
+	accelerator="Ctrl-L",
+	variable=shading_shown,
+	onvalue=True,
+	offvalue=False,
+	command=lambda: redraw_map(viewport, True))
 view_menu.add_separator()
 view_menu.add_command(
 	label="Background...", underline=0, command=pick_background)
@@ -521,12 +899,16 @@ ttk.Separator(statusbar, orient=VERTICAL).pack(side=RIGHT, padx=4)
 palette = ttk.Frame(top)
 palette.pack(side=LEFT, fill="y", padx=4, pady=4)
 
+def set_brush(char):
+	global brush
+	if doc is elevation and char not in ELEVATION_CHARS:
+		status["text"] = "Elevation brushes are the digits 0-" + ELEVATION_CHARS[-1] + "."
+		return
+	brush = char
+	brush_view["text"] = brush
+
 def brush_setter(char):
-	def do_set():
-		global brush
-		brush = char
-		brush_view["text"] = brush
-	return do_set
+	return lambda: set_brush(char)
 
 for i in """.,:;#=/+"~|^&*<>()[]?!$%""":
 	ttk.Button(palette, text=i, width=2,
@@ -535,10 +917,8 @@ for i in """.,:;#=/+"~|^&*<>()[]?!$%""":
 work_area.pack(side=RIGHT, fill="both", expand=1, padx=4, pady=4)
 
 def set_brush_by_key(event):
-	global brush
 	if len(event.char) > 0:
-		brush = event.char
-		brush_view["text"] = brush
+		set_brush(event.char)
 
 top.bind("<KeyPress>", set_brush_by_key)
 
@@ -546,16 +926,28 @@ def toggle_grid(canvas, flag):
 	flag.set(not flag.get())
 	set_grid_by_state(canvas)
 
+def toggle_shading(canvas, flag):
+	flag.set(not flag.get())
+	redraw_map(canvas, True)
+
 top.bind("<Control-n>", lambda e: new_command())
 top.bind("<Control-o>", lambda e: open_command())
 top.bind("<Control-s>", lambda e: save_command())
 top.bind("<Control-r>", lambda e: reload_command())
+top.bind("<Control-e>", lambda e: export_command())
+top.bind("<Control-z>", lambda e: undo_command())
+top.bind("<Control-y>", lambda e: redo_command())
+top.bind("<Control-Z>", lambda e: redo_command())
 top.bind("<Control-q>", lambda e: confirm_quit())
 
 top.bind("<Command-n>", lambda e: new_command())
 top.bind("<Command-o>", lambda e: open_command())
 top.bind("<Command-s>", lambda e: save_command())
 top.bind("<Command-r>", lambda e: reload_command())
+top.bind("<Command-e>", lambda e: export_command())
+top.bind("<Command-z>", lambda e: undo_command())
+top.bind("<Command-y>", lambda e: redo_command())
+top.bind("<Command-Z>", lambda e: redo_command())
 top.bind("<Command-q>", lambda e: confirm_quit())
 
 top.protocol("WM_DELETE_WINDOW", confirm_quit)
@@ -563,17 +955,20 @@ top.protocol("WM_DELETE_WINDOW", confirm_quit)
 top.bind("<Control-equal>", lambda e: set_zoom(viewport, zoom + 1))
 top.bind("<Control-minus>", lambda e: set_zoom(viewport, zoom - 1))
 top.bind("<Control-g>", lambda e: toggle_grid(viewport, grid_shown))
+top.bind("<Control-l>", lambda e: toggle_shading(viewport, shading_shown))
 
 top.bind("<Command-equal>", lambda e: set_zoom(viewport, zoom + 1))
 top.bind("<Command-minus>", lambda e: set_zoom(viewport, zoom - 1))
 top.bind("<Command-g>", lambda e: toggle_grid(viewport, grid_shown))
+top.bind("<Command-l>", lambda e: toggle_shading(viewport, shading_shown))
+
+redraw_map(viewport, True)
 
-redraw_grid(viewport)
-redraw_map(viewport)
-set_grid_by_state(viewport)
+saver = mapsave.Worker()
+top.after(AUTOSAVE_MS, autosave)
 
 if len(sys.argv) < 2:
-	pass
+	recover_autosave(None)
 elif load_file(sys.argv[1]):
 	map_filename = sys.argv[1]
 
@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the hot paths of ASCII Battle.
+
+Run from this folder:
+    python3 benchmark.py              (all benchmarks)
+    python3 benchmark.py occupancy    (just one)
+"""
+
+import curses
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import ascii_battle
+import mapgen
+import renderer
+import savegame
+from hpa import AbstractGraph
+from engine import COMBAT, Battlefield, Engine, UNIT_TYPES, WEAPON_SYSTEM_TYPES
+from occupancy import OccupancyGrid
+from pathfinding import astar
+from policies import greedy_policy, play, random_policy
+from units import UnitStore
+
+
+def timeit(fn, repeat=5):
+    # Best of `repeat` runs, in milliseconds
+    best = None
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        t = (time.perf_counter() - t0) * 1000
+        if best is None or t < best:
+            best = t
+    return best
+
+
+def random_units(n, width, height, seed=1):
+    rng = random.Random(seed)
+    cells = rng.sample(range(width * height), n)
+    kinds = list(UNIT_TYPES)
+    store = UnitStore(UNIT_TYPES, WEAPON_SYSTEM_TYPES)
+    for i, c in enumerate(cells):
+        store.add(c % width, c // width, 1 + (i % 2), rng.choice(kinds))
+    return store
+
+
+def bench_occupancy():
+    # One "frame" = one unit_at lookup per map cell, like Game.draw does
+    width, height = 100, 100
+    print(f"Frame lookup cost on a {width}x{height} map ({width*height} unit_at calls)")
+    print(f"{'units':>8} {'linear scan':>14} {'occupancy grid':>16}")
+    for n in (10, 100, 1000, 5000):
+        units = random_units(n, width, height)
+        grid = OccupancyGrid(width, height)
+        for u in units:
+            grid.add(u)
+
+        def linear_frame():
+            for y in range(height):
+                for x in range(width):
+                    for u in units:
+                        if u.is_alive() and u.x == x and u.y == y:
+                            break
+
+        def grid_frame():
+            for y in range(height):
+                for x in range(width):
+                    grid.get(x, y)
+
+        # The linear scan gets unbearably slow, only sample it where it finishes
+        linear = f"{timeit(linear_frame, 1):.1f} ms" if n <= 1000 else "-"
+        print(f"{n:>8} {linear:>14} {timeit(grid_frame):>13.2f} ms")
+
+
+class PlainUnit:
+    # The old per-instance __dict__ unit, kept only as a baseline for bench_units
+    def __init__(self, x, y, owner, kind):
+        un = UNIT_TYPES[kind]
+        self.x = x
+        self.y = y
+        self.owner = owner
+        self.kind = kind
+        self.name = un['name']
+        self.max_hp = un['hp']
+        self.hp = self.max_hp
+        self.arm = un['arm']
+        self.move_range = un['move']
+        self.amph = un['amph']
+        self.flying = un['flying']
+        self.optics = un['optics']
+        self.ws1 = un['ws1']
+        self.ws2 = un['ws2']
+        self.ws1_ammo = WEAPON_SYSTEM_TYPES[self.ws1]['ammo']
+        self.ws2_ammo = WEAPON_SYSTEM_TYPES[self.ws2]['ammo']
+        self.moved = False
+        self.acted = False
+
+
+def allocated(build):
+    # Bytes still allocated by build()'s result
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def bench_units():
+    n = 100000
+    width, height = 1000, 1000
+    plain = allocated(lambda: [PlainUnit(u.x, u.y, u.owner, u.kind) for u in random_units(n, width, height)])
+    store = allocated(lambda: random_units(n, width, height))
+    print(f"Memory for {n} units")
+    print(f"  plain objects: {plain / n:6.0f} bytes/unit")
+    print(f"  unit store:    {store / n:6.0f} bytes/unit ({plain / store:.1f}x smaller)")
+
+    units = random_units(n, width, height)
+    plain_units = [PlainUnit(u.x, u.y, u.owner, u.kind) for u in units]
+    x, y, r = width // 2, height // 2, 50
+
+    def scan():
+        return [u for u in plain_units if u.hp > 0 and u.owner == 2 and abs(u.x-x) + abs(u.y-y) <= r]
+
+    def vectorized():
+        return units.within(x, y, r, owner=2)
+
+    assert len(scan()) == len(vectorized())
+    print(f"Living P2 units within {r} cells of ({x},{y}), {len(scan())} hits")
+    print(f"  python scan: {timeit(scan):8.2f} ms")
+    print(f"  vectorized:  {timeit(vectorized):8.2f} ms")
+
+
+class StubWindow:
+    # Stands in for a curses window so drawing can be timed without a terminal
+    def __init__(self, lines=50, cols=120):
+        self.lines = lines
+        self.cols = cols
+        self.calls = 0
+
+    def getmaxyx(self):
+        return self.lines, self.cols
+
+    def addch(self, *args):
+        self.calls += 1
+
+    def addstr(self, *args):
+        self.calls += 1
+
+    def inch(self, y, x):
+        return 0
+
+    def noop(self, *args):
+        pass
+
+    clear = erase = refresh = noutrefresh = move = clrtoeol = keypad = nodelay = noop
+
+
+class StubCurses:
+    # Just enough of the curses module for Game.__init__ and Renderer
+    error = curses.error
+    KEY_RESIZE = curses.KEY_RESIZE
+    COLOR_BLACK = curses.COLOR_BLACK
+    COLOR_YELLOW = curses.COLOR_YELLOW
+    COLOR_MAGENTA = curses.COLOR_MAGENTA
+    A_DIM = curses.A_DIM
+
+    @staticmethod
+    def color_pair(n):
+        return n << 8
+
+    @staticmethod
+    def newwin(*args):
+        return StubWindow()
+
+    @staticmethod
+    def noop(*args):
+        pass
+
+    start_color = use_default_colors = init_pair = doupdate = curs_set = noop
+
+
+def stub_game(field=None):
+    ascii_battle.curses = StubCurses
+    renderer.curses = StubCurses
+    if field is None:
+        field = Battlefield.from_files("map3.txt", "elevation2.txt")
+    return ascii_battle.Game(StubWindow(), field)
+
+
+def tiled_field(size):
+    # map3 repeated to a size x size map
+    small = Battlefield.from_files("map3.txt", "elevation2.txt")
+    reps = (size // small.height + 1, size // small.width + 1)
+    return Battlefield(np.tile(small.terrain, reps)[:size, :size], np.tile(small.elevation, reps)[:size, :size])
+
+
+COLOR_FIELD = 25    # color pair of '"' in the ladder
+
+
+def ladder_cell_look(g):
+    # Game.cell_look as it was before the terrain colors were baked: the
+    # pair of every terrain cell is picked by an if/elif ladder on its
+    # character and elevation digit each time it is drawn. Kept, branch for
+    # branch, as the reference the baked lookup is measured against; the
+    # '"' (field) branch has no terrain type any more, the baked lookup
+    # draws it as an error, and map3 has no such cells
+    e = g.engine
+    game_map = ["".join(map(chr, row)) for row in e.field.terrain.tolist()]
+    elev = ["".join(str(level) for level in row) for row in e.field.elevation.tolist()]
+    color_pair = ascii_battle.curses.color_pair
+    A = ascii_battle
+
+    def cell_look(x, y):
+        i = y*e.width + x
+        u = e.occupancy.cells.get(i)
+        viewer = g.viewer
+        if u and (u.owner == viewer or not A.FOG_OF_WAR or e.visibility.spotted[viewer][i]):
+            if u.owner == 1:
+                attr = color_pair(A.COLOR_P1)
+            else:
+                attr = color_pair(A.COLOR_P2)
+            return u.kind, attr
+
+        if game_map[y][x] == '.' and elev[y][x] == '0':
+            attr = color_pair(A.COLOR_GRASS+A.COLOR_L0)
+        elif game_map[y][x] == '.' and elev[y][x] == '1':
+            attr = color_pair(A.COLOR_GRASS+A.COLOR_L1)
+        elif game_map[y][x] == '.' and elev[y][x] == '2':
+            attr = color_pair(A.COLOR_GRASS+A.COLOR_L2)
+        elif game_map[y][x] == '.' and elev[y][x] == '3':
+            attr = color_pair(A.COLOR_GRASS+A.COLOR_L3)
+        elif game_map[y][x] == '.' and elev[y][x] == '4':
+            attr = color_pair(A.COLOR_GRASS+A.COLOR_L4)
+
+        elif (game_map[y][x] == 'f' or game_map[y][x] == 'F') and elev[y][x] == '0':
+            attr = color_pair(A.COLOR_FOREST+A.COLOR_L0)
+        elif (game_map[y][x] == 'f' or game_map[y][x] == 'F') and elev[y][x] == '1':
+            attr = color_pair(A.COLOR_FOREST+A.COLOR_L1)
+        elif (game_map[y][x] == 'f' or game_map[y][x] == 'F') and elev[y][x] == '2':
+            attr = color_pair(A.COLOR_FOREST+A.COLOR_L2)
+        elif (game_map[y][x] == 'f' or game_map[y][x] == 'F') and elev[y][x] == '3':
+            attr = color_pair(A.COLOR_FOREST+A.COLOR_L3)
+        elif (game_map[y][x] == 'f' or game_map[y][x] == 'F') and elev[y][x] == '4':
+            attr = color_pair(A.COLOR_FOREST+A.COLOR_L4)
+
+        elif game_map[y][x] == '+' and elev[y][x] == '0':
+            attr = color_pair(A.COLOR_ROAD+A.COLOR_L0)
+        elif game_map[y][x] == '+' and elev[y][x] == '1':
+            attr = color_pair(A.COLOR_ROAD+A.COLOR_L1)
+        elif game_map[y][x] == '+' and elev[y][x] == '2':
+            attr = color_pair(A.COLOR_ROAD+A.COLOR_L2)
+        elif game_map[y][x] == '+' and elev[y][x] == '3':
+            attr = color_pair(A.COLOR_ROAD+A.COLOR_L3)
+        elif game_map[y][x] == '+' and elev[y][x] == '4':
+            attr = color_pair(A.COLOR_ROAD+A.COLOR_L4)
+
+        elif game_map[y][x] == '*' and elev[y][x] == '0':
+            attr = color_pair(A.COLOR_SHRUB+A.COLOR_L0)
+        elif game_map[y][x] == '*' and elev[y][x] == '1':
+            attr = color_pair(A.COLOR_SHRUB+A.COLOR_L1)
+        elif game_map[y][x] == '*' and elev[y][x] == '2':
+            attr = color_pair(A.COLOR_SHRUB+A.COLOR_L2)
+        elif game_map[y][x] == '*' and elev[y][x] == '3':
+            attr = color_pair(A.COLOR_SHRUB+A.COLOR_L3)
+        elif game_map[y][x] == '*' and elev[y][x] == '4':
+            attr = color_pair(A.COLOR_SHRUB+A.COLOR_L4)
+
+        elif game_map[y][x] == '"':
+            attr = color_pair(COLOR_FIELD)
+        elif game_map[y][x] == 'H':
+            attr = color_pair(A.COLOR_BUILDING)
+        elif game_map[y][x] == '~':
+            attr = color_pair(A.COLOR_WATER)
+
+        else:
+            attr = color_pair(A.COLOR_ERROR)
+        if A.FOG_OF_WAR and not e.visibility.seen[viewer][i]:
+            attr |= ascii_battle.curses.A_DIM
+        return game_map[y][x], attr
+
+    return cell_look
+
+
+def bench_draw():
+    n = 200
+    g = stub_game()
+    print(f"draw() on map3.txt ({g.engine.width * g.engine.height} cells), stub screen, {n} frames")
+    print(f"{'terrain colors':>16} {'full repaint':>14} {'cursor move':>14}")
+    ladder = ladder_cell_look(g)
+    assert all(ladder(x, y) == g.cell_look(x, y) for y in range(g.engine.height) for x in range(g.engine.width))
+    for name in ("if/elif ladder", "baked"):
+        g = stub_game()
+        if name == "if/elif ladder":
+            g.cell_look = ladder_cell_look(g)
+
+        def full_frame():
+            g.renderer.invalidate()
+            g.draw()
+
+        def cursor_frame():
+            g.cursor_x = (g.cursor_x + 1) % g.engine.width
+            g.draw()
+
+        full = timeit(lambda: [full_frame() for i in range(n)]) / n * 1000
+        cursor = timeit(lambda: [cursor_frame() for i in range(n)]) / n * 1000
+        print(f"{name:>16} {full:>11.1f} us {cursor:>11.1f} us")
+
+
+def bench_viewport():
+    # Frame cost should follow the viewport, not the map size
+    n = 200
+    print(f"draw() with a scrolling viewport, stub 120x50 screen, {n} frames")
+    print(f"{'map':>11} {'full repaint':>14} {'scrolling':>14} {'chunks held':>12}")
+    for size in (64, 512, 2048):
+        g = stub_game(tiled_field(size))
+
+        def full_frame():
+            g.renderer.invalidate()
+            g.draw()
+
+        def scroll_frame():
+            # Walk the cursor right along a row, the camera scrolls with it
+            g.cursor_x = (g.cursor_x + 1) % size
+            g.draw()
+
+        full = timeit(lambda: [full_frame() for i in range(n)]) / n * 1000
+        scroll = timeit(lambda: [scroll_frame() for i in range(n)]) / n * 1000
+        print(f"{size:>5}x{size:<5} {full:>11.1f} us {scroll:>11.1f} us {len(g.terrain_chunks.chunks):>12}")
+
+
+def bench_headless():
+    field = Battlefield.from_files("map3.txt", "elevation2.txt")
+    n = 200
+    t0 = time.perf_counter()
+    turns = 0
+    for seed in range(n):
+        e = Engine(field, seed=seed)
+        play(e, random_policy, random_policy)
+        turns += e.turn_count
+    t = time.perf_counter() - t0
+    print(f"Headless random games on map3.txt: {n} games, {turns} turns")
+    print(f"  {n / t:8.1f} games/s   {turns / t:8.1f} turns/s")
+
+
+def bench_mapgen():
+    print("Procedural maps (mapgen.generate), best of 5")
+    for size in (64, 256, 1024):
+        t = timeit(lambda: mapgen.generate(size, size, seed=1))
+        print(f"  {size:>5}x{size:<5} {t:8.1f} ms")
+    a = mapgen.generate(256, 256, seed=1)
+    b = mapgen.generate(256, 256, seed=1)
+    same = np.array_equal(a[0], b[0]) and np.array_equal(a[1], b[1])
+    print(f"  same seed, same map: {same}")
+
+
+def bench_hpa():
+    # Long ground routes on a generated map: grid A* against HPA* with a cold
+    # and a warm cluster cache, then one terrain edit
+    size, n = 2048, 5
+    field = Battlefield(*mapgen.generate(size, size, seed=1))
+    costs = field.move_costs[0]
+    labels = field.connectivity.ground
+    rng = random.Random(1)
+    pairs = []
+    while len(pairs) < n:
+        # Far apart and in the same component, so a route exists
+        sx, sy, gx, gy = (rng.randrange(size) for i in range(4))
+        if abs(sx - gx) + abs(sy - gy) >= size and labels[sy, sx] >= 0 and labels[sy, sx] == labels[gy, gx]:
+            pairs.append((sx, sy, gx, gy))
+    graph = AbstractGraph(np.where(field.layers.passable, field.layers.move_cost, 0))
+
+    print(f"Ground routes on a generated {size}x{size} map, {n} routes of {size}+ cells")
+    print(f"{'grid A*':>10} {'HPA* cold':>10} {'HPA* warm':>10} {'1st leg':>8} {'cost':>12}")
+    for sx, sy, gx, gy in pairs:
+        t0 = time.perf_counter()
+        exact = astar(costs, size, size, sy * size + sx, gy * size + gx)[0]
+        t1 = time.perf_counter()
+        route = graph.route(sx, sy, gx, gy)
+        t2 = time.perf_counter()
+        graph.route(sx, sy, gx, gy)
+        t3 = time.perf_counter()
+        route.leg(0)
+        t4 = time.perf_counter()
+        print(f"{(t1 - t0) * 1000:7.0f} ms {(t2 - t1) * 1000:7.0f} ms {(t3 - t2) * 1000:7.1f} ms "
+              f"{(t4 - t3) * 1000:5.1f} ms {route.cost / exact:11.1%}")
+
+    # Dropping a cell's clusters only costs rebuilding those clusters
+    sx, sy, gx, gy = pairs[0]
+    route = graph.route(sx, sy, gx, gy)
+    x, y = graph.local_path(route.waypoints[1], route.waypoints[2])[0]
+    held = len(graph.clusters)
+    graph.set_cost(x, y, 0)
+    dropped = held - len(graph.clusters)
+    t = timeit(lambda: graph.route(sx, sy, gx, gy), 1)
+    print(f"  wall at ({x},{y}): {dropped} of {held} clusters dropped, re-route {t:.0f} ms")
+
+
+def bench_clone():
+    # Engine.clone() should cost the same on any map size, the map is shared
+    print("Engine.clone() for look-ahead and take-back, best of 5 x 1000")
+    print(f"{'map':>11} {'clone':>9} {'clones/s':>9} {'+ 1 move':>9}")
+    for size in (64, 512, 2048):
+        e = Engine(tiled_field(size), seed=1)
+        u = e.units[0]
+        t = timeit(lambda: [e.clone() for i in range(1000)]) / 1000
+
+        def clone_and_move():
+            # The first move on a copy copies the fog of war chunks its unit's view touches
+            for i in range(100):
+                c = e.clone()
+                c.move_unit(c.units[u.index], u.x + 1, u.y)
+        moved = timeit(clone_and_move) / 100
+        print(f"{size:>5}x{size:<5} {t * 1000:6.0f} us {1000 / t:9.0f} {moved * 1000:6.0f} us")
+
+    field = Battlefield.from_files("map3.txt", "elevation2.txt")
+    e = Engine(field, seed=1)
+    for i in range(10):
+        greedy_policy(e)
+        e.end_turn()
+    path = "benchmark" + savegame.SAVE_EXT
+    save = timeit(lambda: savegame.save(e, path))
+    load = timeit(lambda: savegame.load(path, field))
+    print(f"  savegame on map3.txt: save {save:.2f} ms, load {load:.2f} ms")
+    os.remove(path)
+
+
+def bench_combat():
+    # One attack at a time through the table against whole arrays of them
+    n = 100000
+    rng = random.Random(1)
+    indices = [rng.randrange(len(COMBAT.hit)) for i in range(n)]
+    dice = random.Random(1)
+    single = timeit(lambda: [COMBAT.resolve(i, dice) for i in indices])
+    batch_indices = np.array(indices)
+    gen = np.random.default_rng(1)
+    batch = timeit(lambda: COMBAT.resolve_many(batch_indices, gen))
+    print(f"Attack resolution from the {len(COMBAT.hit)}-entry combat table, {n} attacks")
+    print(f"  resolve()      {single * 1000 / n:8.3f} us/attack")
+    print(f"  resolve_many() {batch * 1000 / n:8.3f} us/attack")
+
+    # Picking weapons for every attacker/target pair of a battle
+    field = tiled_field(256)
+    e = Engine(field, seed=1)
+    for i in range(500):
+        x, y = rng.randrange(field.width), rng.randrange(field.height)
+        if field.layers.passable[y, x] and not e.unit_at(x, y):
+            e.add_unit(x, y, 1 + i % 2, rng.choice(list(UNIT_TYPES)))
+    units = [u for u in e.units if u.owner == 1]
+    targets = [u for u in e.units if u.owner == 2]
+    a = [u for u in units for t in targets]
+    t = [t for u in units for t in targets]
+    loop = timeit(lambda: [e.weapon_for(u, v) is not None and e.attack_index(u, v, e.weapon_for(u, v))
+                           for u, v in zip(a, t)], 1)
+    vector = timeit(lambda: e.attack_indices(a, t), 1)
+    print(f"  {len(a)} attacker/target pairs: one by one {loop:.0f} ms, attack_indices() {vector:.1f} ms")
+
+
+BENCHMARKS = {
+    'occupancy': bench_occupancy,
+    'units': bench_units,
+    'draw': bench_draw,
+    'viewport': bench_viewport,
+    'headless': bench_headless,
+    'mapgen': bench_mapgen,
+    'hpa': bench_hpa,
+    'clone': bench_clone,
+    'combat': bench_combat,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark: {name} (choose from {', '.join(BENCHMARKS)})")
+            sys.exit(1)
+        BENCHMARKS[name]()
+        print()
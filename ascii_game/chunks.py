@@ -0,0 +1,52 @@
+"""
+Fixed-size map chunks with an LRU cache.
+
+Big maps are never baked or drawn as a whole: the map is split into
+CHUNK_SIZE x CHUNK_SIZE chunks, a chunk is built (read from the map
+arrays, colored, ...) the first time a cell in it is needed and the least
+recently used chunks are dropped once more than `capacity` are held. With
+a scrolling viewport only the chunks around the camera stay in memory, so
+the renderer's cost depends on the viewport size, not on the map size.
+This is the renderer only: the rules' layers (engine.Battlefield) cover
+the whole map and grow with it.
+"""
+
+from collections import OrderedDict
+
+CHUNK_SIZE = 32
+
+
+class ChunkCache:
+    def __init__(self, build, capacity=64):
+        self.build = build          # (cx, cy) -> chunk, rows of cells
+        self.capacity = capacity
+        self.chunks = OrderedDict()
+        self.last_key = None
+        self.last = None
+        self.loads = 0
+
+    def chunk(self, cx, cy):
+        key = (cx, cy)
+        # Neighbouring cells mostly share a chunk, skip the LRU bookkeeping then
+        if key == self.last_key:
+            return self.last
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.build(cx, cy)
+            self.loads += 1
+            self.chunks[key] = chunk
+            if len(self.chunks) > self.capacity:
+                self.chunks.popitem(last=False)
+        else:
+            self.chunks.move_to_end(key)
+        self.last_key = key
+        self.last = chunk
+        return chunk
+
+    def get(self, x, y):
+        return self.chunk(x // CHUNK_SIZE, y // CHUNK_SIZE)[y % CHUNK_SIZE][x % CHUNK_SIZE]
+
+    def clear(self):
+        self.chunks.clear()
+        self.last_key = None
+        self.last = None
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Curses client for matches hosted by server.py.
+
+The client keeps a mirror of the match (protocol.mirror) only to draw it
+with the usual ascii_battle view: keys send commands to the server, and the
+mirror changes only when a delta comes back. Everything else, controls
+included, works like the hot-seat game, except that the map is always
+drawn from this player's side.
+
+    python3 client.py --host 127.0.0.1 --port 8765 --match duel
+"""
+
+import argparse
+import curses
+import select
+import socket
+import sys
+
+import protocol
+from ascii_battle import Game
+from server import DEFAULT_PORT
+
+POLL_MS = 50    # how often the screen checks for server messages
+
+
+class Connection:
+    # Line oriented socket: send messages, read whole ones as they arrive
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = b''
+        self.pending = []   # messages read but not handed out yet
+
+    def send(self, msg):
+        self.sock.sendall(protocol.encode(msg))
+
+    def read(self, timeout):
+        # Wait up to `timeout` seconds (None = for ever) for data, False once
+        # the server closed the connection
+        if select.select([self.sock], [], [], timeout)[0]:
+            data = self.sock.recv(65536)
+            if not data:
+                return False
+            *lines, self.buffer = (self.buffer + data).split(b'\n')
+            self.pending += [protocol.decode(line) for line in lines]
+        return True
+
+    def messages(self):
+        # Messages that have arrived so far, None once the connection is closed
+        if not self.read(0):
+            return None
+        msgs, self.pending = self.pending, []
+        return msgs
+
+    def receive(self):
+        # Next message, waiting for it
+        while not self.pending:
+            if not self.read(None):
+                raise ConnectionError("Server closed the connection.")
+        return self.pending.pop(0)
+
+
+class NetGame(Game):
+    def __init__(self, stdscr, conn, welcome):
+        engine = protocol.mirror(welcome)
+        super().__init__(stdscr, engine.field, engine=engine)
+        self.conn = conn
+        self.player = welcome['player']
+        self.message = f"You are player {self.player}."
+        if self.player == 1:
+            self.message += " Waiting for an opponent..."
+
+    @property
+    def viewer(self):
+        return self.player
+
+    def move_selected(self):
+        if not self.selected:
+            self.message = "No unit selected."
+            return
+        self.conn.send({'op': 'move', 'unit': self.selected.index, 'x': self.cursor_x, 'y': self.cursor_y})
+
+    def attack_with_selected(self):
+        if not self.selected:
+            self.message = "No unit selected."
+            return
+        target = self.visible_unit_at(self.cursor_x, self.cursor_y)
+        if not target:
+            self.message = "No enemy at target to attack."
+            return
+        self.conn.send({'op': 'attack', 'unit': self.selected.index, 'target': target.index})
+
+    def order_selected(self):
+        self.message = "Multi-turn orders aren't available in a network match."
+
+    def end_turn(self):
+        self.selected = None
+        self.conn.send({'op': 'end_turn'})
+
+    def take_back(self):
+        self.message = "Moves can't be taken back in a network match."
+
+    def quicksave(self):
+        self.message = "Network matches can't be saved."
+
+    def quickload(self):
+        self.message = "Network matches can't be loaded."
+
+    def handle_message(self, msg):
+        op = msg['op']
+        if op == 'delta':
+            protocol.apply(self.engine, msg)
+            self.message = msg['message']
+        elif op == 'error':
+            self.message = msg['message']
+        elif op == 'joined':
+            self.message = "Your opponent joined, your turn."
+        elif op == 'left':
+            self.message = "Your opponent left the match."
+
+    def game_loop(self):
+        curses.curs_set(0)
+        self.stdscr.timeout(POLL_MS)
+        self.stdscr.keypad(True)
+        while True:
+            msgs = self.conn.messages()
+            if msgs is None:
+                return
+            for msg in msgs:
+                self.handle_message(msg)
+            winner = self.check_victory()
+            if winner:
+                self.message = f"Player {winner} wins! Press q to quit."
+            self.draw()
+            c = self.stdscr.getch()
+            if c != -1 and not self.handle_key(c):
+                return
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play an ASCII Battle match on a server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--match", default="default", help="match name, the second player joins the same name")
+    args = parser.parse_args(argv)
+
+    try:
+        conn = Connection(socket.create_connection((args.host, args.port)))
+        conn.send({'op': 'join', 'match': args.match})
+        welcome = conn.receive()
+    except OSError as e:
+        sys.exit(f"Can't join {args.host}:{args.port}: {e}")
+    if welcome['op'] != 'welcome':
+        sys.exit(welcome.get('message', "Unexpected answer from the server."))
+    try:
+        curses.wrapper(lambda stdscr: NetGame(stdscr, conn, welcome).game_loop())
+    except KeyboardInterrupt:
+        print('\nGoodbye.')
+    except ConnectionError as e:
+        sys.exit(str(e))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Attack resolution for ASCII Battle.
+
+An attack has to hit and then get through the target's armor:
+
+    hit chance  HIT_BASE % - COVER_PENALTY % per cover level of the target's
+                cell + ELEVATION_BONUS % per elevation level the shooter
+                stands above the target (minus when below), kept within
+                HIT_MIN..HIT_MAX %. Flying targets get no cover, but
+                weapons that aren't `antiair` have AIR_PENALTY % less
+                chance to hit them.
+    damage      the weapon's dmg_val, one less for every point the target's
+                armor (`arm`) is above the weapon's arm_pen. A hit rolls
+                max(1, d - 2)..d + 1 of what is left, nothing if that's 0.
+
+The outcome only depends on five small integers: weapon system, whether
+the target flies, target armor, cover level and elevation difference.
+CombatTable works out every combination of them once, at startup (about
+two thousand entries), as flat lists for the engine and NumPy arrays for
+batches:
+
+    i = COMBAT.index(ws, arm, cover, delta, flying)
+    COMBAT.hit[i], COMBAT.low[i], COMBAT.high[i], COMBAT.expected[i]
+    COMBAT.resolve(i, dice)              -> (hit, damage), one attack
+    COMBAT.resolve_many(indices, rng)    -> damage of a whole array of attacks
+
+The table for the game's units is engine.COMBAT. indices() is index()
+over NumPy arrays, so a threat map or a batch of AI look-ups is one
+vectorized expression. Engine.attack() resolves with the engine's dice,
+Engine.attack_indices() gives the indices of many (attacker, target)
+pairs at once; `simulate.py --matchups` prints what every unit kind
+expects to do to every other.
+"""
+
+import numpy as np
+
+HIT_BASE = 80           # % to hit a target in the open on level ground
+COVER_PENALTY = 15      # % less per cover level
+ELEVATION_BONUS = 5     # % more per level the shooter is above the target
+HIT_MIN = 10
+HIT_MAX = 95
+MAX_DELTA = 4           # elevation differences beyond this count as this
+AIR_PENALTY = 30        # % less to hit a flying target without an antiair weapon
+
+
+class CombatTable:
+    def __init__(self, weapon_types, max_armor, max_cover, max_delta=MAX_DELTA):
+        self.weapons = len(weapon_types)
+        self.armors = max_armor + 1
+        self.covers = max_cover + 1
+        self.max_delta = max_delta
+        self.deltas = 2 * max_delta + 1
+
+        hit, low, high, expected = [], [], [], []
+        for ws in range(self.weapons):
+            w = weapon_types[ws]
+            for flying in (False, True):
+                penalty = AIR_PENALTY if flying and not w['antiair'] else 0
+                for arm in range(self.armors):
+                    d = w['dmg_val'] - max(0, arm - w['arm_pen'])
+                    lo, hi = (max(1, d - 2), d + 1) if d > 0 else (0, 0)
+                    for cover in range(self.covers):
+                        for delta in range(-max_delta, max_delta + 1):
+                            chance = HIT_BASE - COVER_PENALTY * cover + ELEVATION_BONUS * delta - penalty
+                            chance = min(HIT_MAX, max(HIT_MIN, chance)) if w['dmg_val'] > 0 else 0
+                            hit.append(chance)
+                            low.append(lo)
+                            high.append(hi)
+                            expected.append(chance / 100 * (lo + hi) / 2)
+        # Lists for single attacks (plain ints are quickest to index one at
+        # a time), arrays for batches
+        self.hit, self.low, self.high, self.expected = hit, low, high, expected
+        self.hit_array = np.array(hit, np.int16)
+        self.low_array = np.array(low, np.int16)
+        self.high_array = np.array(high, np.int16)
+        self.expected_array = np.array(expected, np.float32)
+
+    def index(self, ws, arm, cover, delta, flying=False):
+        # Table index of one attack
+        delta = min(self.max_delta, max(-self.max_delta, delta)) + self.max_delta
+        return (((ws * 2 + flying) * self.armors + arm) * self.covers + cover) * self.deltas + delta
+
+    def indices(self, ws, arm, cover, delta, flying=False):
+        # index() of many attacks, the arguments are NumPy arrays (or ints)
+        # that broadcast together
+        delta = np.clip(delta, -self.max_delta, self.max_delta) + self.max_delta
+        flying = np.asarray(flying, np.int64)
+        return (((np.asarray(ws) * 2 + flying) * self.armors + arm) * self.covers + cover) * self.deltas + delta
+
+    def can_hurt(self, ws, arm):
+        # The weapon does damage to armor `arm` when it hits
+        return self.high[self.index(ws, arm, 0, 0)] > 0
+
+    def resolve(self, i, dice):
+        # (hit, damage) of one attack, rolled with the random.Random `dice`
+        if dice.randrange(100) >= self.hit[i]:
+            return False, 0
+        if not self.high[i]:
+            return True, 0
+        return True, dice.randint(self.low[i], self.high[i])
+
+    def resolve_many(self, indices, rng):
+        # Damage of every attack in `indices`, rolled with the NumPy Generator `rng`
+        indices = np.asarray(indices)
+        hits = rng.integers(0, 100, indices.shape) < self.hit_array[indices]
+        damage = rng.integers(self.low_array[indices], self.high_array[indices] + 1)
+        return np.where(hits, damage, 0)
+
@@ -0,0 +1,95 @@
+"""
+Static connectivity of a battle map per movement class.
+
+Cells that a movement class can enter are grouped into connected
+components (4-neighbourhood, like the pathfinder moves):
+
+    ground      terrain with `pass`
+    amphibious  any terrain in the table (water too)
+    flying      everything, one component (not stored)
+
+Labels are computed once per map with a union-find over the cells that
+runs as whole-array NumPy passes: every round hooks the root of each edge's
+larger end under the smaller one (np.minimum.at) and then compresses the
+paths by pointer jumping (parent = parent[parent]) until every cell points
+at its root; edges whose ends already share a root are dropped. A few
+rounds label a 1024x1024 map.
+
+With the labels, "can this unit ever get there?" is two array lookups:
+the pathfinder answers it before flooding anything, and the map can be
+checked at load time for armies that could never meet.
+"""
+
+import numpy as np
+
+UNREACHABLE = -1    # label of cells the movement class can't enter
+
+
+def label_components(enterable):
+    # (height, width) int32 component labels 0..n-1 of a boolean mask,
+    # UNREACHABLE outside it
+    h, w = enterable.shape
+    index = np.arange(h * w, dtype=np.int32).reshape(h, w)
+    right = enterable[:, :-1] & enterable[:, 1:]
+    down = enterable[:-1, :] & enterable[1:, :]
+    a = np.concatenate((index[:, :-1][right], index[:-1, :][down]))
+    b = np.concatenate((index[:, 1:][right], index[1:, :][down]))
+
+    parent = index.ravel().copy()
+    while len(a):
+        ra = parent[a]
+        rb = parent[b]
+        split = ra != rb
+        a, b, ra, rb = a[split], b[split], ra[split], rb[split]
+        if not len(a):
+            break
+        np.minimum.at(parent, np.maximum(ra, rb), np.minimum(ra, rb))
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+
+    labels = np.full(h * w, UNREACHABLE, np.int32)
+    inside = enterable.ravel()
+    labels[inside] = np.unique(parent[inside], return_inverse=True)[1]
+    return labels.reshape(h, w)
+
+
+class Connectivity:
+    def __init__(self, layers):
+        self.width = layers.width
+        self.height = layers.height
+        self.ground = label_components(layers.passable)
+        self.amph = label_components(layers.known)
+        # Flat copies for the per-call lookups, as fast as list indexing
+        self.ground_flat = layers.flat(self.ground)
+        self.amph_flat = layers.flat(self.amph)
+
+    def connected(self, unit, x, y):
+        # Could the unit ever get from where it is to (x, y), ignoring other units
+        if unit.flying:
+            return True
+        labels = self.amph_flat if unit.amph else self.ground_flat
+        here = labels[unit.y * self.width + unit.x]
+        return here != UNREACHABLE and here == labels[y * self.width + x]
+
+    def start_problems(self, starts_p1, starts_p2):
+        # Why ground armies placed on these start positions could never all
+        # meet, [] if they can. Positions are (x, y), negative ones count
+        # from the right/bottom edge like in Engine.populate_units.
+        problems = []
+        first = None
+        for player, starts in ((1, starts_p1), (2, starts_p2)):
+            for x, y in starts:
+                x %= self.width
+                y %= self.height
+                label = self.ground[y, x]
+                if label == UNREACHABLE:
+                    problems.append(f"Player {player} start position ({x},{y}) is impassable.")
+                elif first is None:
+                    first = (x, y, label)
+                elif label != first[2]:
+                    problems.append(f"Player {player} start position ({x},{y}) is cut off "
+                                    f"from ({first[0]},{first[1]}).")
+        return problems
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+Headless rules engine for ASCII Battle.
+
+Holds the unit/weapon/terrain tables, the units and the whole match state
+(turn, positions, moved/acted flags) and implements the rules: move,
+attack, end_turn and check_victory. Nothing in here touches curses, so
+matches can be played by scripts without a terminal; ascii_battle.Game is
+just a view on top of an Engine.
+
+Rule methods return True when the action happened and leave a
+human-readable result in `message` either way.
+"""
+
+import random
+from collections import Counter
+from functools import cached_property
+
+import numpy as np
+
+from combat import CombatTable
+from connectivity import Connectivity
+from hpa import route_graphs
+from maplayers import MapLayers
+from mapfile import MAP_EXT, elevation_array, grid_array, load_elev, load_map, read_map
+from occupancy import OccupancyGrid
+from pathfinding import Pathfinder, movement_costs
+from units import UnitStore
+from visibility import SightMap, Visibility
+
+# Terrain color indices (+ NUMBER OF ELEVATION LEVELS (5))
+COLOR_WATER = 5
+COLOR_GRASS = 10
+COLOR_FOREST = 15
+COLOR_ROAD = 20
+COLOR_FIELD = 25
+COLOR_BUILDING = 30
+COLOR_SHRUB = 35
+
+# Unit definitions
+"""
+size: 1-10 ? (relevant for transport cargo/troops and spotting via optics)
+arm: armor
+optics: range 1-3 (bad-medium-good)
+cost: points the unit takes out of an army's ARMY_POINTS (armoury.py)
+ws1 & ws2: weapon systems index (look at WEAPON_SYSTEM_TYPES)
+"""
+UNIT_TYPES = {
+    'X': { 'name': 'Infantry',      'cost': 2, 'size':2,   'hp': 6, 'arm': 0,   'move': 2,  'flying': False,  'amph': False, 'ws1': 1, 'ws2': 2, 'ws1_ammo': 0, 'ws2_ammo': 0, 'optics': 1 },
+    'T': { 'name': 'Tank',          'cost': 6, 'size':5,   'hp': 6, 'arm': 4,   'move': 2,  'flying': False,  'amph': False, 'ws1': 5, 'ws2': 3, 'ws1_ammo': 0, 'ws2_ammo': 0, 'optics': 1  },
+    '>': { 'name': 'Atk. Helo',     'cost': 7, 'size':7,   'hp': 5, 'arm': 1,   'move': 4,  'flying': True,   'amph': False, 'ws1': 4, 'ws2': 0, 'ws1_ammo': 0, 'ws2_ammo': 0, 'optics': 3  },
+    'O': { 'name': 'APC',           'cost': 4, 'size':5,   'hp': 6, 'arm': 2,   'move': 3,  'flying': False,  'amph': True , 'ws1': 4, 'ws2': 0, 'ws1_ammo': 0, 'ws2_ammo': 0, 'optics': 1 },
+    'R': { 'name': 'Recon',         'cost': 2, 'size':1,   'hp': 4, 'arm': 0,   'move': 3,  'flying': False,  'amph': False, 'ws1': 1, 'ws2': 2, 'ws1_ammo': 0, 'ws2_ammo': 0, 'optics': 3  },
+    'm': { 'name': 'Mortar',        'cost': 4, 'size':3,   'hp': 4, 'arm': 0,   'move': 1,  'flying': False,  'amph': False, 'ws1': 6, 'ws2': 0, 'ws1_ammo': 0, 'ws2_ammo': 0, 'optics': 2 },    # lahko dodamo radio operaterja kasneje k mortarju doda optics + range
+    'C': { 'name': 'Cargo Truck',   'cost': 1, 'size':4,   'hp': 4, 'arm': 0,   'move': 3,  'flying': False,  'amph': False, 'ws1': 0, 'ws2': 0, 'ws1_ammo': 0, 'ws2_ammo': 0, 'optics': 1  },
+    'A': { 'name': 'AA Gun',        'cost': 4, 'size':5,   'hp': 5, 'arm': 2,   'move': 2,  'flying': False,  'amph': False, 'ws1': 7, 'ws2': 7, 'ws1_ammo': 0, 'ws2_ammo': 0, 'optics': 2  },
+}
+
+# Sight radius (in cells) per optics rating
+OPTICS_RANGE = { 1: 5, 2: 7, 3: 9 }
+
+# Weapon systems definitions
+WEAPON_SYSTEM_TYPES = {
+    0 : { 'name': '/',              'arm_pen': 0,  'dmg_val': 0, 'att_range': 0,   'ammo': 0,  'antiair': False },
+    1 : { 'name': 'Small Arms',     'arm_pen': 1,  'dmg_val': 2, 'att_range': 2,   'ammo': 5,  'antiair': False },
+    2 : { 'name': 'AT Rocket',      'arm_pen': 5,  'dmg_val': 3, 'att_range': 2,   'ammo': 1,  'antiair': False },
+    3 : { 'name': 'Light MG',       'arm_pen': 1,  'dmg_val': 2, 'att_range': 3,   'ammo': 4,  'antiair': False },
+    4 : { 'name': 'Heavy MG',       'arm_pen': 2,  'dmg_val': 3, 'att_range': 4,   'ammo': 4,  'antiair': False },
+    5 : { 'name': 'Cannon',         'arm_pen': 5,  'dmg_val': 3, 'att_range': 5,   'ammo': 4,  'antiair': False },
+    6 : { 'name': 'Heavy Mortar',   'arm_pen': 4,  'dmg_val': 6, 'att_range': 10,  'ammo': 3,  'antiair': False }, 
+    7 : { 'name': 'MANPADS',        'arm_pen': 4,  'dmg_val': 5, 'att_range': 10,  'ammo': 3,  'antiair': True }, 
+}
+
+# Terrain definitions
+"""
+color: terrain color index (look at ascii_battle.TERRAIN_FG)
+shaded: background follows the elevation level (COLOR_L0..L4) instead of the terrain color
+"""
+TERRAIN_TYPES = {
+    '.': { 'name': 'Open terrain',  'cover_lvl': 0, 'conceal': 0, 'mov_cost': 1, 'el_height': 0,  'pass': True,   'los': True,  'color': COLOR_GRASS,    'shaded': True },
+    'f': { 'name': 'Light Woods',   'cover_lvl': 1, 'conceal': 2, 'mov_cost': 2, 'el_height': 1,  'pass': True,   'los': False, 'color': COLOR_FOREST,   'shaded': True },
+    '+': { 'name': 'Road',          'cover_lvl': 0, 'conceal': 0, 'mov_cost': 1, 'el_height': 0,  'pass': True,   'los': True,  'color': COLOR_ROAD,     'shaded': True },
+    '~': { 'name': 'Water',         'cover_lvl': 0, 'conceal': 0, 'mov_cost': 0, 'el_height': 0,  'pass': False,  'los': True,  'color': COLOR_WATER,    'shaded': False },
+    'F': { 'name': 'Heavy Woods',   'cover_lvl': 2, 'conceal': 3, 'mov_cost': 2, 'el_height': 1,  'pass': True,   'los': False, 'color': COLOR_FOREST,   'shaded': True },
+    'H': { 'name': 'House',         'cover_lvl': 2, 'conceal': 4, 'mov_cost': 2, 'el_height': 1,  'pass': True,   'los': False, 'color': COLOR_BUILDING, 'shaded': False },
+    '*': { 'name': 'Shrubbery',     'cover_lvl': 0, 'conceal': 1, 'mov_cost': 1, 'el_height': 0,  'pass': True,   'los': False, 'color': COLOR_SHRUB,    'shaded': True },
+}
+
+# Army starting positions, negative coordinates count from the right/bottom edge of the map
+START_POSITIONS_P1 = [(1,1),(1,3),(1,5),(2,2),(2,4),(2,7)]
+START_POSITIONS_P2 = [(-2,-2),(-2,-4),(-2,2),(-3,3),(-3,5),(-3,1)]
+
+ARMY_P1 = [">","X","O","T","m","R"]
+ARMY_P2 = ["X","X","T","O","X","X"]
+# Point budget of an army, see UNIT_TYPES cost
+ARMY_POINTS = 25
+
+# Hit chance and damage of every weapon x armor x cover x elevation difference, see combat.py
+COMBAT = CombatTable(
+    WEAPON_SYSTEM_TYPES,
+    max(un['arm'] for un in UNIT_TYPES.values()),
+    max(t['cover_lvl'] for t in TERRAIN_TYPES.values()),
+)
+
+
+class Battlefield:
+    # Static map data (terrain, elevation and everything derived from them),
+    # shared by every match played on the map. terrain holds character codes
+    # and elevation int8 levels, both (height, width) arrays. Derived data is
+    # built for the whole map on first use: starting a match builds the
+    # layers and the sight map (units look around as they are placed), the
+    # move costs come with the first move highlight, the connectivity with
+    # the first move and the route graphs with the first long route. Fog of
+    # war counters are per match, in chunks allocated around its units
+    # (visibility.py). The layers and the sight map are whole-map arrays of
+    # a few bytes per cell (about 50 MB for a match on 2048x2048), so memory
+    # grows with the map; only the renderer works in chunks (chunks.py).
+    def __init__(self, terrain, elevation):
+        self.terrain = terrain
+        self.elevation = elevation
+        self.height, self.width = terrain.shape
+        if elevation.shape != terrain.shape:
+            raise ValueError('Elevation grid size must match map size!')
+        # (map file, elevation file) the map was loaded from, if any
+        self.files = None
+
+    @classmethod
+    def from_files(cls, map_file, elev_file=None):
+        # Compiled .map files carry their own elevation, text maps need the CSV
+        if map_file.endswith(MAP_EXT):
+            field = cls(*read_map(map_file))
+        else:
+            field = cls(grid_array(load_map(map_file)), elevation_array(load_elev(elev_file)))
+        field.files = (map_file, elev_file)
+        return field
+
+    def terrain_at(self, x, y):
+        return chr(self.terrain[y, x])
+
+    @cached_property
+    def layers(self):
+        return MapLayers(self.terrain, self.elevation, TERRAIN_TYPES)
+
+    @cached_property
+    def move_costs(self):
+        return movement_costs(self.layers)
+
+    @cached_property
+    def sight(self):
+        return SightMap(self.layers)
+
+    @cached_property
+    def connectivity(self):
+        return Connectivity(self.layers)
+
+    @cached_property
+    def route_graphs(self):
+        return route_graphs(self.layers)
+
+    def problems(self):
+        # Reasons the default armies could never meet on this map, [] if none
+        return self.connectivity.start_problems(START_POSITIONS_P1, START_POSITIONS_P2)
+
+
+class Engine:
+    def __init__(self, field, army_p1=ARMY_P1, army_p2=ARMY_P2, seed=None):
+        self.field = field
+        self.terrain = field.terrain
+        self.elevation = field.elevation
+        self.layers = field.layers
+        self.width = field.width
+        self.height = field.height
+        self.armies = (list(army_p1), list(army_p2))
+
+        # Every match has a seed, so any match can be replayed (replay.py). Dice
+        # rolls of attacks come from their own generator, so players drawing
+        # from `rng` don't change them and a replay needs only the commands.
+        if seed is None:
+            seed = random.randrange(1 << 63)
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.dice = random.Random(f"dice-{seed}")
+        # ReplayLog recording every command that succeeds, None if not recording
+        self.log = None
+        self.turn = 1
+        self.turn_count = 1
+        self.units = UnitStore(UNIT_TYPES, WEAPON_SYSTEM_TYPES)
+        self.message = ""
+        # Damage dealt and kills scored, keyed by (owner, kind) of the attacker
+        self.damage = Counter()
+        self.kills = Counter()
+        # Cells whose contents changed, views drain this to know what to redraw
+        self.dirty = set()
+        self.occupancy = OccupancyGrid(self.width, self.height)
+        self.pathfinder = Pathfinder(field, self.occupancy)
+        self.visibility = Visibility(field.sight, OPTICS_RANGE)
+        self.populate_units(army_p1, army_p2)
+
+    def clone(self):
+        # Independent copy of the match state for look-ahead search. The map
+        # data is shared; units, occupancy and fog of war are copied as flat
+        # arrays and nothing is recomputed. Unit handles of the copy are
+        # clone.units[u.index].
+        e = Engine.__new__(Engine)
+        e.field = self.field
+        e.terrain = self.terrain
+        e.elevation = self.elevation
+        e.layers = self.layers
+        e.width = self.width
+        e.height = self.height
+        e.armies = self.armies
+        e.seed = self.seed
+        e.rng = random.Random()
+        e.rng.setstate(self.rng.getstate())
+        e.dice = random.Random()
+        e.dice.setstate(self.dice.getstate())
+        e.log = None
+        e.turn = self.turn
+        e.turn_count = self.turn_count
+        e.units = self.units.copy()
+        e.message = ""
+        e.damage = Counter(self.damage)
+        e.kills = Counter(self.kills)
+        e.dirty = set()
+        e.occupancy = self.occupancy.copy(e.units)
+        e.pathfinder = Pathfinder(self.field, e.occupancy)
+        e.visibility = self.visibility.copy(e.units)
+        return e
+
+    def populate_units(self, army_p1, army_p2):
+        # Place units for each side: P1 on left, P2 on right
+        for (x,y), kind in zip(START_POSITIONS_P1, army_p1):
+            self.add_unit(x % self.width, y % self.height, 1, kind)
+        for (x,y), kind in zip(START_POSITIONS_P2, army_p2):
+            self.add_unit(x % self.width, y % self.height, 2, kind)
+
+    def add_unit(self, x, y, owner, kind):
+        if self.unit_at(x, y):
+            raise ValueError(f"Cell ({x},{y}) is already occupied")
+        unit = self.units.add(x, y, owner, kind)
+        self.occupancy.add(unit)
+        self.visibility.add(unit)
+        self.dirty.add((unit.x, unit.y))
+        return unit
+
+    def move_unit(self, unit, x, y):
+        self.dirty.add((unit.x, unit.y))
+        self.occupancy.move(unit, x, y)
+        self.visibility.update(unit)
+        self.dirty.add((x, y))
+
+    def kill_unit(self, unit):
+        self.occupancy.remove(unit)
+        self.visibility.remove(unit)
+        self.dirty.add((unit.x, unit.y))
+
+    def unit_at(self, x, y):
+        # Occupancy grid only holds living units
+        return self.occupancy.get(x, y)
+
+    def is_spotted(self, player, x, y):
+        return self.visibility.is_spotted(player, x, y)
+
+    def reachable(self, unit):
+        return self.pathfinder.reachable(unit)
+
+    def weapon_for(self, unit, target):
+        # Weapon slot (1 or 2) of the first weapon system that reaches the
+        # target, has ammo left and can get through its armor; None if none
+        dist = unit.distance_to(target.x, target.y)
+        arm = target.arm
+        for slot, ws, ammo in ((1, unit.ws1, unit.ws1_ammo), (2, unit.ws2, unit.ws2_ammo)):
+            if ammo > 0 and dist <= WEAPON_SYSTEM_TYPES[ws]['att_range'] and COMBAT.can_hurt(ws, arm):
+                return slot
+        return None
+
+    def attack_index(self, unit, target, slot):
+        # COMBAT index of `unit` shooting at `target` with weapon `slot`
+        ws = unit.ws1 if slot == 1 else unit.ws2
+        cover = 0 if target.flying else int(self.layers.cover[target.y, target.x])
+        delta = int(self.elevation[unit.y, unit.x]) - int(self.elevation[target.y, target.x])
+        return COMBAT.index(ws, target.arm, cover, delta, target.flying)
+
+    def attack_indices(self, units, targets):
+        # COMBAT index of every units[k] shooting at targets[k] from where they
+        # stand, with the weapon weapon_for() would pick; -1 where it has none
+        store = self.units
+        if not units:
+            return np.zeros(0, np.int64)
+        a = np.array([u.index for u in units])
+        t = np.array([u.index for u in targets])
+        x, y, own, hp = store.columns()
+        kind = np.frombuffer(store.kind, np.uint8)
+        types = [store.unit_types[k] for k in store.kinds]
+        arm = np.array([un['arm'] for un in types])[kind[t]]
+        flying = np.array([un['flying'] for un in types])[kind[t]]
+        ax, ay, tx, ty = x[a], y[a], x[t], y[t]
+        dist = np.abs(ax - tx) + np.abs(ay - ty)
+        cover = np.where(flying, 0, self.layers.cover[ty, tx])
+        delta = self.elevation[ay, ax].astype(np.int16) - self.elevation[ty, tx]
+        att_range = np.array([WEAPON_SYSTEM_TYPES[ws]['att_range'] for ws in range(len(WEAPON_SYSTEM_TYPES))])
+        result = np.full(len(a), -1, np.int64)
+        # Slot 2 first, slot 1 overwrites it where both can shoot
+        for slot in ('ws2', 'ws1'):
+            ws = np.array([un[slot] for un in types])[kind[a]]
+            ammo = np.frombuffer(getattr(store, slot + '_ammo'), np.int16)[a]
+            idx = COMBAT.indices(ws, arm, cover, delta, flying)
+            ok = (ammo > 0) & (dist <= att_range[ws]) & (COMBAT.high_array[idx] > 0)
+            result[ok] = idx[ok]
+        return result
+
+    def expected_damage(self, unit, targets):
+        # Expected damage of `unit` attacking each of `targets` from where it stands
+        idx = self.attack_indices([unit] * len(targets), targets)
+        return np.where(idx >= 0, COMBAT.expected_array[idx], 0.0)
+
+    def targets(self, unit):
+        # Spotted enemy units the unit could attack from where it stands
+        reach = max(WEAPON_SYSTEM_TYPES[ws]['att_range'] for ws in (unit.ws1, unit.ws2))
+        enemy = 2 if unit.owner == 1 else 1
+        return [u for u in self.units.within(unit.x, unit.y, reach, enemy)
+                if self.is_spotted(unit.owner, u.x, u.y)
+                and self.weapon_for(unit, u) is not None]
+
+    def threat_map(self, player, arm=0, flying=False, enemies=None):
+        # Expected damage living enemies of `player` (or just `enemies`) could
+        # deal to a unit with armor `arm` in each cell without moving, summed
+        # over all of them (each picks its weapon like weapon_for does); cover
+        # and elevation count, flying units get no cover
+        threat = np.zeros((self.height, self.width), np.float32)
+        if enemies is None:
+            enemies = self.units.alive(2 if player == 1 else 1)
+        cover = 0 if flying else self.layers.cover
+        ground = self.elevation.astype(np.int16)
+        for u in enemies:
+            dist = self.layers.distance_from(u.x, u.y)
+            delta = ground[u.y, u.x] - ground
+            dmg = np.zeros_like(threat)
+            for ws, ammo in ((u.ws2, u.ws2_ammo), (u.ws1, u.ws1_ammo)):   # ws1 last, it wins where both reach
+                if ammo > 0 and COMBAT.can_hurt(ws, arm):
+                    expected = COMBAT.expected_array[COMBAT.indices(ws, arm, cover, delta, flying)]
+                    in_range = dist <= WEAPON_SYSTEM_TYPES[ws]['att_range']
+                    dmg[in_range] = expected[in_range]
+            threat += dmg
+        return threat
+
+    def move(self, unit, x, y):
+        if unit.owner != self.turn:
+            self.message = "Selected unit does not belong to you."
+            return False
+        if not unit.is_alive():
+            self.message = "Selected unit is dead."
+            return False
+        if unit.moved:
+            self.message = "Selected unit already moved this turn."
+            return False
+        if self.unit_at(x, y):
+            self.message = "Target cell is occupied."
+            return False
+        if not self.pathfinder.connected(unit, x, y):
+            self.message = "Target cell can never be reached by this unit."
+            return False
+        reach = self.pathfinder.reachable(unit)
+        if not reach.can_reach(x, y):
+            self.message = "Target cell is out of reach."
+            return False
+        cost = reach.cost_to(x, y)
+        if self.log:
+            self.log.move(unit, x, y)
+        # perform move
+        self.move_unit(unit, x, y)
+        unit.moved = True
+        self.message = f"Moved to ({x},{y}) (cost: {cost})."
+        return True
+
+    def attack(self, unit, target):
+        # Hit chance and damage come from COMBAT (armor, cover, elevation),
+        # every attack spends one round of the weapon used, hit or miss
+        if unit.owner != self.turn:
+            self.message = "Selected unit does not belong to you."
+            return False
+        if not unit.is_alive():
+            self.message = "Selected unit is dead."
+            return False
+        if unit.acted:
+            self.message = "Selected unit already acted this turn."
+            return False
+        # Only enemies spotted by any friendly unit can be targeted
+        if not target or not target.is_alive() or target.owner == unit.owner or not self.is_spotted(unit.owner, target.x, target.y):
+            self.message = "No enemy at target to attack."
+            return False
+        slot = self.weapon_for(unit, target)
+        if slot is None:
+            self.message = "Target out of range, out of ammo or too well armored!"
+            return False
+        if self.log:
+            self.log.attack(unit, target)
+        # perform attack
+        if slot == 1:
+            ws = unit.ws1
+            unit.ws1_ammo -= 1
+        else:
+            ws = unit.ws2
+            unit.ws2_ammo -= 1
+        hit, dmg = COMBAT.resolve(self.attack_index(unit, target, slot), self.dice)
+        unit.acted = True
+        name = WEAPON_SYSTEM_TYPES[ws]['name']
+        if not hit:
+            self.message = f"Attacked enemy with {name}, missed."
+            return True
+        target.hp -= dmg
+        self.damage[unit.owner, unit.kind] += dmg
+        self.dirty.add((target.x, target.y))
+        self.message = f"Attacked enemy with {name} for {dmg} dmg."
+        if target.hp <= 0:
+            self.kill_unit(target)
+            self.kills[unit.owner, unit.kind] += 1
+            self.message += " Enemy died!"
+        return True
+
+    def end_turn(self):
+        if self.log:
+            self.log.end_turn()
+        # reset moved/acted flags for next player's units
+        self.units.reset_turn(self.turn)
+        # swap turn
+        self.turn = 2 if self.turn == 1 else 1
+        self.turn_count += 1
+        self.message = f"Player {self.turn}'s turn."
+
+    def check_victory(self):
+        p1_alive = self.units.any_alive(1)
+        p2_alive = self.units.any_alive(2)
+        if not p1_alive:
+            return 2
+        if not p2_alive:
+            return 1
+        return None
+
+        # ADD OBJECTIVES...
@@ -0,0 +1,405 @@
+"""
+Hierarchical pathfinding (HPA*) for long routes on big maps.
+
+The map is cut into square clusters of CLUSTER cells a side. Wherever two
+neighbouring clusters share a run of border cells enterable on both sides,
+the run gets entrances: pairs of cells facing each other across the border
+(one in the middle of a short run, one at each end of a long one). Those
+cells are the nodes of an abstract graph whose edges are
+
+    across      the two cells of an entrance, one step apart
+    inside      every pair of nodes of a cluster, at the cost of the
+                cheapest route between them that stays in the cluster
+
+A route search hooks start and goal up to the nodes of their clusters, runs
+A* over the abstract graph and returns a Route of waypoints. Legs between
+waypoints are turned into cells only when asked for, so a multi-turn order
+refines its first leg right away and the rest as the unit gets there.
+
+Cluster data is built the first time a search reaches the cluster and is
+kept until the cost of one of its cells changes (set_cost), which drops
+just that cluster and, for a cell on its edge, the neighbour across it.
+Costs inside a cluster come from distance_fields(), which relaxes all of
+the cluster's nodes at once with directional sweeps, each a NumPy scan
+(minimum.accumulate over prefix sums of the step costs).
+
+graph.distances(gx, gy) answers the other question scripted players ask:
+the route cost from every cell to one goal (Distances), by the same
+entrances, searching backwards from the goal only as far as the cells
+asked about need. Goals are kept until a cost changes.
+
+Routes pass through entrances, so they can be a few percent longer than
+the best one. Like connectivity.py they only know the terrain, not units.
+Battlefield.route_graphs holds one graph per movement class, Pathfinder.route
+picks the unit's.
+"""
+
+import heapq
+
+import numpy as np
+
+CLUSTER = 32            # cluster side in cells
+LONG_RUN = 6            # border runs this long get an entrance at both ends
+SPACING = 8            # and more in between, at most this far apart
+BLOCKED = 1 << 24       # step cost of cells that can't be entered, beyond any real route
+INFINITE = 1 << 48
+GOALS = 256             # cost fields of this many goals are kept per graph
+
+
+def distance_fields(steps, sources):
+    # (len(sources), h, w) cheapest cost from each (y, x) source to every cell
+    # of the window, paying the step cost of each cell entered; >= BLOCKED
+    # means there is no way.
+    k = len(sources)
+    h, w = steps.shape
+    d = np.full((k, h, w), INFINITE, np.int64)
+    ys, xs = np.array(sources, np.intp).reshape(k, 2).T
+    d[np.arange(k), ys, xs] = 0
+    return relax(steps, d)
+
+
+def relax(steps, d):
+    # Lower the (k, h, w) costs in d to the cheapest way from any of their
+    # finite cells, paying the step cost of each cell entered. Every pass
+    # sweeps right, left, down and up; a pass that changes nothing ends it.
+    # Cost of entering every cell from the start of the row/column to here
+    right = np.cumsum(steps, axis=1)
+    left = np.cumsum(steps[:, ::-1], axis=1)[:, ::-1]
+    down = np.cumsum(steps, axis=0)
+    up = np.cumsum(steps[::-1], axis=0)[::-1]
+    while True:
+        old = d
+        d = right + np.minimum.accumulate(d - right, axis=2)
+        d = left + np.minimum.accumulate((d - left)[:, :, ::-1], axis=2)[:, :, ::-1]
+        d = down + np.minimum.accumulate(d - down, axis=1)
+        d = up + np.minimum.accumulate((d - up)[:, ::-1], axis=1)[:, ::-1]
+        if np.array_equal(d, old):
+            return d
+
+
+def entrances(open_cells):
+    # Offsets along a border of its entrance cells
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], open_cells.view(np.int8), [0]))))
+    offsets = []
+    for start, end in zip(edges[::2].tolist(), edges[1::2].tolist()):
+        if end - start >= LONG_RUN:
+            # Both ends and evenly spread ones in between, at most SPACING apart
+            n = -(-(end - 1 - start) // SPACING)
+            offsets += [start + (end - 1 - start) * i // n for i in range(n + 1)]
+        else:
+            offsets.append((start + end - 1) // 2)
+    return offsets
+
+
+class Route:
+    def __init__(self, graph, waypoints, cost):
+        self.graph = graph
+        self.waypoints = waypoints  # cell indices, start first and goal last
+        self.cost = cost            # total cost of the route
+        self.legs = {}
+
+    def leg(self, i):
+        # Cells (x, y) from waypoint i (excluded) to waypoint i + 1, None if
+        # the map changed so that they aren't connected any more
+        path = self.legs.get(i)
+        if path is None:
+            path = self.graph.local_path(self.waypoints[i], self.waypoints[i + 1])
+            self.legs[i] = path
+        return path
+
+    def cells(self):
+        # Every cell of the route, refining leg after leg as they are taken
+        for i in range(len(self.waypoints) - 1):
+            path = self.leg(i)
+            if path is None:
+                return
+            yield from path
+
+
+class Distances:
+    def __init__(self, graph, gx, gy):
+        # Route cost from every cell to the goal (gx, gy): the cheapest way to
+        # a node of the cell's cluster plus that node's cost to the goal. Node
+        # costs come from a Dijkstra search backwards from the goal that only
+        # goes as far as the clusters asked about need; a cluster's cells are
+        # filled in the first time one of them is asked about.
+        self.graph = graph
+        self.goal = gy * graph.width + gx
+        self.fields = {}    # (cx, cy) -> cost of every cell of the cluster
+        self.node_costs = {}
+        self.settled = set()
+        self.heap = []
+        self.direct = None
+        if graph.steps[gy, gx] >= BLOCKED:
+            return
+        w = graph.width
+        x0, y0, steps = graph.window(*graph.cluster_of(self.goal))
+        to_goal = distance_fields(steps, [(gy - y0, gx - x0)])[0]
+        # Reversing a route swaps which end's step is paid
+        self.direct = to_goal - steps + int(graph.steps[gy, gx])
+        for n in graph.cluster(*graph.cluster_of(self.goal)):
+            c = int(self.direct[n // w - y0, n % w - x0])
+            if c < BLOCKED:
+                self.node_costs[n] = c
+                heapq.heappush(self.heap, (c, n))
+
+    def settle(self, nodes):
+        # Run the backward search until every one of `nodes` has its final
+        # cost, or nothing more can reach the goal
+        graph = self.graph
+        flat = graph.steps.ravel()
+        pending = set(nodes) - self.settled
+        while pending and self.heap:
+            c, n = heapq.heappop(self.heap)
+            if n in self.settled:
+                continue
+            self.settled.add(n)
+            pending.discard(n)
+            for m, step in graph.cluster(*graph.cluster_of(n))[n]:
+                # Edges are there both ways, m -> n costs what n -> m does
+                # with the other end's step paid
+                mc = c + step - int(flat[m]) + int(flat[n])
+                if mc < self.node_costs.get(m, INFINITE):
+                    self.node_costs[m] = mc
+                    heapq.heappush(self.heap, (mc, m))
+
+    def field(self, cx, cy):
+        # Cost to the goal of every cell of a cluster, >= BLOCKED for none
+        key = (cx, cy)
+        costs = self.fields.get(key)
+        if costs is not None:
+            return costs
+        graph = self.graph
+        w = graph.width
+        x0, y0, steps = graph.window(cx, cy)
+        nodes = list(graph.cluster(cx, cy))
+        self.settle(nodes)
+        d = np.full((1,) + steps.shape, INFINITE, np.int64)
+        for n in nodes:
+            if n in self.settled:
+                # Seeded with the step into the node, which leaving a cell
+                # for it pays and relax() charges again
+                d[0, n // w - y0, n % w - x0] = self.node_costs[n] + int(graph.steps.flat[n])
+        costs = relax(steps, d)[0] - steps
+        if key == graph.cluster_of(self.goal) and self.direct is not None:
+            costs = np.minimum(costs, self.direct)
+        costs[(steps >= BLOCKED) | (costs >= BLOCKED)] = INFINITE
+        self.fields[key] = costs
+        return costs
+
+    def at(self, x, y):
+        s = self.graph.size
+        return int(self.field(x // s, y // s)[y % s, x % s])
+
+    def costs(self, xs, ys):
+        # Costs of many cells, one array lookup per cluster they fall in
+        xs, ys = np.asarray(xs), np.asarray(ys)
+        s = self.graph.size
+        out = np.empty(len(xs), np.int64)
+        keys = (ys // s) * (self.graph.width // s + 1) + xs // s
+        for key in np.unique(keys).tolist():
+            mask = keys == key
+            field = self.field(int(xs[mask][0]) // s, int(ys[mask][0]) // s)
+            out[mask] = field[ys[mask] % s, xs[mask] % s]
+        return out
+
+
+class AbstractGraph:
+    def __init__(self, cost, cluster=CLUSTER):
+        # cost: (height, width) step cost of every cell, 0 = can't be entered
+        self.height, self.width = cost.shape
+        self.size = cluster
+        self.steps = np.where(cost > 0, cost.astype(np.int32), BLOCKED)
+        self.borders = {}   # (cx, cy, 'r' or 'd') -> [(cell, cell across)] to the right/lower neighbour
+        self.clusters = {}  # (cx, cy) -> {node: [(node, cost)]}, across and inside edges
+        self.goals = {}     # goal cell -> Distances, dropped on any set_cost
+
+    def cluster_of(self, cell):
+        y, x = divmod(cell, self.width)
+        return x // self.size, y // self.size
+
+    def window(self, cx, cy):
+        # Top left corner and step costs of a cluster
+        x0, y0 = cx * self.size, cy * self.size
+        return x0, y0, self.steps[y0:y0 + self.size, x0:x0 + self.size]
+
+    def border(self, cx, cy, side):
+        key = (cx, cy, side)
+        pairs = self.borders.get(key)
+        if pairs is None:
+            s, w = self.size, self.width
+            if side == 'r':
+                x = cx * s + s - 1
+                y0, y1 = cy * s, min(cy * s + s, self.height)
+                pairs = []
+                if x + 1 < self.width:
+                    mine, theirs = self.steps[y0:y1, x], self.steps[y0:y1, x + 1]
+                    for i in entrances((mine < BLOCKED) & (theirs < BLOCKED)):
+                        pairs.append(((y0 + i) * w + x, (y0 + i) * w + x + 1))
+            else:
+                y = cy * s + s - 1
+                x0, x1 = cx * s, min(cx * s + s, w)
+                pairs = []
+                if y + 1 < self.height:
+                    mine, theirs = self.steps[y, x0:x1], self.steps[y + 1, x0:x1]
+                    for i in entrances((mine < BLOCKED) & (theirs < BLOCKED)):
+                        pairs.append((y * w + x0 + i, (y + 1) * w + x0 + i))
+            self.borders[key] = pairs
+        return pairs
+
+    def cluster(self, cx, cy):
+        # Edges of the nodes of a cluster, built on first use
+        key = (cx, cy)
+        edges = self.clusters.get(key)
+        if edges is not None:
+            return edges
+        flat = self.steps.ravel()
+        edges = {}
+        across = self.border(cx, cy, 'r') + self.border(cx, cy, 'd')
+        if cx > 0:
+            across += [(b, a) for a, b in self.border(cx - 1, cy, 'r')]
+        if cy > 0:
+            across += [(b, a) for a, b in self.border(cx, cy - 1, 'd')]
+        for node, other in across:
+            edges.setdefault(node, []).append((other, int(flat[other])))
+        nodes = list(edges)
+        if nodes:
+            x0, y0, steps = self.window(cx, cy)
+            ys = [n // self.width - y0 for n in nodes]
+            xs = [n % self.width - x0 for n in nodes]
+            costs = distance_fields(steps, list(zip(ys, xs)))[:, ys, xs].tolist()
+            for a, row in zip(nodes, costs):
+                for b, c in zip(nodes, row):
+                    if b != a and c < BLOCKED:
+                        edges[a].append((b, c))
+        self.clusters[key] = edges
+        return edges
+
+    def set_cost(self, x, y, cost):
+        # Change the step cost of a cell (0 = can't be entered), dropping only
+        # the cluster data that depends on it
+        self.steps[y, x] = cost if cost > 0 else BLOCKED
+        s = self.size
+        cx, cy = x // s, y // s
+        stale = [(cx, cy)]
+        if x % s == s - 1:
+            self.borders.pop((cx, cy, 'r'), None)
+            stale.append((cx + 1, cy))
+        if x % s == 0 and cx > 0:
+            self.borders.pop((cx - 1, cy, 'r'), None)
+            stale.append((cx - 1, cy))
+        if y % s == s - 1:
+            self.borders.pop((cx, cy, 'd'), None)
+            stale.append((cx, cy + 1))
+        if y % s == 0 and cy > 0:
+            self.borders.pop((cx, cy - 1, 'd'), None)
+            stale.append((cx, cy - 1))
+        for key in stale:
+            self.clusters.pop(key, None)
+        self.goals = {}
+
+    def distances(self, gx, gy):
+        # Route costs to (gx, gy) from anywhere (Distances), kept for the
+        # next GOALS goals asked about
+        goal = gy * self.width + gx
+        found = self.goals.get(goal)
+        if found is None:
+            if len(self.goals) >= GOALS:
+                self.goals = {}
+            found = self.goals[goal] = Distances(self, gx, gy)
+        return found
+
+    def local_path(self, a, b):
+        # Cells (x, y) from cell a (excluded) to cell b, staying in a's cluster
+        # unless b is right next to a; None if there is no such path
+        w = self.width
+        ay, ax = divmod(a, w)
+        by, bx = divmod(b, w)
+        if abs(ax - bx) + abs(ay - by) == 1:
+            return [(bx, by)] if self.steps[by, bx] < BLOCKED else None
+        x0, y0, steps = self.window(*self.cluster_of(a))
+        d = distance_fields(steps, [(ay - y0, ax - x0)])[0]
+        y, x = by - y0, bx - x0
+        if not (0 <= y < d.shape[0] and 0 <= x < d.shape[1]) or d[y, x] >= BLOCKED:
+            return None
+        path = []
+        while d[y, x] > 0:
+            path.append((x + x0, y + y0))
+            before = d[y, x] - steps[y, x]
+            for nx, ny in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+                if 0 <= ny < d.shape[0] and 0 <= nx < d.shape[1] and d[ny, nx] == before:
+                    x, y = nx, ny
+                    break
+        path.reverse()
+        return path
+
+    def route(self, sx, sy, gx, gy):
+        # Route from (sx, sy) to (gx, gy), None if there is none
+        w = self.width
+        start, goal = sy * w + sx, gy * w + gx
+        if self.steps[gy, gx] >= BLOCKED:
+            return None
+        if start == goal:
+            return Route(self, [start], 0)
+
+        # Hook the start up to the nodes of its cluster, and those of the
+        # goal's cluster up to the goal. Reversing a route swaps which end's
+        # step is paid: cost(n -> goal) = cost(goal -> n) - step(n) + step(goal).
+        sc, gc = self.cluster_of(start), self.cluster_of(goal)
+        x0, y0, steps = self.window(*sc)
+        from_start = distance_fields(steps, [(sy - y0, sx - x0)])[0]
+        out = [(n, int(from_start[n // w - y0, n % w - x0])) for n in self.cluster(*sc)]
+        out = [(n, c) for n, c in out if c < BLOCKED]
+        if sc == gc:
+            direct = int(from_start[gy - y0, gx - x0])
+            if direct < BLOCKED:
+                out.append((goal, direct))
+        x0, y0, steps = self.window(*gc)
+        to_goal = distance_fields(steps, [(gy - y0, gx - x0)])[0]
+        last = int(self.steps[gy, gx])
+        into = {}
+        for n in self.cluster(*gc):
+            c = int(to_goal[n // w - y0, n % w - x0])
+            if c < BLOCKED:
+                into[n] = c - int(self.steps.flat[n]) + last
+
+        # A* over the abstract graph, every step costs at least 1
+        best = {start: 0}
+        prev = {}
+        heap = [(abs(sx - gx) + abs(sy - gy), 0, start)]
+        while heap:
+            f, c, n = heapq.heappop(heap)
+            if n == goal:
+                break
+            if c > best[n]:
+                continue
+            if n == start:
+                edges = out + self.cluster(*sc).get(start, [])
+            else:
+                edges = self.cluster(*self.cluster_of(n))[n]
+                if n in into:
+                    edges = edges + [(goal, into[n])]
+            for m, step in edges:
+                nc = c + step
+                if nc < best.get(m, INFINITE):
+                    best[m] = nc
+                    prev[m] = n
+                    my, mx = divmod(m, w)
+                    heapq.heappush(heap, (nc + abs(mx - gx) + abs(my - gy), nc, m))
+        else:
+            return None
+
+        waypoints = [goal]
+        while waypoints[-1] != start:
+            waypoints.append(prev[waypoints[-1]])
+        waypoints.reverse()
+        return Route(self, waypoints, best[goal])
+
+
+def route_graphs(layers):
+    # Abstract graphs for ground, amphibious and flying units; cheap to make,
+    # clusters are only built as searches reach them
+    ground = np.where(layers.passable, layers.move_cost, 0)
+    amph = np.where(layers.known, layers.move_cost, 0)
+    flying = np.ones((layers.height, layers.width), np.int32)
+    return AbstractGraph(ground), AbstractGraph(amph), AbstractGraph(flying)
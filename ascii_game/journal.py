@@ -0,0 +1,206 @@
+# coding=utf-8
+#
+# Undo journal for ASCII Mapper.
+#
+# Every stroke, fill or resize becomes one Edit. An Edit does not hold a
+# snapshot of the map, only the cells that changed in each layer (a Diff
+# per MapDoc), grouped in runs: a run is a stretch of cells on one row
+# that all went from the same old character to the same new one. A flood
+# fill of 100k cells is then a few hundred runs, and undoing or redoing an
+# edit costs as much as the edit.
+
+from __future__ import division
+from __future__ import print_function
+
+from array import array
+
+
+class Diff(object):
+	# The runs changed in one MapDoc
+	def __init__(self, doc):
+		self.doc = doc
+		self.ys = array("i")
+		self.xs = array("i")
+		self.counts = array("i")
+		self.olds = []		# None: the cell did not exist before (resize)
+		self.news = []		# None: the cell does not exist after (resize)
+		self.size = None	# (old width, old height, new width, new height)
+
+	def __len__(self):
+		return len(self.counts)
+
+	def record(self, x, y, count, old, new):
+		# Extend the last run when the cells carry on from it
+		last = len(self.counts) - 1
+		if (last >= 0 and self.ys[last] == y
+				and self.xs[last] + self.counts[last] == x
+				and self.olds[last] == old and self.news[last] == new):
+			self.counts[last] += count
+		else:
+			self.ys.append(y)
+			self.xs.append(x)
+			self.counts.append(count)
+			self.olds.append(old)
+			self.news.append(new)
+
+	def apply(self, forward):
+		# Put the new (forward) or old characters back; runs are replayed
+		# in reverse when undoing, as a stroke can go over a cell twice
+		doc = self.doc
+		if self.size is not None:
+			if forward:
+				doc.reshape(self.size[2], self.size[3], " ")
+			else:
+				doc.reshape(self.size[0], self.size[1], " ")
+		chars = self.news if forward else self.olds
+		order = range(len(self.counts))
+		if not forward:
+			order = reversed(order)
+		for i in order:
+			char = chars[i]
+			if char is not None:
+				x = self.xs[i]
+				count = self.counts[i]
+				doc.rows[self.ys[i]][x:x + count] = [char] * count
+
+
+class Edit(object):
+	# One step of undo: the diffs of every layer it touched, in order
+	def __init__(self):
+		self.diffs = []
+
+	def __len__(self):
+		return sum([len(diff) for diff in self.diffs])
+
+	def diff(self, doc):
+		# Diff recording changes to doc; a resize always starts a new one
+		if self.diffs:
+			last = self.diffs[-1]
+			if last.doc is doc and last.size is None:
+				return last
+		diff = Diff(doc)
+		self.diffs.append(diff)
+		return diff
+
+	def apply(self, forward):
+		diffs = self.diffs if forward else reversed(self.diffs)
+		for diff in diffs:
+			diff.apply(forward)
+
+	def resized(self):
+		return any([diff.size is not None for diff in self.diffs])
+
+	def docs(self):
+		docs = []
+		for diff in self.diffs:
+			if diff.doc not in docs:
+				docs.append(diff.doc)
+		return docs
+
+	def cell_count(self, doc):
+		return sum([sum(diff.counts) for diff in self.diffs if diff.doc is doc])
+
+	def rows(self, doc):
+		rows = set()
+		for diff in self.diffs:
+			if diff.doc is doc:
+				rows.update(diff.ys)
+		return rows
+
+	def cells(self, doc):
+		# Every cell of doc touched, for redrawing
+		cells = []
+		for diff in self.diffs:
+			if diff.doc is doc:
+				for i in range(len(diff.counts)):
+					y = diff.ys[i]
+					x = diff.xs[i]
+					cells.extend([(x + j, y) for j in range(diff.counts[i])])
+		return cells
+
+
+class Journal(object):
+	# Edits are dropped oldest first once there are more than max_edits of
+	# them or they hold more than max_runs runs between them (a run takes
+	# about 30 bytes); the newest edit is always kept
+	def __init__(self, max_edits=100, max_runs=250000):
+		self.max_edits = max_edits
+		self.max_runs = max_runs
+		self.undo_stack = []
+		self.redo_stack = []
+		self.runs = 0
+		self.current = None
+
+	def begin(self):
+		self.end()
+		self.current = Edit()
+
+	def end(self):
+		edit = self.current
+		self.current = None
+		if edit is None or not edit.diffs:
+			return
+		self.undo_stack.append(edit)
+		self.runs += len(edit)
+		for e in self.redo_stack:
+			self.runs -= len(e)
+		del self.redo_stack[:]
+		self.evict()
+
+	def evict(self):
+		while len(self.undo_stack) > 1 and (
+				len(self.undo_stack) > self.max_edits or self.runs > self.max_runs):
+			self.runs -= len(self.undo_stack.pop(0))
+
+	def record(self, doc, x, y, count, old, new):
+		if self.current is not None:
+			self.current.diff(doc).record(x, y, count, old, new)
+
+	def resized(self, doc, width, height, filler):
+		# Called before doc changes size: remember the cells cut off and
+		# the ones that will be added, a row at a time
+		if self.current is None:
+			return
+		diff = Diff(doc)
+		self.current.diffs.append(diff)
+		diff.size = (doc.width, doc.height, width, height)
+		for y in range(doc.height):
+			row = doc.rows[y]
+			start = width if y < height else 0
+			for x in range(start, doc.width):
+				diff.record(x, y, 1, row[x], None)
+		for y in range(height):
+			start = doc.width if y < doc.height else 0
+			if start < width:
+				diff.record(start, y, width - start, None, filler)
+
+	def can_undo(self):
+		return len(self.undo_stack) > 0
+
+	def can_redo(self):
+		return len(self.redo_stack) > 0
+
+	def undo(self):
+		# Returns the edit taken back, or None
+		self.end()
+		if not self.undo_stack:
+			return None
+		edit = self.undo_stack.pop()
+		edit.apply(False)
+		self.redo_stack.append(edit)
+		return edit
+
+	def redo(self):
+		self.end()
+		if not self.redo_stack:
+			return None
+		edit = self.redo_stack.pop()
+		edit.apply(True)
+		self.undo_stack.append(edit)
+		return edit
+
+	def clear(self):
+		self.current = None
+		del self.undo_stack[:]
+		del self.redo_stack[:]
+		self.runs = 0
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Load generator for server.py.
+
+Opens --matches matches with two scripted players each, all from one
+asyncio process. On its turn a player sends --actions commands (move a
+random unit of its own to a random cell it can reach, shoot when something
+is in range) and then ends the turn, each time waiting for the answer
+before the next command. Round-trip latencies of the commands the server
+carried out are reported as percentiles, refused ones are only counted,
+together with the size of the deltas the server sent.
+
+    python3 server.py &
+    python3 loadgen.py --matches 200 --turns 20
+    python3 loadgen.py --spawn --matches 500      (starts its own server)
+"""
+
+import argparse
+import asyncio
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import protocol
+from server import DEFAULT_PORT
+
+# Fields by map, so all players of the process share one Battlefield
+fields = {}
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []     # seconds per command carried out
+        self.delta_bytes = []   # size of every delta received
+        self.full_bytes = []    # size of the unit rows of every welcome
+        self.errors = 0
+
+
+async def player(host, port, match, turns, actions, seed, stats):
+    reader, writer = await asyncio.open_connection(host, port)
+    rng = random.Random(seed)
+
+    async def receive():
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection.")
+        msg = protocol.decode(line)
+        if msg['op'] == 'delta':
+            stats.delta_bytes.append(len(line))
+            protocol.apply(engine, msg)
+        return msg
+
+    async def command(msg):
+        t0 = time.perf_counter()
+        writer.write(protocol.encode(msg))
+        await writer.drain()
+        # Everything arriving during our turn answers our own commands
+        while True:
+            answer = await receive()
+            if answer['op'] in ('delta', 'error'):
+                break
+        if answer['op'] == 'error':
+            stats.errors += 1
+        else:
+            stats.latencies.append(time.perf_counter() - t0)
+
+    writer.write(protocol.encode({'op': 'join', 'match': match}))
+    welcome = protocol.decode(await reader.readline())
+    key = tuple(welcome['map'])
+    engine = protocol.mirror(welcome, fields.get(key))
+    fields.setdefault(key, engine.field)
+    stats.full_bytes.append(len(protocol.encode(welcome['units'])))
+    me = welcome['player']
+    if me == 1:
+        while (await receive())['op'] != 'joined':
+            pass
+
+    try:
+        for turn in range(turns):
+            while engine.turn != me:
+                if (await receive())['op'] == 'left':
+                    return
+            if engine.check_victory() is not None:
+                return
+            for i in range(actions):
+                mine = [u for u in engine.units.alive(me) if not (u.moved and u.acted)]
+                if not mine:
+                    break
+                u = rng.choice(mine)
+                targets = engine.targets(u) if not u.acted else []
+                cells = sorted(engine.reachable(u).cells) if not u.moved else []
+                if targets:
+                    await command({'op': 'attack', 'unit': u.index, 'target': rng.choice(targets).index})
+                elif cells:
+                    x, y = rng.choice(cells)
+                    await command({'op': 'move', 'unit': u.index, 'x': x, 'y': y})
+            await command({'op': 'end_turn'})
+    finally:
+        writer.close()
+
+
+def percentile(values, q):
+    return np.percentile(values, q) * 1000
+
+
+async def run(args, stats):
+    games = [
+        player(args.host, args.port, f"load-{i}", args.turns, args.actions, 2 * i + p, stats)
+        for i in range(args.matches) for p in (0, 1)
+    ]
+    results = await asyncio.gather(*games, return_exceptions=True)
+    return [r for r in results if isinstance(r, Exception)]
+
+
+async def wait_for_server(host, port, timeout=10):
+    end = time.monotonic() + timeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > end:
+                raise
+            await asyncio.sleep(0.1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play many scripted matches on a server and time the commands.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--matches", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=20, help="turns each player plays")
+    parser.add_argument("--actions", type=int, default=3, help="commands per turn before ending it")
+    parser.add_argument("--spawn", action="store_true", help="start a server.py for the run")
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.spawn:
+        server = subprocess.Popen([sys.executable, "server.py", "--host", args.host, "--port", str(args.port)],
+                                  stdout=subprocess.DEVNULL)
+    try:
+        if server:
+            asyncio.run(wait_for_server(args.host, args.port))
+        stats = Stats()
+        t0 = time.perf_counter()
+        failures = asyncio.run(run(args, stats))
+        elapsed = time.perf_counter() - t0
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    lat = stats.latencies
+    sent = len(lat) + stats.errors
+    print(f"{args.matches} matches, {2 * args.matches} players, {sent} commands in {elapsed:.1f}s "
+          f"({sent / elapsed:.0f} commands/s)")
+    if failures:
+        print(f"  {len(failures)} players failed, first: {failures[0]!r}")
+    if lat:
+        print(f"  latency  p50 {percentile(lat, 50):6.2f} ms   p90 {percentile(lat, 90):6.2f} ms   "
+              f"p99 {percentile(lat, 99):6.2f} ms   max {max(lat) * 1000:6.2f} ms")
+    if sent:
+        print(f"  refused commands: {stats.errors} ({stats.errors / sent:.1%}), not in the latencies")
+    if stats.delta_bytes:
+        print(f"  delta size: {np.mean(stats.delta_bytes):.0f} bytes on average, "
+              f"all units {np.mean(stats.full_bytes):.0f} bytes")
+
+
+if __name__ == '__main__':
+    main()
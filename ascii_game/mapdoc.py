@@ -0,0 +1,154 @@
+# coding=utf-8
+#
+# Map document for ASCII Mapper: the character grid being edited.
+#
+# The editor used to keep the map only in its canvas items, one text item
+# per cell. MapDoc is now the source of truth and the canvas just shows
+# the part of it that is on screen, so the map size no longer decides how
+# many canvas items exist.
+
+from __future__ import division
+from __future__ import print_function
+
+
+class MapDoc(object):
+	def __init__(self, width, height, filler="."):
+		self.width = width
+		self.height = height
+		self.rows = [[filler] * width for i in range(height)]
+		self.journal = None	# journal.Journal recording the changes, if any
+
+	def in_bounds(self, x, y):
+		return 0 <= x < self.width and 0 <= y < self.height
+
+	def get(self, x, y):
+		return self.rows[y][x]
+
+	def set(self, x, y, char):
+		# True if the cell actually changed
+		row = self.rows[y]
+		old = row[x]
+		if old == char:
+			return False
+		row[x] = char
+		if self.journal is not None:
+			self.journal.record(self, x, y, 1, old, char)
+		return True
+
+	def paint(self, cells, char):
+		# Set every in-bounds cell to char, returns the cells that changed
+		changed = []
+		for x, y in cells:
+			if self.in_bounds(x, y) and self.set(x, y, char):
+				changed.append((x, y))
+		return changed
+
+	def fill_rect(self, x0, y0, x1, y1, char):
+		# Rectangle with corners (x0, y0) and (x1, y1), both included
+		x0, x1 = max(0, min(x0, x1)), min(self.width - 1, max(x0, x1))
+		y0, y1 = max(0, min(y0, y1)), min(self.height - 1, max(y0, y1))
+		changed = []
+		journal = self.journal
+		for y in range(y0, y1 + 1):
+			row = self.rows[y]
+			for x in range(x0, x1 + 1):
+				old = row[x]
+				if old != char:
+					row[x] = char
+					changed.append((x, y))
+					if journal is not None:
+						journal.record(self, x, y, 1, old, char)
+		return changed
+
+	def flood_fill(self, x, y, char):
+		# Replace the 4-connected area of same characters around (x, y),
+		# one horizontal run at a time
+		target = self.rows[y][x]
+		if target == char:
+			return []
+		changed = []
+		seeds = [(x, y)]
+		while seeds:
+			x, y = seeds.pop()
+			row = self.rows[y]
+			if row[x] != target:
+				continue
+			left = x
+			while left > 0 and row[left - 1] == target:
+				left -= 1
+			right = x
+			while right < self.width - 1 and row[right + 1] == target:
+				right += 1
+			for i in range(left, right + 1):
+				row[i] = char
+				changed.append((i, y))
+			if self.journal is not None:
+				self.journal.record(self, left, y, right - left + 1, target, char)
+			for ny in (y - 1, y + 1):
+				if 0 <= ny < self.height:
+					other = self.rows[ny]
+					# One seed per run of target cells next to this run
+					inside = False
+					for i in range(left, right + 1):
+						if other[i] == target:
+							if not inside:
+								seeds.append((i, ny))
+								inside = True
+						else:
+							inside = False
+		return changed
+
+	def data(self):
+		return ["".join(row) for row in self.rows]
+
+	def load(self, data, filler):
+		# Copy lines of text in, cutting or padding them to the map size
+		for y in range(self.height):
+			line = data[y].rstrip("\r\n") if y < len(data) else ""
+			row = list(line[:self.width])
+			row.extend([filler] * (self.width - len(row)))
+			self.rows[y] = row
+
+	def fill(self, filler):
+		self.rows = [[filler] * self.width for i in range(self.height)]
+
+	def resize(self, width, height, filler):
+		if self.journal is not None:
+			self.journal.resized(self, width, height, filler)
+		self.reshape(width, height, filler)
+
+	def reshape(self, width, height, filler):
+		# Keep the overlapping part, pad new cells with the filler
+		data = self.data()
+		self.width = width
+		self.height = height
+		self.rows = [None] * height
+		self.load(data, filler)
+
+
+def line_cells(x0, y0, x1, y1):
+	# Cells on the line from (x0, y0) to (x1, y1) (Bresenham), both ends included,
+	# so a fast mouse stroke leaves no gaps between motion events
+	cells = []
+	dx = abs(x1 - x0)
+	dy = -abs(y1 - y0)
+	sx = 1 if x0 < x1 else -1
+	sy = 1 if y0 < y1 else -1
+	err = dx + dy
+	while True:
+		cells.append((x0, y0))
+		if x0 == x1 and y0 == y1:
+			return cells
+		e2 = 2 * err
+		if e2 >= dy:
+			err += dy
+			x0 += sx
+		if e2 <= dx:
+			err += dx
+			y0 += sy
+
+
+def data_size(data):
+	# (width, height) of lines of text, ignoring line endings
+	width = max([len(line.rstrip("\r\n")) for line in data] or [0])
+	return width, len(data)
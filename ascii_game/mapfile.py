@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Compiled binary map format for ASCII Battle.
+
+A .map file holds the terrain and the elevation of a map in one file:
+
+    offset  size   content
+    0       8      magic b'ASCIIMAP'
+    8       2      format version (uint16, little endian)
+    10      2      reserved
+    12      4      width (uint32)
+    16      4      height (uint32)
+    20      12     reserved, pads the header to 32 bytes
+    32      w*h    terrain, one ASCII character code per cell (uint8), row by row
+    32+w*h  w*h    elevation level per cell (int8), row by row
+
+read_map() memory-maps the file and returns NumPy views straight into the
+mapping: nothing is parsed or copied, pages are only read when touched,
+so opening a 4096x4096 map takes milliseconds.
+
+Convert the text formats (terrain .txt or the mapper's .json, elevation
+.csv) with:
+    python3 mapfile.py map3.txt elevation2.txt -o map3.map
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b'ASCIIMAP'
+VERSION = 1
+HEADER = struct.Struct('<8sHHII12x')
+MAP_EXT = '.map'
+
+
+def grid_array(rows):
+    # Terrain rows (strings or lists of characters) -> (height, width) uint8 character codes
+    rows = ["".join(row) for row in rows]
+    if not rows or any(len(row) != len(rows[0]) for row in rows):
+        raise ValueError('Map rows must all have the same length!')
+    data = "".join(rows).encode('ascii')
+    return np.frombuffer(data, np.uint8).reshape(len(rows), len(rows[0]))
+
+
+def elevation_array(rows):
+    # Elevation rows (lists of digit strings or numbers) -> (height, width) int8 levels
+    if not rows or any(len(row) != len(rows[0]) for row in rows):
+        raise ValueError('Elevation rows must all have the same length!')
+    return np.array(rows).astype(np.int8)
+
+
+def load_map(map_file):
+    # Terrain rows of a plain text (one row per line) or JSON (list of strings) map
+    with open(map_file) as f:
+        if map_file.endswith('.json'):
+            return json.load(f)
+        return [line.rstrip("\n") for line in f]
+
+
+def load_elev(elev_file):
+    with open(elev_file) as f:
+        return [line.rstrip("\n").split(",") for line in f]
+
+
+def map_bytes(terrain, elevation):
+    # Contents of a .map file
+    terrain = np.ascontiguousarray(terrain, np.uint8)
+    elevation = np.ascontiguousarray(elevation, np.int8)
+    if terrain.ndim != 2 or elevation.shape != terrain.shape:
+        raise ValueError('Elevation grid size must match map size!')
+    height, width = terrain.shape
+    return HEADER.pack(MAGIC, VERSION, 0, width, height) + terrain.tobytes() + elevation.tobytes()
+
+
+def write_map(path, terrain, elevation):
+    data = map_bytes(terrain, elevation)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def read_map(path):
+    # (terrain, elevation) as read-only arrays backed by a memory mapping of the file
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < HEADER.size:
+            raise ValueError(f'{path}: not a compiled map (file too short)')
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, _, width, height = HEADER.unpack_from(mm)
+    if magic != MAGIC:
+        raise ValueError(f'{path}: not a compiled map')
+    if version != VERSION:
+        raise ValueError(f'{path}: unsupported map format version {version}')
+    cells = width * height
+    if size != HEADER.size + 2 * cells:
+        raise ValueError(f'{path}: file size does not match a {width}x{height} map')
+    terrain = np.frombuffer(mm, np.uint8, cells, HEADER.size).reshape(height, width)
+    elevation = np.frombuffer(mm, np.int8, cells, HEADER.size + cells).reshape(height, width)
+    return terrain, elevation
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile a text map (+ elevation CSV) into a binary .map file.")
+    parser.add_argument("map", help="terrain map, .txt or .json")
+    parser.add_argument("elev", nargs="?", help="elevation CSV (flat map if omitted)")
+    parser.add_argument("-o", "--out", help="output file (default: map name with .map)")
+    args = parser.parse_args(argv)
+
+    terrain = grid_array(load_map(args.map))
+    if args.elev:
+        elevation = elevation_array(load_elev(args.elev))
+    else:
+        elevation = np.zeros(terrain.shape, np.int8)
+    out = args.out or os.path.splitext(args.map)[0] + MAP_EXT
+    write_map(out, terrain, elevation)
+    height, width = terrain.shape
+    print(f"Wrote {width}x{height} map to {out}")
+
+
+if __name__ == '__main__':
+    main()
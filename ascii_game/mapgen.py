@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Procedural map generator for ASCII Battle.
+
+generate(width, height, seed) returns the terrain (character codes) and
+elevation arrays of a random map, the same arrays Battlefield takes. Every
+random choice comes from one NumPy generator seeded with `seed`, so a seed
+always gives the same map.
+
+    elevation   fractal value noise (octaves of smoothly interpolated random
+                lattices), quantized to the 0..LEVELS-1 elevation levels
+    forest      cellular automaton grown clumps of light woods `f`, their
+                inner cells heavy woods `F`
+    shrubbery   smaller, sparser clumps of `*`
+    rivers      `~` flowing downhill along the elevation noise from high
+                sources until they leave the map, or into a lake in a pit
+    roads       `+` random walks from one map edge to the other, bridging
+                rivers on the way
+
+Everything but the river and road walks is whole-array NumPy work; a
+1024x1024 map takes a fraction of a second. Write maps with:
+    python3 mapgen.py 128 64 --seed 7 -o gen.map
+    python3 mapgen.py 64 32 --seed 7 -o gen.txt --elev gen_elev.txt
+    python3 mapgen.py 64 64 --seed 100 --count 1000 -o maps/gen.map  (gen-100.map ... gen-1099.map)
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+from engine import START_POSITIONS_P1, START_POSITIONS_P2, Battlefield
+from mapfile import MAP_EXT, write_map
+
+LEVELS = 5      # elevation levels, as many as ascii_battle can shade
+
+
+def value_noise(rng, width, height, cell):
+    # One octave: random values on a lattice `cell` cells apart, smoothly
+    # interpolated in between (separably, first along x then along y)
+    gw = width // cell + 2
+    gh = height // cell + 2
+    lattice = rng.random((gh, gw), dtype=np.float32)
+
+    def axis(n):
+        pos = np.arange(n, dtype=np.float32) / cell
+        i = pos.astype(np.intp)
+        t = pos - i
+        return i, t * t * (3 - 2 * t)   # smoothstep
+
+    ix, tx = axis(width)
+    iy, ty = axis(height)
+    rows = lattice[:, ix] * (1 - tx) + lattice[:, ix + 1] * tx
+    return rows[iy] * (1 - ty)[:, None] + rows[iy + 1] * ty[:, None]
+
+
+def fractal_noise(rng, width, height, cell, octaves=4):
+    # Octaves of halving lattice size and amplitude, normalized to 0..1
+    total = np.zeros((height, width), np.float32)
+    amplitude = 1.0
+    for i in range(octaves):
+        total += amplitude * value_noise(rng, width, height, max(1, cell >> i))
+        amplitude *= 0.5
+    total -= total.min()
+    top = total.max()
+    return total / top if top > 0 else total
+
+
+def neighbours(mask):
+    # Number of set cells in the 3x3 block around every cell, the cell included
+    padded = np.pad(mask.astype(np.uint8), 1)
+    h, w = mask.shape
+    count = np.zeros((h, w), np.uint8)
+    for dy in range(3):
+        for dx in range(3):
+            count += padded[dy:dy + h, dx:dx + w]
+    return count
+
+
+def grow(rng, shape, density, steps, birth=5):
+    # Cellular automaton: start from random cells (density: chance per cell,
+    # scalar or array) and let a cell live where at least `birth` of its 3x3
+    # block do, which merges the noise into clumps
+    alive = rng.random(shape, dtype=np.float32) < density
+    for i in range(steps):
+        alive = neighbours(alive) >= birth
+    return alive
+
+
+def river(rng, height_map, water, min_length):
+    # Walk downhill from a random high cell to the lowest unvisited
+    # neighbour until leaving the map or meeting water. A river that ends
+    # in a pit of the noise fills it as a small lake.
+    h, w = height_map.shape
+    high = np.flatnonzero(height_map.ravel() > 0.7)
+    if len(high) == 0:
+        return
+    y, x = divmod(int(high[rng.integers(len(high))]), w)
+    path = [(y, x)]
+    seen = {(y, x)}
+    pit = True
+    while pit:
+        best = None
+        for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)):
+            if not (0 <= ny < h and 0 <= nx < w) or water[ny, nx]:
+                pit = False         # left the map or joined another river
+                break
+            if (ny, nx) not in seen and (best is None or height_map[ny, nx] < height_map[best]):
+                best = (ny, nx)
+        else:
+            # Small rises are crossed, the noise is full of tiny bumps
+            if best is None or height_map[best] > height_map[y, x] + 0.02:
+                break
+            y, x = best
+            path.append(best)
+            seen.add(best)
+    if len(path) < min_length:
+        return
+    ys, xs = np.array(path).T
+    water[ys, xs] = True
+    # Two cells wide like the hand-drawn maps, side by side across the flow
+    across = np.append(ys[1:] == ys[:-1], False)
+    water[np.minimum(ys + across, h - 1), np.minimum(xs + ~across, w - 1)] = True
+    if pit:
+        r = max(2, min(w, h) // 32)
+        y0, y1, x0, x1 = max(0, y - r), min(h, y + r + 1), max(0, x - r), min(w, x + r + 1)
+        dy = np.arange(y0, y1)[:, None] - y
+        dx = np.arange(x0, x1)[None, :] - x
+        lake = (dy * dy + dx * dx <= r * r) & (height_map[y0:y1, x0:x1] <= height_map[y, x] + 0.05)
+        water[y0:y1, x0:x1] |= lake
+
+
+def road(rng, width, height, horizontal):
+    # Random walk across the map: mostly straight on, sometimes drifting
+    # sideways for a few cells. Returns the (ys, xs) of the cells.
+    length, across = (width, height) if horizontal else (height, width)
+    n = length * 2
+    forward = rng.random(n) < 0.75
+    # Drift keeps its direction for a while, changing at random
+    drift = np.where(rng.random(n) < 0.5, -1, 1)
+    drift = drift[np.maximum.accumulate(np.where(rng.random(n) < 0.1, np.arange(n), 0))]
+    along = np.cumsum(forward)
+    side = rng.integers(across // 4, across - across // 4 + 1) + np.cumsum(np.where(forward, 0, drift))
+    side = np.clip(side, 0, across - 1)
+    keep = along < length
+    along = np.concatenate(([0], along[keep]))
+    side = np.concatenate(([side[0]], side[keep]))
+    return (side, along) if horizontal else (along, side)
+
+
+def generate(width, height, seed=None, forest=0.45, shrubs=0.4, rivers=None, roads=None):
+    # (terrain, elevation) arrays of a new map. forest and shrubs are the
+    # starting densities of their automata; rivers and roads default to one
+    # per 64 cells of map size (at least one).
+    rng = np.random.default_rng(seed)
+    size = max(width, height)
+    if rivers is None:
+        rivers = max(1, size // 64)
+    if roads is None:
+        roads = max(1, size // 64)
+
+    height_map = fractal_noise(rng, width, height, cell=max(4, size // 4))
+    elevation = np.minimum(height_map * LEVELS, LEVELS - 1).astype(np.int8)
+
+    # Woods like the hills a bit better than the valleys
+    shape = (height, width)
+    woods = grow(rng, shape, forest * (0.8 + 0.4 * height_map), steps=4)
+    heavy = woods & (neighbours(woods) == 9)
+    shrub = grow(rng, shape, shrubs, steps=2) & ~woods
+
+    water = np.zeros(shape, bool)
+    for i in range(rivers):
+        river(rng, height_map, water, min_length=min(width, height) // 4)
+
+    paved = np.zeros(shape, bool)
+    for i in range(roads):
+        paved[road(rng, width, height, horizontal=bool(i % 2 == 0))] = True
+
+    terrain = np.full(shape, ord('.'), np.uint8)
+    terrain[shrub] = ord('*')
+    terrain[woods] = ord('f')
+    terrain[heavy] = ord('F')
+    terrain[water] = ord('~')
+    terrain[paved] = ord('+')
+
+    # Armies must be able to stand on their start positions
+    for x, y in START_POSITIONS_P1 + START_POSITIONS_P2:
+        if -width <= x < width and -height <= y < height:
+            if terrain[y, x] == ord('~'):
+                terrain[y, x] = ord('.')
+    return terrain, elevation
+
+
+def write_text(path, elev_path, terrain, elevation):
+    # The text formats: terrain rows and an elevation CSV
+    with open(path, 'w') as f:
+        for row in terrain:
+            f.write(row.tobytes().decode('ascii') + "\n")
+    if elev_path:
+        with open(elev_path, 'w') as f:
+            for row in elevation:
+                f.write(",".join(str(level) for level in row) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate random ASCII Battle maps.")
+    parser.add_argument("width", type=int)
+    parser.add_argument("height", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--count", type=int, default=1, help="maps to write, with seeds SEED, SEED+1, ...")
+    parser.add_argument("-o", "--out", default="generated.map", help=".map, or .txt (terrain only, see --elev)")
+    parser.add_argument("--elev", help="elevation CSV to write next to a .txt map")
+    args = parser.parse_args(argv)
+    if args.width < 1 or args.height < 1:
+        parser.error("the map needs at least one cell")
+
+    def numbered(path, seed):
+        # gen.map -> gen-<seed>.map when writing several maps
+        if path is None or args.count == 1:
+            return path
+        base, ext = os.path.splitext(path)
+        return f"{base}-{seed}{ext}"
+
+    for seed in range(args.seed, args.seed + args.count):
+        terrain, elevation = generate(args.width, args.height, seed)
+        out = numbered(args.out, seed)
+        for problem in Battlefield(terrain, elevation).problems():
+            print(f"Warning: seed {seed}: {problem}")
+        if out.endswith(MAP_EXT):
+            write_map(out, terrain, elevation)
+        else:
+            write_text(out, numbered(args.elev, seed), terrain, elevation)
+    print(f"Wrote {args.count} {args.width}x{args.height} map(s), seeds {args.seed}..{args.seed + args.count - 1}")
+
+
+if __name__ == '__main__':
+    main()
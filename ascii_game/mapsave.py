@@ -0,0 +1,171 @@
+# coding=utf-8
+#
+# Saving for ASCII Mapper: background writes, atomic saves and autosave.
+#
+# Saves never rewrite the map file in place. The new content goes to a
+# temporary file next to it, is flushed to disk and then renamed over the
+# old file, so a crash leaves either the old or the new map, never half of
+# one. The writing happens on a Worker thread so big maps don't freeze Tk.
+#
+# Maps are saved as text (.txt, .json: terrain only) or compiled (.map, see
+# mapfile.py: terrain and elevation in one file, what the game loads).
+#
+# Between saves the editor autosaves to a sidecar file (map name plus
+# ".autosave"). It is a journal of text lines:
+#
+#	size <width> <height>
+#	<y> <terrain row>
+#	e<y> <elevation row>
+#
+# Each autosave appends only the rows changed since the previous one; the
+# sidecar is compacted (rewritten with every row) once it grows past a few
+# map sizes. Reading it back, later rows win. The sidecar is removed after
+# a successful save.
+
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import tempfile
+import threading
+
+try:
+	import queue
+except ImportError: # Python 2.7
+	import Queue as queue
+
+
+class Worker(object):
+	# One background thread running jobs in order. Tk must only be used
+	# from its own thread, so the jobs don't call back: their results are
+	# handed to the done callbacks by poll() or wait(), in the Tk thread.
+	def __init__(self):
+		self.jobs = queue.Queue()
+		self.results = queue.Queue()
+		self.pending = 0
+		thread = threading.Thread(target=self.run)
+		thread.daemon = True
+		thread.start()
+
+	def submit(self, job, done=None):
+		# done(result, error) gets the job's return value or its exception
+		self.pending += 1
+		self.jobs.put((job, done))
+
+	def run(self):
+		while True:
+			job, done = self.jobs.get()
+			try:
+				result, error = job(), None
+			except Exception as e:
+				# Handed to the Tk thread, the worker must keep going
+				result, error = None, e
+			self.results.put((done, result, error))
+
+	def poll(self, block=False):
+		while self.pending > 0:
+			try:
+				done, result, error = self.results.get(block)
+			except queue.Empty:
+				return
+			self.pending -= 1
+			if done is not None:
+				done(result, error)
+
+	def wait(self):
+		# Finish every job, before quitting
+		self.poll(True)
+
+
+def write_atomic(path, content):
+	# content: text, or bytes for a binary file
+	folder = os.path.dirname(os.path.abspath(path))
+	fd, temp = tempfile.mkstemp(dir=folder, prefix=".", suffix=".tmp")
+	try:
+		with os.fdopen(fd, "wb" if isinstance(content, bytes) else "w") as f:
+			f.write(content)
+			f.flush()
+			os.fsync(f.fileno())
+		if hasattr(os, "replace"):
+			os.replace(temp, path)
+		else: # Python 2.7, rename can't replace files on Windows
+			if os.name == "nt" and os.path.exists(path):
+				os.remove(path)
+			os.rename(temp, path)
+	except:
+		if os.path.exists(temp):
+			os.remove(temp)
+		raise
+
+def save_map(path, data, elevation_data=None):
+	# Terrain lines to a .json or text file, or terrain plus elevation
+	# lines (digits) to a compiled .map file
+	ext = os.path.splitext(path)[1]
+	if ext == ".map":
+		import mapfile # Needs NumPy, only loaded for compiled maps
+		terrain = mapfile.grid_array(data)
+		elevation = mapfile.grid_array(elevation_data) - ord("0")
+		content = mapfile.map_bytes(terrain, elevation)
+	elif ext == ".json":
+		content = json.dumps(data)
+	else:
+		content = "\n".join(data) + "\n"
+	write_atomic(path, content)
+
+def autosave_path(map_path):
+	if map_path is None:
+		return os.path.join(tempfile.gettempdir(), "ascii-mapper-untitled.autosave")
+	return map_path + ".autosave"
+
+def rows_text(width, height, rows, elevation_rows):
+	# rows, elevation_rows: {y: row string}
+	lines = ["size %d %d\n" % (width, height)]
+	for y in sorted(rows):
+		lines.append("%d %s\n" % (y, rows[y]))
+	for y in sorted(elevation_rows):
+		lines.append("e%d %s\n" % (y, elevation_rows[y]))
+	return "".join(lines)
+
+def write_rows(path, text, compact):
+	# Append a batch of rows to the sidecar, or replace it with a full map
+	if compact:
+		write_atomic(path, text)
+		return
+	with open(path, "a") as f:
+		f.write(text)
+		f.flush()
+		os.fsync(f.fileno())
+
+def read_autosave(path):
+	# (width, height, {y: terrain row}, {y: elevation row}) from a sidecar,
+	# None if there is none. A line cut short by a crash is left out.
+	if not os.path.isfile(path):
+		return None
+	width = height = None
+	rows = {}
+	elevation_rows = {}
+	with open(path) as f:
+		for line in f:
+			if not line.endswith("\n"):
+				break
+			key, _, value = line[:-1].partition(" ")
+			try:
+				if key == "size":
+					width, height = [int(n) for n in value.split()]
+				elif key.startswith("e"):
+					elevation_rows[int(key[1:])] = value
+				else:
+					rows[int(key)] = value
+			except ValueError:
+				break
+	if width is None:
+		return None
+	def fitting(rows):
+		return dict((y, row) for y, row in rows.items()
+			if 0 <= y < height and len(row) == width)
+	return width, height, fitting(rows), fitting(elevation_rows)
+
+def discard(path):
+	if os.path.exists(path):
+		os.remove(path)
@@ -0,0 +1,60 @@
+"""
+Spatial index of living units on the battle map.
+
+Maps the index of every occupied cell (y * width + x) to its unit, so
+"which unit stands here?" is a single dict lookup instead of a scan over
+every unit. Only occupied cells are stored, so copying the index (for
+Engine.clone) costs as much as the army, not the map. `version` is bumped
+on every change, so callers can cache anything that depends on unit
+positions.
+"""
+
+
+class OccupancyGrid:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.cells = {}     # cell index -> unit
+        self.version = 0
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def get(self, x, y):
+        if not self.in_bounds(x, y):
+            return None
+        return self.cells.get(y * self.width + x)
+
+    def add(self, unit):
+        i = unit.y * self.width + unit.x
+        if i in self.cells:
+            raise ValueError(f"Cell ({unit.x},{unit.y}) is already occupied.")
+        self.cells[i] = unit
+        self.version += 1
+
+    def remove(self, unit):
+        i = unit.y * self.width + unit.x
+        if self.cells.get(i) is unit:
+            del self.cells[i]
+            self.version += 1
+
+    def move(self, unit, x, y):
+        # Updates both the index and the unit's own coordinates
+        j = y * self.width + x
+        if j in self.cells:
+            raise ValueError(f"Cell ({x},{y}) is already occupied.")
+        del self.cells[unit.y * self.width + unit.x]
+        unit.x = x
+        unit.y = y
+        self.cells[j] = unit
+        self.version += 1
+
+    def copy(self, units):
+        # Same occupancy with the handles of `units`, a copy of the store
+        grid = OccupancyGrid(self.width, self.height)
+        grid.cells = {i: units[u.index] for i, u in self.cells.items()}
+        return grid
+
+    def clear(self):
+        self.cells = {}
+        self.version += 1
@@ -0,0 +1,209 @@
+"""
+Terrain-aware movement for ASCII Battle.
+
+Dijkstra flood fill from a unit's cell, limited by its move points:
+ - every entered cell costs the terrain's `mov_cost` (at least 1)
+ - impassable terrain (`pass: False`) is only entered by amphibious units
+ - flying units pay 1 per cell and ignore terrain and other units
+ - ground units may pass through friendly units but not enemy ones,
+   and nobody can end a move on an occupied cell
+
+Results are cached per (unit, position, occupancy version), so the move
+highlight and route preview cost nothing until some unit moves or dies.
+Cells in another connected component of the map (connectivity.py) are
+rejected before flooding anything. Orders beyond this turn's move points
+go through route(), the hierarchical search of hpa.py: advance() is how far
+along one a unit gets this turn. Scripted players rank cells by
+route_costs() to their goals, over the same graphs.
+"""
+
+import heapq
+
+import numpy as np
+
+NEIGHBOURS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+
+class Reach:
+    def __init__(self, width, start, cost, prev, cells):
+        self.width = width
+        self.start = start
+        self.cost = cost    # cell index -> cheapest cost to get there
+        self.prev = prev    # cell index -> previous cell index on that route
+        self.cells = cells  # set of (x, y) the unit may end its move on
+
+    def can_reach(self, x, y):
+        return (x, y) in self.cells
+
+    def cost_to(self, x, y):
+        return self.cost.get(y * self.width + x)
+
+    def path_to(self, x, y):
+        # Cells from the start (excluded) to (x, y), or None if out of reach
+        i = y * self.width + x
+        if i not in self.cost:
+            return None
+        path = []
+        while i != self.start:
+            path.append((i % self.width, i // self.width))
+            i = self.prev[i]
+        path.reverse()
+        return path
+
+
+def movement_costs(layers):
+    # Per cell entry cost for ground and amphibious units, 0 = impassable
+    ground_cost = layers.flat(np.where(layers.passable, layers.move_cost, 0).astype(np.int16))
+    amph_cost = layers.flat(np.where(layers.known, layers.move_cost, 0).astype(np.int16))
+    return ground_cost, amph_cost
+
+
+def astar(costs, width, height, start, goal):
+    # Cheapest route between two cells on a flat cost grid (0 = impassable),
+    # ignoring units and move points: (cost, [cell index, ...] after start),
+    # None if there is none. Exact but explores the whole way, see hpa.py
+    # for long routes.
+    gx, gy = goal % width, goal // width
+    cost = {start: 0}
+    prev = {}
+    heap = [(0, 0, start)]
+    while heap:
+        f, c, i = heapq.heappop(heap)
+        if i == goal:
+            path = []
+            while i != start:
+                path.append(i)
+                i = prev[i]
+            path.reverse()
+            return c, path
+        if c > cost[i]:
+            continue
+        x, y = i % width, i // width
+        for dx, dy in NEIGHBOURS:
+            nx, ny = x + dx, y + dy
+            if nx < 0 or ny < 0 or nx >= width or ny >= height:
+                continue
+            j = ny * width + nx
+            step = costs[j]
+            if not step:
+                continue
+            nc = c + step
+            if nc < cost.get(j, nc + 1):
+                cost[j] = nc
+                prev[j] = i
+                heapq.heappush(heap, (nc + abs(nx - gx) + abs(ny - gy), nc, j))
+    return None
+
+
+class Pathfinder:
+    def __init__(self, field, occupancy):
+        # `field` is the engine's Battlefield: its move costs, connectivity and
+        # route graphs are only built once a unit first needs them
+        self.field = field
+        self.width = occupancy.width
+        self.height = occupancy.height
+        self.occupancy = occupancy
+        self.cache = {}
+        self.cache_version = occupancy.version
+
+    def reachable(self, unit):
+        if self.cache_version != self.occupancy.version:
+            self.cache = {}
+            self.cache_version = self.occupancy.version
+        key = (id(unit), unit.x, unit.y, unit.move_range)
+        reach = self.cache.get(key)
+        if reach is None:
+            reach = self.flood(unit)
+            self.cache[key] = reach
+        return reach
+
+    def connected(self, unit, x, y):
+        # O(1): False when no route to (x, y) exists at all, whatever the move points
+        return self.field.connectivity.connected(unit, x, y)
+
+    def path(self, unit, x, y):
+        if not self.connected(unit, x, y):
+            return None
+        return self.reachable(unit).path_to(x, y)
+
+    def route_graph(self, unit):
+        # hpa.AbstractGraph of the unit's movement class
+        ground_graph, amph_graph, flying_graph = self.field.route_graphs
+        if unit.flying:
+            return flying_graph
+        if unit.amph:
+            return amph_graph
+        return ground_graph
+
+    def route(self, unit, x, y):
+        # Multi-turn route to (x, y) over the terrain alone (hpa.Route), None if
+        # there is none. Only legs asked for are turned into cells.
+        if not self.connected(unit, x, y):
+            return None
+        return self.route_graph(unit).route(unit.x, unit.y, x, y)
+
+    def advance(self, unit, x, y):
+        # Farthest cell along route() to (x, y) the unit can end this turn's
+        # move on, None if it can't get any further along it. Only the legs
+        # within this turn's reach are refined.
+        route = self.route(unit, x, y)
+        if route is None:
+            return None
+        reach = self.reachable(unit)
+        best = None
+        for cx, cy in route.cells():
+            if cy * self.width + cx not in reach.cost:
+                break
+            if (cx, cy) in reach.cells:
+                best = (cx, cy)
+        return best
+
+    def route_costs(self, unit, xs, ys, goals):
+        # Route cost over the terrain alone from each cell (xs[i], ys[i]) to
+        # the nearest of `goals` [(x, y)], >= hpa.BLOCKED where there is none.
+        # Costs to a goal are kept until the terrain changes, see hpa.Distances.
+        graph = self.route_graph(unit)
+        return np.min([graph.distances(gx, gy).costs(xs, ys) for gx, gy in goals], axis=0)
+
+    def flood(self, unit):
+        w, h = self.width, self.height
+        cells = self.occupancy.cells
+        if unit.flying:
+            costs = None
+        elif unit.amph:
+            costs = self.field.move_costs[1]
+        else:
+            costs = self.field.move_costs[0]
+        budget = unit.move_range
+        start = unit.y * w + unit.x
+
+        cost = {start: 0}
+        prev = {}
+        heap = [(0, start)]
+        while heap:
+            c, i = heapq.heappop(heap)
+            if c > cost[i]:
+                continue
+            x, y = i % w, i // w
+            for dx, dy in NEIGHBOURS:
+                nx, ny = x + dx, y + dy
+                if nx < 0 or ny < 0 or nx >= w or ny >= h:
+                    continue
+                j = ny * w + nx
+                if costs is None:
+                    step = 1
+                else:
+                    step = costs[j]
+                    if not step:
+                        continue
+                    other = cells.get(j)
+                    if other is not None and other.owner != unit.owner:
+                        continue
+                nc = c + step
+                if nc <= budget and nc < cost.get(j, budget + 1):
+                    cost[j] = nc
+                    prev[j] = i
+                    heapq.heappush(heap, (nc, j))
+
+        reach = {(j % w, j // w) for j in cost if j not in cells}
+        return Reach(w, start, cost, prev, reach)
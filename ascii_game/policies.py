@@ -0,0 +1,102 @@
+"""
+Scripted players for headless matches.
+
+A policy plays one whole turn for the side whose turn it is: it may move
+and attack with any of that side's units but does not end the turn, the
+caller does. Policies only use the Engine API and the engine's seeded RNG,
+so a match is fully determined by its seed.
+"""
+
+import numpy as np
+
+from hpa import BLOCKED
+
+
+def own_units(engine):
+    return [u for u in engine.units if u.is_alive() and u.owner == engine.turn]
+
+
+def random_policy(engine):
+    # Every unit moves somewhere random and shoots at a random target
+    rng = engine.rng
+    for u in own_units(engine):
+        cells = sorted(engine.reachable(u).cells)
+        if cells:
+            engine.move(u, *rng.choice(cells))
+        targets = engine.targets(u)
+        if targets:
+            engine.attack(u, rng.choice(targets))
+
+
+def weakest(targets):
+    return min(targets, key=lambda t: (t.hp, t.x, t.y))
+
+
+def enemy_distances(engine, unit, cx, cy, enemies):
+    # Cost of the cheapest route from each cell (cx[i], cy[i]) to any enemy.
+    # Grid distance when no route gets there (ground units with only enemies
+    # across water left)
+    dist = engine.pathfinder.route_costs(unit, cx, cy, [(e.x, e.y) for e in enemies])
+    if dist.min() >= BLOCKED:
+        ex = np.array([e.x for e in enemies])
+        ey = np.array([e.y for e in enemies])
+        dist = (np.abs(cx[:, None] - ex) + np.abs(cy[:, None] - ey)).min(axis=1)
+    return dist
+
+
+def enemy_distance(engine, unit, enemies):
+    # enemy_distances() of the unit's own cell, one lookup per enemy
+    graph = engine.pathfinder.route_graph(unit)
+    dist = min(graph.distances(e.x, e.y).at(unit.x, unit.y) for e in enemies)
+    if dist >= BLOCKED:
+        dist = min(abs(e.x - unit.x) + abs(e.y - unit.y) for e in enemies)
+    return dist
+
+
+def closest_safest(engine, unit, cells, enemies, threat):
+    # Cell with the cheapest route to any enemy, ties broken by the least enemy fire on it
+    cx, cy = np.array(cells).T
+    dist = enemy_distances(engine, unit, cx, cy, enemies)
+    return cells[np.lexsort((threat[cy, cx], dist))[0]]
+
+
+def greedy_policy(engine):
+    # Shoot the weakest target in range, otherwise close in on the enemy it has the cheapest route to
+    # and try again. Enemy positions are read straight from the engine, so it ignores fog of
+    # war when moving.
+    enemies = [u for u in engine.units if u.is_alive() and u.owner != engine.turn]
+    threat = None
+    for u in own_units(engine):
+        targets = engine.targets(u)
+        if targets:
+            engine.attack(u, weakest(targets))
+            continue
+        enemies = [e for e in enemies if e.is_alive()]
+        if not enemies:
+            return
+        cells = sorted(engine.reachable(u).cells)
+        if cells:
+            # Enemies don't move during our turn, so one threat map per turn will do
+            if threat is None:
+                threat = engine.threat_map(engine.turn)
+            # Enemies across water are no goal for ground units, unless there's no other
+            goals = [e for e in enemies if engine.pathfinder.connected(u, e.x, e.y)] or enemies
+            engine.move(u, *closest_safest(engine, u, cells, goals, threat))
+        targets = engine.targets(u)
+        if targets:
+            engine.attack(u, weakest(targets))
+
+
+POLICIES = {
+    'random': random_policy,
+    'greedy': greedy_policy,
+}
+
+
+def play(engine, policy_p1, policy_p2, max_turns=200):
+    # Plays until someone wins or max_turns is reached, returns the winner (0 = draw)
+    policies = {1: policy_p1, 2: policy_p2}
+    while engine.check_victory() is None and engine.turn_count <= max_turns:
+        policies[engine.turn](engine)
+        engine.end_turn()
+    return engine.check_victory() or 0
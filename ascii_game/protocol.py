@@ -0,0 +1,102 @@
+"""
+Wire format between the match server (server.py) and its clients.
+
+Every message is one JSON object on its own line, with the kind of message
+in "op". Clients send
+
+    {"op": "join", "match": name}                        joins (or opens) a match
+    {"op": "move", "unit": i, "x": x, "y": y}
+    {"op": "attack", "unit": i, "target": j}
+    {"op": "end_turn"}
+
+where units are indices into the match's UnitStore. The server answers a
+join with the whole match once
+
+    {"op": "welcome", "player": p, "map": [rows], "elevation": [rows],
+     "armies": [army_p1, army_p2], "turn": t, "turn_count": n, "units": [rows]}
+
+and after every action sends both players only what changed
+
+    {"op": "delta", "turn": t, "turn_count": n, "message": text, "units": [rows]}
+
+a row being [index, x, y, hp, ws1_ammo, ws2_ammo, moved, acted] (the
+STATE_COLUMNS of units.py) of a unit whose state differs from before the
+action. A rejected command gets {"op": "error", "message": text} back, only
+to its sender. {"op": "joined"} tells the first player of a match that the
+second one is in, {"op": "left"} that the opponent disconnected.
+"""
+
+import json
+
+from engine import Battlefield, Engine
+from mapfile import elevation_array, grid_array
+
+
+def encode(msg):
+    return json.dumps(msg, separators=(',', ':')).encode() + b'\n'
+
+
+def decode(line):
+    return json.loads(line)
+
+
+def unit_rows(units, indices):
+    return [[i] + units.row(i) for i in indices]
+
+
+def welcome(engine, player, armies):
+    field = engine.field
+    return {
+        'op': 'welcome',
+        'player': player,
+        'map': [bytes(row).decode() for row in field.terrain.tolist()],
+        'elevation': field.elevation.tolist(),
+        'armies': armies,
+        'turn': engine.turn,
+        'turn_count': engine.turn_count,
+        'units': unit_rows(engine.units, range(len(engine.units))),
+    }
+
+
+def delta(engine, state):
+    # What changed since units.state() was `state`
+    return {
+        'op': 'delta',
+        'turn': engine.turn,
+        'turn_count': engine.turn_count,
+        'message': engine.message,
+        'units': unit_rows(engine.units, engine.units.changed_since(state)),
+    }
+
+
+def mirror(msg, field=None):
+    # Client side copy of the match in a welcome message; clients of many
+    # matches on the same map can pass one shared Battlefield
+    if field is None:
+        field = Battlefield(grid_array(msg['map']), elevation_array(msg['elevation']))
+    engine = Engine(field, *msg['armies'])
+    apply(engine, msg)
+    return engine
+
+
+def apply(engine, msg):
+    # Bring a mirror up to date with a welcome or delta message
+    engine.turn = msg['turn']
+    engine.turn_count = msg['turn_count']
+    engine.message = msg.get('message', engine.message)
+    units = engine.units
+    # Units that moved or died leave their cell first, another one may have
+    # just moved into it; fog of war is only redone for those
+    rows = [(units[r[0]], r) for r in msg['units']]
+    relocated = [(u, r) for u, r in rows if u.is_alive() and (r[1], r[2], r[3] > 0) != (u.x, u.y, True)]
+    for u, r in relocated:
+        engine.kill_unit(u)
+    for u, (i, x, y, hp, ws1_ammo, ws2_ammo, moved, acted) in rows:
+        u.x, u.y, u.hp = x, y, hp
+        u.ws1_ammo, u.ws2_ammo = ws1_ammo, ws2_ammo
+        u.moved, u.acted = moved, acted
+        engine.dirty.add((x, y))
+    for u, r in relocated:
+        if u.hp > 0:
+            engine.occupancy.add(u)
+            engine.visibility.add(u)
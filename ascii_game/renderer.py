@@ -0,0 +1,171 @@
+"""
+Incremental curses renderer for the battle map.
+
+The screen is split into three windows (map, info panel, message bar).
+The map window is a viewport sized to what fits next to the info panel;
+the camera scrolls to keep the cursor SCROLL_MARGIN cells inside it and
+only visible cells are ever asked for, so maps can be much larger than
+the terminal.
+Only map cells marked dirty are redrawn: the old and new cursor cell,
+cells touched by units that moved or got hit and cells whose overlay
+(move highlight, route preview) changed. Panel and message text is diffed
+line by line. All windows are flushed with noutrefresh() and a single
+doupdate(), so a cursor move sends a handful of bytes instead of
+repainting the terminal.
+"""
+
+import curses
+
+# Columns kept free for the info panel next to the map
+INFO_WIDTH = 40
+SCROLL_MARGIN = 3
+
+
+class Renderer:
+    def __init__(self, stdscr, width, height, cursor_attr, highlight_attr, info_height=20, msg_height=6):
+        self.stdscr = stdscr
+        self.width = width      # map size
+        self.height = height
+        self.cursor_attr = cursor_attr
+        self.highlight_attr = highlight_attr
+        self.info_height = info_height
+        self.msg_height = msg_height
+
+        self.cam_x = 0
+        self.cam_y = 0
+        self.dirty = set()
+        self.overlay = {}
+        self.cursor = None
+        self.info_lines = []
+        self.msg_lines = []
+        self.layout()
+
+    def layout(self):
+        # (Re)create the windows for the current terminal size
+        lines, cols = self.stdscr.getmaxyx()
+        self.view_w = max(1, min(self.width, cols - INFO_WIDTH - 4))
+        self.view_h = max(1, min(self.height, lines - self.msg_height - 3))
+        info_x = self.view_w + 4
+        self.map_win = curses.newwin(self.view_h+2, self.view_w+2, 0, 0)
+        self.info_win = curses.newwin(self.info_height, max(1, cols-info_x), 0, info_x) if cols > info_x else None
+        self.msg_win = curses.newwin(self.msg_height, cols, self.view_h+3, 0) if lines > self.view_h+3 else None
+        self.full = True
+
+    def mark(self, x, y):
+        self.dirty.add((x, y))
+
+    def invalidate(self):
+        # Next draw() repaints everything (first frame, restart)
+        self.full = True
+
+    def resize(self):
+        self.layout()
+
+    def follow(self, x, y):
+        # Scroll the camera to keep (x, y) in view, True if it moved
+        cam_x = scroll(self.cam_x, x, self.view_w, self.width)
+        cam_y = scroll(self.cam_y, y, self.view_h, self.height)
+        if (cam_x, cam_y) == (self.cam_x, self.cam_y):
+            return False
+        self.cam_x, self.cam_y = cam_x, cam_y
+        return True
+
+    def visible(self, x, y):
+        return 0 <= x - self.cam_x < self.view_w and 0 <= y - self.cam_y < self.view_h
+
+    def put(self, win, y, x, text, attr=0):
+        # Writing the bottom-right cell of a window raises even though it succeeds
+        try:
+            if len(text) == 1:
+                win.addch(y, x, text, attr)
+            else:
+                win.addstr(y, x, text, attr)
+        except curses.error:
+            pass
+
+    def draw_border(self):
+        for y in range(self.view_h+2):
+            for x in range(self.view_w+2):
+                if y==0 or y==self.view_h+1:
+                    ch = '-'
+                elif x==0 or x==self.view_w+1:
+                    ch = '|'
+                else:
+                    continue
+                self.put(self.map_win, y, x, ch)
+
+    def draw_lines(self, win, old, new):
+        # Rewrite only the rows whose text changed
+        if win is None:
+            return
+        rows, cols = win.getmaxyx()
+        for i in range(min(rows, max(len(old), len(new)))):
+            text = new[i] if i < len(new) else ""
+            if i < len(old) and old[i] == text:
+                continue
+            win.move(i, 0)
+            win.clrtoeol()
+            self.put(win, i, 0, text[:cols-1])
+
+    def draw(self, game):
+        overlay = game.overlay()
+        cursor = (game.cursor_x, game.cursor_y)
+        scrolled = self.follow(*cursor)
+
+        if self.full:
+            self.full = False
+            self.stdscr.clear()
+            self.stdscr.noutrefresh()
+            for win in (self.map_win, self.info_win, self.msg_win):
+                if win is not None:
+                    win.erase()
+            self.draw_border()
+            self.info_lines = []
+            self.msg_lines = []
+            scrolled = True
+        if scrolled:
+            dirty = [(self.cam_x + x, self.cam_y + y) for y in range(self.view_h) for x in range(self.view_w)]
+        else:
+            dirty = self.dirty
+            for cell in overlay.keys() | self.overlay.keys():
+                if overlay.get(cell) != self.overlay.get(cell):
+                    dirty.add(cell)
+            dirty.add(cursor)
+            if self.cursor is not None:
+                dirty.add(self.cursor)
+        self.dirty = set()
+        self.overlay = overlay
+        self.cursor = cursor
+
+        for x, y in dirty:
+            if not self.visible(x, y):
+                continue
+            if (x, y) in overlay:
+                ch, attr = overlay[x, y], self.highlight_attr
+            else:
+                ch, attr = game.cell_look(x, y)
+            if (x, y) == cursor:
+                attr = self.cursor_attr
+            self.put(self.map_win, y-self.cam_y+1, x-self.cam_x+1, ch, attr)
+
+        info_lines = game.info_lines()
+        self.draw_lines(self.info_win, self.info_lines, info_lines)
+        self.info_lines = info_lines
+        msg_lines = game.message_lines()
+        self.draw_lines(self.msg_win, self.msg_lines, msg_lines)
+        self.msg_lines = msg_lines
+
+        for win in (self.map_win, self.info_win, self.msg_win):
+            if win is not None:
+                win.noutrefresh()
+        curses.doupdate()
+
+
+def scroll(cam, pos, view, size):
+    # Camera start along one axis so pos stays SCROLL_MARGIN cells inside the view
+    margin = min(SCROLL_MARGIN, (view - 1) // 2)
+    if pos < cam + margin:
+        cam = pos - margin
+    elif pos > cam + view - 1 - margin:
+        cam = pos - view + 1 + margin
+    return max(0, min(cam, size - view))
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Replay logs for ASCII Battle.
+
+A ReplayLog attached to an Engine appends every command that succeeds to
+a binary file as it happens. Attacks roll their dice from Engine.dice,
+seeded from the match seed, so the seed and the commands are all it takes
+to play the match again exactly:
+
+    offset  size   content
+    0       8      magic b'ASCIIREP'
+    8       2      format version (uint16, little endian)
+    10      2      reserved
+    12      8      match seed (uint64)
+    20      4      CRC-32 of the map's terrain and elevation bytes
+    24      4      length n of the JSON part (uint32)
+    28      n      JSON {"map": file, "elev": file, "armies": [army_p1, army_p2]}
+    28+n    9*k    k commands: op (uint8), unit index (uint32), argument (int32)
+
+The map files are named relative to the log's directory, so a log can be
+played back from anywhere as long as it moves along with its maps.
+The argument is the target cell (y * width + x) of a move, the target
+unit's index for an attack and 0 for end of turn. Selecting a unit changes
+nothing in the match, so it isn't logged.
+
+Replay plays a log back headlessly through the normal rules, which would
+refuse a command that doesn't fit (a changed rule or map), raising
+ReplayError instead of drifting away from the original match. While it
+plays it keeps a clone of the engine (Engine.clone) at the start of every
+SNAPSHOT_EVERY-th turn, so seek(turn) only replays from the nearest one.
+
+    python3 replay.py game.rep              (replay it all, print the result)
+    python3 replay.py game.rep --turn 40    (state at the start of turn 40)
+    python3 simulate.py -n 1000 --replays logs/   (log every simulated match)
+"""
+
+import argparse
+import json
+import os
+import struct
+import time
+import zlib
+
+from engine import Battlefield, Engine
+
+MAGIC = b'ASCIIREP'
+VERSION = 4     # 2: attacks roll to hit and spend ammo (combat.py), 3: antiair, 4: sight over one-level rises; older logs play differently
+HEADER = struct.Struct('<8sHHQII')
+RECORD = struct.Struct('<BIi')
+REPLAY_EXT = '.rep'
+SNAPSHOT_EVERY = 10     # turns between the snapshots seek() starts from
+
+MOVE = 1
+ATTACK = 2
+END_TURN = 3
+
+
+class ReplayError(Exception):
+    pass
+
+
+def map_crc(field):
+    return zlib.crc32(field.elevation.tobytes(), zlib.crc32(field.terrain.tobytes()))
+
+
+def map_paths(field, path):
+    # The field's map and elevation files relative to the directory of the
+    # log or save at `path` (absolute when on another drive)
+    base = os.path.dirname(os.path.abspath(path))
+    paths = []
+    for f in field.files:
+        if f is not None:
+            try:
+                f = os.path.relpath(os.path.abspath(f), base)
+            except ValueError:
+                f = os.path.abspath(f)
+        paths.append(f)
+    return paths
+
+
+def resolve_paths(path, map_file, elev_file):
+    # The files map_paths() stored in the log or save at `path`, as paths from here
+    base = os.path.dirname(os.path.abspath(path))
+    return (os.path.normpath(os.path.join(base, map_file)),
+            elev_file and os.path.normpath(os.path.join(base, elev_file)))
+
+
+class ReplayLog:
+    def __init__(self, path, engine):
+        # Starts recording `engine`, which must not have played anything yet.
+        # Its map has to come from files (Battlefield.from_files).
+        if engine.field.files is None:
+            raise ValueError("Only matches on maps loaded from files can be recorded.")
+        map_file, elev_file = map_paths(engine.field, path)
+        info = json.dumps({'map': map_file, 'elev': elev_file, 'armies': engine.armies}).encode()
+        self.width = engine.width
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0, engine.seed, map_crc(engine.field), len(info)) + info)
+        engine.log = self
+
+    def move(self, unit, x, y):
+        self.file.write(RECORD.pack(MOVE, unit.index, y * self.width + x))
+
+    def attack(self, unit, target):
+        self.file.write(RECORD.pack(ATTACK, unit.index, target.index))
+
+    def end_turn(self):
+        self.file.write(RECORD.pack(END_TURN, 0, 0))
+        # A crash loses the current turn at most
+        self.file.flush()
+
+    def mark(self):
+        # Position after the commands so far, for truncate()
+        return self.file.tell()
+
+    def truncate(self, pos):
+        # Forget the commands after mark() returned `pos` (a take-back)
+        self.file.seek(pos)
+        self.file.truncate()
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class Replay:
+    def __init__(self, path, field=None):
+        # `field` saves loading the map again when replaying many logs of it
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < HEADER.size:
+            raise ValueError(f'{path}: not a replay (file too short)')
+        magic, version, _, self.seed, crc, n = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f'{path}: not a replay')
+        if version != VERSION:
+            raise ValueError(f'{path}: unsupported replay format version {version}')
+        info = json.loads(data[HEADER.size:HEADER.size + n])
+        self.map_file, self.elev_file = resolve_paths(path, info['map'], info['elev'])
+        self.armies = info['armies']
+        self.field = field or Battlefield.from_files(self.map_file, self.elev_file)
+        if map_crc(self.field) != crc:
+            raise ReplayError(f'{path}: recorded on a different version of {self.map_file}')
+        body = data[HEADER.size + n:]
+        # A crash can cut the last record short
+        body = body[:len(body) - len(body) % RECORD.size]
+        self.records = list(RECORD.iter_unpack(body))
+        # Index of the first record of each turn, turn_count t starts at starts[t - 1]
+        self.starts = [0] + [i + 1 for i, r in enumerate(self.records) if r[0] == END_TURN]
+        self.snapshots = {}     # turn_count -> engine at the start of that turn
+
+    @property
+    def turns(self):
+        # Turns started in the log, the last one may be unfinished
+        return len(self.starts)
+
+    def new_engine(self):
+        return Engine(self.field, *self.armies, seed=self.seed)
+
+    def play(self, engine, start, stop):
+        # Play records start..stop-1 on `engine`, which must be where record start begins
+        units = engine.units
+        width = engine.width
+        for i in range(start, stop):
+            if engine.turn_count % SNAPSHOT_EVERY == 0 and engine.turn_count not in self.snapshots \
+                    and self.starts[engine.turn_count - 1] == i:
+                self.snapshots[engine.turn_count] = engine.clone()
+            op, unit, arg = self.records[i]
+            if op in (MOVE, ATTACK) and unit >= len(units):
+                raise ReplayError(f"record {i}: there is no unit {unit}")
+            if op == ATTACK and not 0 <= arg < len(units):
+                raise ReplayError(f"record {i}: there is no unit {arg}")
+            if op == MOVE:
+                ok = engine.move(units[unit], arg % width, arg // width)
+            elif op == ATTACK:
+                ok = engine.attack(units[unit], units[arg])
+            elif op == END_TURN:
+                engine.end_turn()
+                ok = True
+            else:
+                raise ReplayError(f"record {i}: unknown command {op}")
+            if not ok:
+                raise ReplayError(f"record {i} (turn {engine.turn_count}): {engine.message}")
+        return engine
+
+    def run(self):
+        # Engine after the whole log
+        return self.play(self.new_engine(), 0, len(self.records))
+
+    def seek(self, turn):
+        # Engine at the start of turn `turn` (a turn_count), from the nearest snapshot
+        if not 1 <= turn <= self.turns:
+            raise ValueError(f"The log has turns 1 to {self.turns}.")
+        known = [t for t in self.snapshots if t <= turn]
+        if known:
+            start = max(known)
+            engine = self.snapshots[start].clone()
+        else:
+            start = 1
+            engine = self.new_engine()
+        return self.play(engine, self.starts[start - 1], self.starts[turn - 1])
+
+
+def describe(engine):
+    lines = []
+    for player in (1, 2):
+        units = engine.units.alive(player)
+        hp = sum(u.hp for u in units)
+        lines.append(f"  player {player}: {len(units)} units, {hp} hp  " +
+                     " ".join(f"{u.kind}({u.x},{u.y})" for u in units))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded ASCII Battle match headlessly.")
+    parser.add_argument("log", help="replay log (.rep)")
+    parser.add_argument("--turn", type=int, help="show the state at the start of this turn instead of the end")
+    args = parser.parse_args(argv)
+
+    try:
+        replay = Replay(args.log)
+    except (ReplayError, ValueError) as e:
+        parser.exit(1, f"{e}\n")
+    print(f"{args.log}: {replay.map_file}, seed {replay.seed}, {len(replay.records)} commands, {replay.turns} turns")
+    t0 = time.perf_counter()
+    try:
+        if args.turn is None:
+            engine = replay.run()
+        else:
+            engine = replay.seek(args.turn)
+    except (ReplayError, ValueError) as e:
+        parser.exit(1, f"{e}\n")
+    t = time.perf_counter() - t0
+    print(f"Replayed to turn {engine.turn_count} in {t * 1000:.1f} ms")
+    winner = engine.check_victory()
+    if winner:
+        print(f"Player {winner} won.")
+    print("\n".join(describe(engine)))
+
+
+if __name__ == '__main__':
+    main()
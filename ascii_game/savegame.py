@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Saved games for ASCII Battle.
+
+save() writes the whole state of a match (turn, every unit with its
+position, hp, ammo and moved/acted flags, scores and both random
+generators) to a compact binary file; load() gives back an Engine that
+plays on exactly as the saved one would have:
+
+    offset  size   content
+    0       8      magic b'ASCIISAV'
+    8       2      format version (uint16, little endian)
+    10      2      player to move (uint16)
+    12      8      match seed (uint64)
+    20      4      CRC-32 of the map's terrain and elevation bytes
+    24      4      turn_count (uint32)
+    28      4      number of units n (uint32)
+    32      4      length m of the JSON part (uint32)
+    36      m      JSON {"map", "elev", "armies", "kinds", "damage", "kills", "message"}
+    36+m    5000   states of Engine.rng and Engine.dice, 625 uint32 each
+    ...     15*n   unit columns one after the other, see COLUMNS
+
+The unit table is written column by column straight from the UnitStore
+arrays, so saving a thousand units is a few memcpys. Units keep their
+index, which is what replay logs and the network protocol refer to them by.
+On load the map is taken from the files named in the save, relative to its
+directory (or the given Battlefield), and checked against the CRC; occupancy and fog of war are
+rebuilt from the living units.
+
+    python3 savegame.py game.sav            (describe a save)
+
+In-memory copies for look-ahead and take-back don't go through a file,
+see Engine.clone().
+"""
+
+import argparse
+import json
+import random
+import struct
+from array import array
+
+import numpy as np
+
+from engine import Battlefield, Engine
+from replay import describe, map_crc, map_paths, resolve_paths
+from units import Unit
+
+MAGIC = b'ASCIISAV'
+VERSION = 1
+HEADER = struct.Struct('<8sHHQIIII')
+RNG_STATE = struct.Struct('<625I')
+SAVE_EXT = '.sav'
+
+# UnitStore column -> little endian type in the file, in file order
+COLUMNS = (
+    ('x', '<i2'),
+    ('y', '<i2'),
+    ('owner', 'u1'),
+    ('kind', 'u1'),
+    ('hp', '<i2'),
+    ('ws1_ammo', '<i2'),
+    ('ws2_ammo', '<i2'),
+    ('moved', 'u1'),
+    ('acted', 'u1'),
+)
+
+
+def pack_rng(rng):
+    version, words, gauss_next = rng.getstate()
+    return RNG_STATE.pack(*words)
+
+
+def unpack_rng(data, offset):
+    rng = random.Random()
+    rng.setstate((3, RNG_STATE.unpack_from(data, offset), None))
+    return rng
+
+
+def save(engine, path):
+    # The map has to come from files (Battlefield.from_files), the save only names them
+    if engine.field.files is None:
+        raise ValueError("Only matches on maps loaded from files can be saved.")
+    map_file, elev_file = map_paths(engine.field, path)
+    store = engine.units
+    info = json.dumps({
+        'map': map_file,
+        'elev': elev_file,
+        'armies': engine.armies,
+        'kinds': store.kinds,
+        'damage': [[owner, kind, n] for (owner, kind), n in engine.damage.items()],
+        'kills': [[owner, kind, n] for (owner, kind), n in engine.kills.items()],
+        'message': engine.message,
+    }).encode()
+    parts = [
+        HEADER.pack(MAGIC, VERSION, engine.turn, engine.seed, map_crc(engine.field),
+                    engine.turn_count, len(store), len(info)),
+        info,
+        pack_rng(engine.rng),
+        pack_rng(engine.dice),
+    ]
+    for name, dtype in COLUMNS:
+        col = getattr(store, name)
+        parts.append(np.frombuffer(col, col.typecode).astype(dtype).tobytes())
+    with open(path, 'wb') as f:
+        f.write(b''.join(parts))
+
+
+def load(path, field=None):
+    # Engine in the saved state; `field` saves loading the map again
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError(f'{path}: not a saved game (file too short)')
+    magic, version, turn, seed, crc, turn_count, n, m = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f'{path}: not a saved game')
+    if version != VERSION:
+        raise ValueError(f'{path}: unsupported save format version {version}')
+    size = HEADER.size + m + 2 * RNG_STATE.size + n * sum(np.dtype(t).itemsize for _, t in COLUMNS)
+    if len(data) != size:
+        raise ValueError(f'{path}: saved game is damaged ({len(data)} bytes, expected {size})')
+    info = json.loads(data[HEADER.size:HEADER.size + m])
+    field = field or Battlefield.from_files(*resolve_paths(path, info['map'], info['elev']))
+    if map_crc(field) != crc:
+        raise ValueError(f"{path}: saved on a different version of {info['map']}")
+
+    # An engine without units, filled in from the columns below
+    engine = Engine(field, [], [], seed=seed)
+    engine.armies = tuple(info['armies'])
+    engine.turn = turn
+    engine.turn_count = turn_count
+    engine.message = info['message']
+    for owner, kind, count in info['damage']:
+        engine.damage[owner, kind] = count
+    for owner, kind, count in info['kills']:
+        engine.kills[owner, kind] = count
+    offset = HEADER.size + m
+    engine.rng = unpack_rng(data, offset)
+    engine.dice = unpack_rng(data, offset + RNG_STATE.size)
+    offset += 2 * RNG_STATE.size
+
+    store = engine.units
+    for name, dtype in COLUMNS:
+        typecode = getattr(store, name).typecode
+        values = np.frombuffer(data, dtype, n, offset)
+        setattr(store, name, array(typecode, values.astype(np.dtype(typecode)).tobytes()))
+        offset += n * values.itemsize
+    # Kind codes of the save -> this version's
+    try:
+        codes = [store.kind_codes[kind] for kind in info['kinds']]
+    except KeyError as e:
+        raise ValueError(f'{path}: unknown unit type {e}') from None
+    if any(k >= len(codes) for k in store.kind):
+        raise ValueError(f'{path}: saved game is damaged (unknown unit kind)')
+    store.kind = array('B', (codes[k] for k in store.kind))
+    store.units = [Unit(store, i, store.unit_types[store.kinds[k]]) for i, k in enumerate(store.kind)]
+
+    for u in store:
+        if u.is_alive():
+            if not engine.occupancy.in_bounds(u.x, u.y):
+                raise ValueError(f'{path}: unit {u.index} is off the map')
+            engine.occupancy.add(u)
+            engine.visibility.add(u)
+    for player in (1, 2):
+        engine.visibility.take_changed(player)
+    engine.dirty.clear()
+    return engine
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Describe a saved ASCII Battle match.")
+    parser.add_argument("save", help="saved game (.sav)")
+    args = parser.parse_args(argv)
+    try:
+        engine = load(args.save)
+    except (OSError, ValueError) as e:
+        parser.exit(1, f"{e}\n")
+    map_file, _ = engine.field.files
+    print(f"{args.save}: {map_file}, seed {engine.seed}, turn {engine.turn_count}, player {engine.turn} to move")
+    print("\n".join(describe(engine)))
+
+
+if __name__ == '__main__':
+    main()
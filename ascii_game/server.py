@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Networked multiplayer server for ASCII Battle.
+
+One asyncio process hosts any number of matches. Each match is an
+authoritative Engine, clients only send commands (move, attack, end_turn)
+and get the result back as deltas holding just the units that changed;
+see protocol.py for the messages. All matches share one Battlefield, so
+a match costs little more than its units and fog of war counters.
+
+Players join a match by name: the first one to join gets player 1, the
+second player 2, and the match starts once both are in. A match is dropped
+when its last player leaves.
+
+    python3 server.py --port 8765 --map map3.txt --elev elevation2.txt
+    python3 client.py --match duel          (twice, one per player)
+    python3 loadgen.py --matches 200        (load test, see loadgen.py)
+
+Commands are applied in the order they arrive and every match handles one
+at a time, so there is no locking; the rules never block. Fog of war is
+drawn by the clients, which do get the positions of unspotted enemies.
+"""
+
+import argparse
+import asyncio
+import sys
+
+import protocol
+from engine import ARMY_P1, ARMY_P2, Battlefield, Engine
+
+DEFAULT_PORT = 8765
+
+
+class DeadUnit(Exception):
+    pass
+
+
+class Match:
+    def __init__(self, name, field, armies):
+        self.name = name
+        self.armies = armies
+        self.engine = Engine(field, *armies)
+        self.players = {}   # player -> StreamWriter
+
+    def free_player(self):
+        for p in (1, 2):
+            if p not in self.players:
+                return p
+        return None
+
+    def command(self, player, msg):
+        # Apply a command from `player`, the error message if it was refused
+        e = self.engine
+        if len(self.players) < 2:
+            return "Waiting for the other player to join."
+        if e.check_victory() is not None:
+            return "The match is over."
+        if e.turn != player:
+            return "It is not your turn."
+        op = msg.get('op')
+        if op == 'end_turn':
+            e.end_turn()
+            return None
+        try:
+            unit = self.unit(msg['unit'])
+            if op == 'move':
+                x, y = int(msg['x']), int(msg['y'])
+                if not e.occupancy.in_bounds(x, y):
+                    return "Target cell is off the map."
+                ok = e.move(unit, x, y)
+            elif op == 'attack':
+                ok = e.attack(unit, self.unit(msg['target']))
+            else:
+                return f"Unknown command: {op}"
+        except DeadUnit as dead:
+            return f"Unit {dead.args[0]} is dead."
+        except (KeyError, IndexError, TypeError, ValueError):
+            return f"Malformed {op} command."
+        return None if ok else e.message
+
+    def unit(self, index):
+        # Unit a command refers to; dead units can't be commanded or attacked
+        if not 0 <= index < len(self.engine.units):
+            raise IndexError(index)
+        unit = self.engine.units[index]
+        if not unit.is_alive():
+            raise DeadUnit(index)
+        return unit
+
+
+class Server:
+    def __init__(self, field, armies=(ARMY_P1, ARMY_P2)):
+        self.field = field
+        self.armies = armies
+        self.matches = {}
+
+    async def send(self, writer, msg):
+        writer.write(protocol.encode(msg))
+        await writer.drain()
+
+    async def broadcast(self, match, msg):
+        data = protocol.encode(msg)
+        writers = list(match.players.values())
+        for w in writers:
+            w.write(data)
+        # drain() only waits when a client is slow to read, one at a time is fine
+        for w in writers:
+            try:
+                await w.drain()
+            except ConnectionError:
+                pass
+
+    def join(self, name, writer):
+        match = self.matches.get(name)
+        if match is None:
+            match = self.matches[name] = Match(name, self.field, self.armies)
+        player = match.free_player()
+        if player is not None:
+            match.players[player] = writer
+        return match, player
+
+    async def leave(self, match, player):
+        del match.players[player]
+        if match.players:
+            await self.broadcast(match, {'op': 'left'})
+        else:
+            del self.matches[match.name]
+
+    async def handle(self, reader, writer):
+        match = player = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    msg = protocol.decode(line)
+                    op = msg['op']
+                except (ValueError, KeyError, TypeError):
+                    await self.send(writer, {'op': 'error', 'message': "Malformed message."})
+                    continue
+
+                if op == 'join':
+                    if match is not None:
+                        await self.send(writer, {'op': 'error', 'message': "Already in a match."})
+                        continue
+                    match, player = self.join(str(msg.get('match', '')), writer)
+                    if player is None:
+                        match = None
+                        await self.send(writer, {'op': 'error', 'message': "Match is full."})
+                        continue
+                    await self.send(writer, protocol.welcome(match.engine, player, match.armies))
+                    if len(match.players) == 2:
+                        other = match.players[2 if player == 1 else 1]
+                        await self.send(other, {'op': 'joined'})
+                elif match is None:
+                    await self.send(writer, {'op': 'error', 'message': "Join a match first."})
+                else:
+                    state = match.engine.units.state()
+                    error = match.command(player, msg)
+                    if error:
+                        await self.send(writer, {'op': 'error', 'message': error})
+                    else:
+                        await self.broadcast(match, protocol.delta(match.engine, state))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if match is not None:
+                await self.leave(match, player)
+            writer.close()
+
+
+async def serve(field, host, port):
+    server = Server(field)
+    tcp = await asyncio.start_server(server.handle, host, port)
+    print(f"Serving {field.width}x{field.height} matches on {host}:{port}")
+    async with tcp:
+        await tcp.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Host ASCII Battle matches over TCP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--map", default="map3.txt", help="text map, or a compiled .map (then --elev is not used)")
+    parser.add_argument("--elev", default="elevation2.txt")
+    args = parser.parse_args(argv)
+
+    field = Battlefield.from_files(args.map, args.elev)
+    problems = field.problems()
+    if problems:
+        parser.error(f"{args.map} can't be played: " + " ".join(problems))
+    try:
+        asyncio.run(serve(field, args.host, args.port))
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
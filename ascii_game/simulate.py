@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Monte Carlo balance simulator for ASCII Battle.
+
+Plays N headless matches between two army lists and reports win rates,
+match length and damage/kills per unit type. Matches are spread over a
+multiprocessing pool; match i always uses seed `--seed + i`, so results do
+not depend on the number of workers or on scheduling. Every finished match
+is appended to the --out file as one JSON line right away, only running
+totals are kept in memory.
+
+Example:
+    python3 simulate.py -n 10000 --army1 ">XOTmR" --army2 "XXTOXX" --policy1 greedy --policy2 greedy
+    python3 simulate.py -n 1000 --deck1 Blitz --deck2 "Iron Wall"   (decks from armoury.py)
+    python3 simulate.py --matchups --cover 1     (expected damage per attack, kind against kind)
+
+The `search` policy is the computer opponent of ai.py, thinking --budget ms
+per turn; its matches depend on timing as well as on the seed. With
+--replays DIR every match is also recorded to DIR/game-<i>.rep, to be
+played again with replay.py.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+from ai import search_policy
+from armoury import DEFAULT_DB, Armoury, DeckError, army
+from engine import Battlefield, Engine, COMBAT, UNIT_TYPES, ARMY_P1, ARMY_P2, START_POSITIONS_P1, START_POSITIONS_P2
+from policies import POLICIES, play
+from replay import REPLAY_EXT, ReplayLog
+
+CHOICES = sorted(POLICIES) + ['search']
+
+# Set up once per worker process by init_worker()
+worker = {}
+
+
+def make_policy(name, budget_ms):
+    if name == 'search':
+        return search_policy(budget_ms)
+    return POLICIES[name]
+
+
+def init_worker(map_file, elev_file, army_p1, army_p2, policy_p1, policy_p2, budget_ms, seed, max_turns, replays):
+    worker['field'] = Battlefield.from_files(map_file, elev_file)
+    worker['armies'] = (army_p1, army_p2)
+    worker['policies'] = (make_policy(policy_p1, budget_ms), make_policy(policy_p2, budget_ms))
+    worker['seed'] = seed
+    worker['max_turns'] = max_turns
+    worker['replays'] = replays
+
+
+def play_game(i):
+    seed = worker['seed'] + i
+    e = Engine(worker['field'], *worker['armies'], seed=seed)
+    if worker['replays']:
+        log = ReplayLog(os.path.join(worker['replays'], f"game-{i}{REPLAY_EXT}"), e)
+    winner = play(e, *worker['policies'], max_turns=worker['max_turns'])
+    if worker['replays']:
+        log.close()
+    return {
+        'game': i,
+        'seed': seed,
+        'winner': winner,
+        'turns': e.turn_count,
+        'damage': {f"{owner}{kind}": n for (owner, kind), n in e.damage.items()},
+        'kills': {f"{owner}{kind}": n for (owner, kind), n in e.kills.items()},
+    }
+
+
+def matchups(cover, delta):
+    # Expected damage per attack of every unit kind against every other, with
+    # the better of its two weapons (ammo and range aside), in one batch
+    kinds = list(UNIT_TYPES)
+    ws = np.array([[UNIT_TYPES[k]['ws1'], UNIT_TYPES[k]['ws2']] for k in kinds])
+    arm = np.array([UNIT_TYPES[k]['arm'] for k in kinds])
+    flying = np.array([UNIT_TYPES[k]['flying'] for k in kinds])
+    covers = np.where(flying, 0, cover)
+    idx = COMBAT.indices(ws[:, None, :], arm[None, :, None], covers[None, :, None], delta, flying[None, :, None])
+    best = COMBAT.expected_array[idx].max(axis=2)
+    print(f"Expected damage per attack, targets in cover {cover}, shooters {delta} levels above them")
+    print(f"{'shooter':<18}" + "".join(f"{k:>6}" for k in kinds))
+    for k, row in zip(kinds, best):
+        print(f"{UNIT_TYPES[k]['name']:<13} [{k}] " + "".join(f"{v:6.2f}" for v in row))
+
+
+def parse_army(text, limit):
+    army = list(text.replace(",", "").replace(" ", ""))
+    for kind in army:
+        if kind not in UNIT_TYPES:
+            raise argparse.ArgumentTypeError(f"Unknown unit type: {kind}")
+    if len(army) > limit:
+        raise argparse.ArgumentTypeError(f"Army has {len(army)} units but only {limit} start positions.")
+    return army
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play many headless matches and aggregate the results.")
+    parser.add_argument("-n", "--games", type=int, default=1000)
+    parser.add_argument("--map", default="map3.txt", help="text map, or a compiled .map (then --elev is not used)")
+    parser.add_argument("--elev", default="elevation2.txt")
+    parser.add_argument("--army1", default="".join(ARMY_P1), help="unit kinds of player 1, e.g. '>XOTmR'")
+    parser.add_argument("--army2", default="".join(ARMY_P2))
+    parser.add_argument("--deck1", metavar="NAME", help="army of player 1 from the armoury, instead of --army1")
+    parser.add_argument("--deck2", metavar="NAME", help="army of player 2 from the armoury, instead of --army2")
+    parser.add_argument("--armoury", default=DEFAULT_DB, help="deck library for --deck1/--deck2")
+    parser.add_argument("--policy1", choices=CHOICES, default="greedy")
+    parser.add_argument("--policy2", choices=CHOICES, default="greedy")
+    parser.add_argument("--budget", type=int, default=5, help="ms per turn for the search policy")
+    parser.add_argument("--seed", type=int, default=0, help="match i is played with seed SEED+i")
+    parser.add_argument("--max-turns", type=int, default=200, help="matches still running after this are draws")
+    parser.add_argument("-j", "--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("-o", "--out", default="sim_results.jsonl", help="one JSON line per match")
+    parser.add_argument("--replays", metavar="DIR", help="record every match to a replay log in DIR")
+    parser.add_argument("--matchups", action="store_true", help="print the expected damage table and exit")
+    parser.add_argument("--cover", type=int, default=0, help="cover level of the targets for --matchups")
+    parser.add_argument("--delta", type=int, default=0, help="elevation levels above the targets for --matchups")
+    args = parser.parse_args(argv)
+
+    if args.matchups:
+        if not 0 <= args.cover < COMBAT.covers:
+            parser.error(f"cover levels go from 0 to {COMBAT.covers - 1}")
+        matchups(args.cover, args.delta)
+        return
+    if args.games < 1:
+        parser.error("play at least one game (-n 1)")
+    if args.workers < 1:
+        parser.error("use at least one worker process (-j 1)")
+
+    try:
+        army_p1 = parse_army(args.army1, len(START_POSITIONS_P1))
+        army_p2 = parse_army(args.army2, len(START_POSITIONS_P2))
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    if args.deck1 or args.deck2:
+        armoury = Armoury(args.armoury)
+        try:
+            if args.deck1:
+                army_p1 = army(armoury, args.deck1)
+            if args.deck2:
+                army_p2 = army(armoury, args.deck2)
+        except DeckError as e:
+            parser.error(str(e))
+        finally:
+            armoury.close()
+
+    problems = Battlefield.from_files(args.map, args.elev).problems()
+    if problems:
+        parser.error(f"{args.map} can't be played: " + " ".join(problems))
+    if args.replays:
+        os.makedirs(args.replays, exist_ok=True)
+
+    wins = Counter()
+    damage = Counter()
+    kills = Counter()
+    turns = 0
+    done = 0
+    t0 = time.perf_counter()
+    initargs = (args.map, args.elev, army_p1, army_p2, args.policy1, args.policy2, args.budget,
+                args.seed, args.max_turns, args.replays)
+    chunksize = max(1, min(64, args.games // (args.workers * 8)))
+
+    with open(args.out, "w") as out, multiprocessing.Pool(args.workers, init_worker, initargs) as pool:
+        for r in pool.imap_unordered(play_game, range(args.games), chunksize):
+            out.write(json.dumps(r) + "\n")
+            wins[r['winner']] += 1
+            turns += r['turns']
+            damage.update(r['damage'])
+            kills.update(r['kills'])
+            done += 1
+            if done % 1000 == 0:
+                print(f"\r{done}/{args.games} games", end="", file=sys.stderr, flush=True)
+    elapsed = time.perf_counter() - t0
+    if done >= 1000:
+        print(file=sys.stderr)
+
+    print(f"{done} games in {elapsed:.1f}s ({done / elapsed:.0f} games/s), results in {args.out}")
+    print(f"Player 1 ({args.policy1}, {''.join(army_p1)}): {wins[1] / done:6.1%} wins")
+    print(f"Player 2 ({args.policy2}, {''.join(army_p2)}): {wins[2] / done:6.1%} wins")
+    print(f"Draws (over {args.max_turns} turns): {wins[0] / done:6.1%}")
+    print(f"Average length: {turns / done:.1f} turns")
+    print()
+    print(f"{'unit':<20} {'dmg/game':>9} {'kills/game':>11}")
+    for key in sorted(damage.keys() | kills.keys()):
+        owner, kind = key[0], key[1:]
+        name = f"P{owner} {UNIT_TYPES[kind]['name']}"
+        print(f"{name:<20} {damage[key] / done:>9.2f} {kills[key] / done:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
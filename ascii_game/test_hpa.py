@@ -0,0 +1,45 @@
+"""
+Tests for hpa.Distances: route costs to a goal, across clusters and around water.
+
+    python3 -m pytest test_hpa.py
+"""
+
+import numpy as np
+
+from hpa import BLOCKED, AbstractGraph
+from pathfinding import astar
+
+
+def river_map():
+    # 12x12 ones with a wall down column 6, open only at the bottom row
+    cost = np.ones((12, 12), np.int32)
+    cost[:11, 6] = 0
+    return cost
+
+
+def test_costs_follow_the_way_around():
+    graph = AbstractGraph(river_map(), cluster=4)
+    dist = graph.distances(7, 0)
+    # Straight across is 2 cells, around the end of the wall at least 2 * 11 + 2
+    assert dist.at(5, 0) == graph.route(5, 0, 7, 0).cost >= 24
+    assert dist.at(5, 0) > dist.at(5, 10)
+    assert dist.at(6, 5) >= BLOCKED
+    assert dist.at(7, 0) == 0
+
+
+def test_costs_match_routes_and_exact_search():
+    rng = np.random.default_rng(0)
+    cost = rng.integers(1, 4, (24, 24)).astype(np.int32)
+    cost[rng.random((24, 24)) < 0.2] = 0
+    cost[5, 5] = 1
+    graph = AbstractGraph(cost, cluster=8)
+    dist = graph.distances(5, 5)
+    xs, ys = np.nonzero(cost.T)
+    costs = dist.costs(xs, ys)
+    for x, y, c in zip(xs.tolist(), ys.tolist(), costs.tolist()):
+        exact = astar(cost.ravel(), 24, 24, y * 24 + x, 5 * 24 + 5)
+        route = graph.route(x, y, 5, 5)
+        if exact is None:
+            assert c >= BLOCKED and route is None
+        else:
+            assert exact[0] <= c <= route.cost
@@ -0,0 +1,71 @@
+"""
+Tests for server.Match: commands that refer to dead units are refused.
+
+    python3 -m pytest test_server.py
+"""
+
+import os
+
+from engine import ARMY_P1, ARMY_P2, Battlefield
+from server import Match
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def new_match():
+    field = Battlefield.from_files(os.path.join(HERE, "map3.txt"), os.path.join(HERE, "elevation2.txt"))
+    match = Match("test", field, (ARMY_P1, ARMY_P2))
+    # Both seats taken, the writers aren't used by Match.command
+    match.players = {1: None, 2: None}
+    return match
+
+
+def kill(engine, unit):
+    unit.hp = 0
+    engine.kill_unit(unit)
+
+
+def test_dead_unit_cannot_move():
+    match = new_match()
+    e = match.engine
+    unit = e.units.alive(1)[0]
+    kill(e, unit)
+    error = match.command(1, {'op': 'move', 'unit': unit.index, 'x': unit.x + 1, 'y': unit.y})
+    assert error == f"Unit {unit.index} is dead."
+    assert not e.move(unit, unit.x + 1, unit.y)
+    assert e.message == "Selected unit is dead."
+
+
+def test_dead_unit_cannot_attack():
+    match = new_match()
+    e = match.engine
+    unit = e.units.alive(1)[0]
+    target = e.units.alive(2)[0]
+    kill(e, unit)
+    hp = target.hp
+    error = match.command(1, {'op': 'attack', 'unit': unit.index, 'target': target.index})
+    assert error == f"Unit {unit.index} is dead."
+    assert not e.attack(unit, target)
+    assert e.message == "Selected unit is dead."
+    assert target.hp == hp and not unit.acted
+
+
+def test_dead_target_is_refused():
+    match = new_match()
+    e = match.engine
+    unit = e.units.alive(1)[0]
+    target = e.units.alive(2)[0]
+    kill(e, target)
+    error = match.command(1, {'op': 'attack', 'unit': unit.index, 'target': target.index})
+    assert error == f"Unit {target.index} is dead."
+
+
+def test_refused_move_after_dead_unit_reports_engine_message():
+    match = new_match()
+    e = match.engine
+    dead, unit = e.units.alive(1)[:2]
+    kill(e, dead)
+    assert match.command(1, {'op': 'move', 'unit': dead.index, 'x': 0, 'y': 0}) == f"Unit {dead.index} is dead."
+    other = e.units.alive(1)[2]
+    error = match.command(1, {'op': 'move', 'unit': unit.index, 'x': other.x, 'y': other.y})
+    assert error == "Target cell is occupied."
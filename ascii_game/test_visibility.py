@@ -0,0 +1,43 @@
+"""
+Tests for visibility.SightMap: what rises in front of a viewer hides what is behind it.
+
+    python3 -m pytest test_visibility.py
+"""
+
+import numpy as np
+
+from engine import TERRAIN_TYPES
+from maplayers import MapLayers
+from visibility import SightMap
+
+
+def strip(terrain, elevation):
+    # One-row map from a terrain string and a list of levels
+    t = np.array([[ord(c) for c in terrain]], np.uint8)
+    e = np.array([elevation], np.int8)
+    return SightMap(MapLayers(t, e, TERRAIN_TYPES))
+
+
+def seen_xs(sight, radius=8, flying=False):
+    seen, spotted = sight.field_of_view(0, 0, radius, flying)
+    return sorted(seen)
+
+
+def test_one_level_rise_does_not_block():
+    sight = strip(".........", [0, 0, 0, 1, 0, 0, 0, 0, 0])
+    assert seen_xs(sight) == list(range(9))
+
+
+def test_two_level_rise_blocks():
+    sight = strip(".........", [0, 0, 0, 2, 0, 0, 0, 0, 0])
+    assert seen_xs(sight) == [0, 1, 2, 3]
+
+
+def test_woods_block_at_eye_height():
+    sight = strip("...F.....", [0] * 9)
+    assert seen_xs(sight) == [0, 1, 2, 3]
+
+
+def test_flying_units_look_over_woods():
+    sight = strip("...F.....", [0] * 9)
+    assert seen_xs(sight, flying=True) == list(range(9))
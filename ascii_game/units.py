@@ -0,0 +1,275 @@
+"""
+Compact unit storage for ASCII Battle.
+
+UnitStore keeps the per-unit state of a match as structure-of-arrays
+columns (position, owner, hp, ammo, moved/acted flags) in `array.array`s.
+Static stats (name, max hp, armor, movement, weapons, ...) are never copied
+per unit, they are read from the shared unit type table.
+
+A Unit is a small handle (index into the store + its type row) with the
+same attributes as before, so the rules, pathfinding and views don't care
+how units are stored. There is exactly one handle per unit, so handles can
+be compared and used as dict keys.
+
+Because the columns are plain machine arrays, NumPy can look at them
+without copying, which gives vectorized queries over the whole army
+(`within`, `alive`, `any_alive`) for large battles.
+"""
+
+from array import array
+
+import numpy as np
+
+# Below this many units a plain loop beats the NumPy call overhead
+VECTORIZE_MIN = 64
+# Columns that change during a match, what state() and changed_since() look at
+STATE_COLUMNS = ('x', 'y', 'hp', 'ws1_ammo', 'ws2_ammo', 'moved', 'acted')
+
+
+class Unit:
+    __slots__ = ('store', 'index', 'type')
+
+    def __init__(self, store, index, unit_type):
+        self.store = store
+        self.index = index
+        self.type = unit_type   # row of UNIT_TYPES, shared by all units of a kind
+
+    # Per-unit state lives in the store columns
+    @property
+    def x(self):
+        return self.store.x[self.index]
+
+    @x.setter
+    def x(self, value):
+        self.store.x[self.index] = value
+
+    @property
+    def y(self):
+        return self.store.y[self.index]
+
+    @y.setter
+    def y(self, value):
+        self.store.y[self.index] = value
+
+    @property
+    def owner(self):
+        return self.store.owner[self.index]
+
+    @property
+    def kind(self):
+        return self.store.kinds[self.store.kind[self.index]]
+
+    @property
+    def hp(self):
+        return self.store.hp[self.index]
+
+    @hp.setter
+    def hp(self, value):
+        self.store.hp[self.index] = value
+
+    @property
+    def ws1_ammo(self):
+        return self.store.ws1_ammo[self.index]
+
+    @ws1_ammo.setter
+    def ws1_ammo(self, value):
+        self.store.ws1_ammo[self.index] = value
+
+    @property
+    def ws2_ammo(self):
+        return self.store.ws2_ammo[self.index]
+
+    @ws2_ammo.setter
+    def ws2_ammo(self, value):
+        self.store.ws2_ammo[self.index] = value
+
+    @property
+    def moved(self):
+        return bool(self.store.moved[self.index])
+
+    @moved.setter
+    def moved(self, value):
+        self.store.moved[self.index] = value
+
+    @property
+    def acted(self):
+        return bool(self.store.acted[self.index])
+
+    @acted.setter
+    def acted(self, value):
+        self.store.acted[self.index] = value
+
+    # Static stats come from the type table
+    @property
+    def name(self):
+        return self.type['name']
+
+    @property
+    def max_hp(self):
+        return self.type['hp']
+
+    @property
+    def arm(self):
+        return self.type['arm']
+
+    @property
+    def move_range(self):
+        return self.type['move']
+
+    @property
+    def amph(self):
+        return self.type['amph']
+
+    @property
+    def flying(self):
+        return self.type['flying']
+
+    @property
+    def optics(self):
+        return self.type['optics']
+
+    @property
+    def ws1(self):
+        return self.type['ws1']
+
+    @property
+    def ws2(self):
+        return self.type['ws2']
+
+    def is_alive(self):
+        return self.store.hp[self.index] > 0
+
+    def distance_to(self, x, y):
+        return abs(self.x - x) + abs(self.y - y)
+
+    def display_ammo(self, ws_ammo):
+        ammo = ""
+        for i in range(ws_ammo):
+            ammo+="|"
+        return ammo
+
+
+class UnitStore:
+    def __init__(self, unit_types, weapon_types):
+        self.unit_types = unit_types
+        self.weapon_types = weapon_types
+        self.kinds = list(unit_types)
+        self.kind_codes = {k: i for i, k in enumerate(self.kinds)}
+
+        self.x = array('h')
+        self.y = array('h')
+        self.owner = array('B')
+        self.kind = array('B')     # index into self.kinds
+        self.hp = array('h')
+        self.ws1_ammo = array('h')
+        self.ws2_ammo = array('h')
+        self.moved = array('B')
+        self.acted = array('B')
+        self.units = []            # one handle per row
+
+    def __len__(self):
+        return len(self.units)
+
+    def __iter__(self):
+        return iter(self.units)
+
+    def __getitem__(self, index):
+        return self.units[index]
+
+    def add(self, x, y, owner, kind):
+        un = self.unit_types[kind]
+        self.x.append(x)
+        self.y.append(y)
+        self.owner.append(owner)
+        self.kind.append(self.kind_codes[kind])
+        self.hp.append(un['hp'])
+        self.ws1_ammo.append(self.weapon_types[un['ws1']]['ammo'])
+        self.ws2_ammo.append(self.weapon_types[un['ws2']]['ammo'])
+        self.moved.append(False)
+        self.acted.append(False)
+        unit = Unit(self, len(self.units), un)
+        self.units.append(unit)
+        return unit
+
+    def copy(self):
+        # Independent store with the same units, handles keep their index
+        store = UnitStore.__new__(UnitStore)
+        store.unit_types = self.unit_types
+        store.weapon_types = self.weapon_types
+        store.kinds = self.kinds
+        store.kind_codes = self.kind_codes
+        for name in ('x', 'y', 'owner', 'kind', 'hp', 'ws1_ammo', 'ws2_ammo', 'moved', 'acted'):
+            setattr(store, name, getattr(self, name)[:])
+        store.units = [Unit(store, u.index, u.type) for u in self.units]
+        return store
+
+    def reset_turn(self, owner):
+        # Clear moved/acted for all units of `owner`
+        if len(self.units) < VECTORIZE_MIN:
+            for u in self.units:
+                if u.owner == owner:
+                    u.moved = False
+                    u.acted = False
+            return
+        mine = np.frombuffer(self.owner, np.uint8) == owner
+        np.frombuffer(self.moved, np.uint8)[mine] = 0
+        np.frombuffer(self.acted, np.uint8)[mine] = 0
+
+    def state(self):
+        # Copies of the STATE_COLUMNS, to compare against later
+        return tuple(getattr(self, name)[:] for name in STATE_COLUMNS)
+
+    def changed_since(self, state):
+        # Indices of units with any STATE_COLUMNS value different from `state`
+        # (units added since count as changed)
+        n = len(self.units)
+        old_n = len(state[0])
+        changed = np.zeros(n, bool)
+        changed[old_n:] = True
+        for name, old in zip(STATE_COLUMNS, state):
+            new = getattr(self, name)
+            dtype = np.dtype(new.typecode)
+            changed[:old_n] |= np.frombuffer(new, dtype)[:old_n] != np.frombuffer(old, dtype)
+        return np.flatnonzero(changed).tolist()
+
+    def row(self, i):
+        # STATE_COLUMNS values of unit i
+        return [getattr(self, name)[i] for name in STATE_COLUMNS]
+
+    def columns(self):
+        # Zero-copy NumPy views of the position/owner/hp columns; don't keep
+        # them around, the arrays can't grow while a view exists
+        return (np.frombuffer(self.x, np.int16), np.frombuffer(self.y, np.int16),
+                np.frombuffer(self.owner, np.uint8), np.frombuffer(self.hp, np.int16))
+
+    def select(self, mask):
+        units = self.units
+        return [units[i] for i in np.flatnonzero(mask).tolist()]
+
+    def alive(self, owner=None):
+        # Living units, optionally only those of one player
+        if not self.units:
+            return []
+        x, y, own, hp = self.columns()
+        mask = hp > 0
+        if owner is not None:
+            mask &= own == owner
+        return self.select(mask)
+
+    def any_alive(self, owner):
+        if len(self.units) < VECTORIZE_MIN:
+            return any(u.is_alive() and u.owner == owner for u in self.units)
+        x, y, own, hp = self.columns()
+        return bool(np.any((hp > 0) & (own == owner)))
+
+    def within(self, x, y, r, owner=None):
+        # Living units at most r cells (Manhattan distance) from (x, y)
+        if len(self.units) < VECTORIZE_MIN:
+            return [u for u in self.units
+                    if u.is_alive() and (owner is None or u.owner == owner)
+                    and abs(u.x - x) + abs(u.y - y) <= r]
+        xs, ys, own, hp = self.columns()
+        mask = (np.abs(xs - x) + np.abs(ys - y) <= r) & (hp > 0)
+        if owner is not None:
+            mask &= own == owner
+        return self.select(mask)
@@ -0,0 +1,232 @@
+"""
+Line of sight and fog of war for ASCII Battle.
+
+Every unit gets a field of view computed with recursive shadowcasting
+(8 octants, circular radius from its optics rating). Ground units look
+from one level above their cell, flying units from FLYING_HEIGHT levels.
+A cell hides what is behind it when
+ - it is terrain without `los` (woods, houses, ...) whose top, elevation +
+   `el_height`, reaches the viewer's eyes, or
+ - its ground is above the viewer's eyes, i.e. more than one elevation
+   level above a ground unit; a rise of one level doesn't block
+so standing on a hill lets a unit look over woods below it.
+
+Units standing on terrain with `conceal` are only spotted from
+radius - conceal cells away.
+
+SightMap holds the static part (heights, concealment, memoized fields of
+view) and can be shared by every match on the same map. Visibility keeps,
+per player, two counters per cell: how many of its units see the cell and
+how many can spot a unit standing there. A unit's view is only recomputed
+when it moves, so rendering and attack checks are plain index lookups.
+Cells whose state flips for a player are collected in `changed`.
+
+The counters come in chunks of CHUNK cells (a couple of rows of a big map)
+that are only allocated once a unit looks into them, so a match on a huge
+map only holds counters around its units. Copies (for Engine.clone) share
+every chunk until either side writes to it, then copy just that chunk:
+a copy, and the first move made on it, cost as much as the army's views,
+not the map.
+"""
+
+from array import array
+
+import numpy as np
+
+FLYING_HEIGHT = 3
+# Fields of view only depend on static terrain, so they are memoized per
+# (cell, radius, flying); the memo is dropped once it grows past this size
+FOV_CACHE_SIZE = 16384
+# Counters per chunk, a power of two
+CHUNK_BITS = 12
+CHUNK = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK - 1
+
+# Octant transforms (xx, xy, yx, yy)
+OCTANTS = (
+    (1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+    (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1),
+)
+
+
+class SightMap:
+    def __init__(self, layers):
+        self.height = layers.height
+        self.width = layers.width
+        self.ground = layers.flat(layers.elevation)     # elevation level per cell
+        # Height up to which woods, houses, ... block sight, below any eye elsewhere
+        self.top = layers.flat(np.where(layers.blocks_los, layers.top, -128).astype(np.int8))
+        self.conceal = layers.flat(layers.conceal)
+        self.fov_cache = {}
+
+    def field_of_view(self, x, y, radius, flying):
+        # (seen, spotted) cell indices from (x, y), in increasing order
+        w = self.width
+        start = y * w + x
+        key = (start, radius, flying)
+        fov = self.fov_cache.get(key)
+        if fov is not None:
+            return fov
+        if len(self.fov_cache) >= FOV_CACHE_SIZE:
+            self.fov_cache = {}
+        eye = self.ground[start] + (FLYING_HEIGHT if flying else 1)
+        visible = {start}
+        for octant in OCTANTS:
+            self.cast(x, y, 1, 1.0, 0.0, radius, eye, octant, visible)
+        # Sorted, so Visibility.apply meets the cells chunk by chunk
+        visible = sorted(visible)
+
+        spotted = []
+        for i in visible:
+            dx = i % w - x
+            dy = i // w - y
+            r = radius - self.conceal[i]
+            if r >= 0 and dx*dx + dy*dy <= r*r:
+                spotted.append(i)
+        fov = (tuple(visible), tuple(spotted))
+        self.fov_cache[key] = fov
+        return fov
+
+    def blocks(self, i, eye):
+        # See the module docstring
+        return self.top[i] >= eye or self.ground[i] > eye
+
+    def cast(self, cx, cy, row, start, end, radius, eye, octant, visible):
+        # Recursive shadowcasting over one octant, slopes go from start (1.0) down to end (0.0)
+        if start < end:
+            return
+        xx, xy, yx, yy = octant
+        w, h = self.width, self.height
+        r2 = radius * radius
+        new_start = start
+        for j in range(row, radius + 1):
+            dx = -j - 1
+            dy = -j
+            blocked = False
+            while dx <= 0:
+                dx += 1
+                l_slope = (dx - 0.5) / (dy + 0.5)
+                r_slope = (dx + 0.5) / (dy - 0.5)
+                if start < r_slope:
+                    continue
+                if end > l_slope:
+                    break
+                x = cx + dx * xx + dy * xy
+                y = cy + dx * yx + dy * yy
+                inside = 0 <= x < w and 0 <= y < h
+                i = y * w + x
+                if inside and dx*dx + dy*dy <= r2:
+                    visible.add(i)
+                wall = not inside or self.blocks(i, eye)
+                if blocked:
+                    if wall:
+                        new_start = r_slope
+                    else:
+                        blocked = False
+                        start = new_start
+                elif wall and j < radius:
+                    blocked = True
+                    self.cast(cx, cy, j + 1, start, l_slope, radius, eye, octant, visible)
+                    new_start = r_slope
+            if blocked:
+                break
+
+
+class Counters:
+    # Per-cell counters of one player in chunks of CHUNK int16s, allocated on
+    # first write and shared with copies until either side writes to them
+    def __init__(self):
+        self.chunks = {}    # chunk number -> array('h') of CHUNK counters
+        self.own = set()    # chunks only this copy uses, written in place
+
+    def __getitem__(self, i):
+        chunk = self.chunks.get(i >> CHUNK_BITS)
+        return 0 if chunk is None else chunk[i & CHUNK_MASK]
+
+    def writable(self, c):
+        # Chunk c, made this copy's own before it is written to
+        if c in self.own:
+            return self.chunks[c]
+        chunk = self.chunks.get(c)
+        chunk = array('h', bytes(2 * CHUNK)) if chunk is None else chunk[:]
+        self.chunks[c] = chunk
+        self.own.add(c)
+        return chunk
+
+    def copy(self):
+        c = Counters.__new__(Counters)
+        c.chunks = dict(self.chunks)
+        c.own = set()
+        self.own = set()
+        return c
+
+
+class Visibility:
+    def __init__(self, sight, optics_range, players=(1, 2)):
+        self.sight = sight
+        self.width = sight.width
+        self.optics_range = optics_range
+        self.seen = {p: Counters() for p in players}
+        self.spotted = {p: Counters() for p in players}
+        self.views = {}     # unit -> (x, y, seen indices, spotted indices)
+        self.changed = {p: set() for p in players}
+
+    def is_seen(self, player, x, y):
+        return self.seen[player][y * self.width + x] > 0
+
+    def is_spotted(self, player, x, y):
+        return self.spotted[player][y * self.width + x] > 0
+
+    def add(self, unit):
+        seen, spotted = self.sight.field_of_view(unit.x, unit.y, self.optics_range[unit.optics], unit.flying)
+        self.views[unit] = (unit.x, unit.y, seen, spotted)
+        self.apply(unit.owner, seen, spotted, 1)
+
+    def remove(self, unit):
+        view = self.views.pop(unit, None)
+        if view is not None:
+            self.apply(unit.owner, view[2], view[3], -1)
+
+    def update(self, unit):
+        # Recompute only if the unit actually changed position
+        view = self.views.get(unit)
+        if view is not None and view[0] == unit.x and view[1] == unit.y:
+            return
+        self.remove(unit)
+        self.add(unit)
+
+    def copy(self, units):
+        # Same counters and views with the handles of `units`, a copy of the
+        # store; nothing is recomputed, the counter chunks are shared until
+        # one of the two changes them
+        vis = Visibility.__new__(Visibility)
+        vis.sight = self.sight
+        vis.width = self.width
+        vis.optics_range = self.optics_range
+        vis.seen = {p: counts.copy() for p, counts in self.seen.items()}
+        vis.spotted = {p: counts.copy() for p, counts in self.spotted.items()}
+        vis.views = {units[u.index]: view for u, view in self.views.items()}
+        vis.changed = {p: set() for p in self.changed}
+        return vis
+
+    def take_changed(self, player):
+        # Cells that flipped for `player` since the last call, other players' changes are dropped
+        cells = self.changed[player]
+        for p in self.changed:
+            self.changed[p] = set()
+        return cells
+
+    def apply(self, player, seen, spotted, delta):
+        changed = self.changed[player]
+        for counts, cells in ((self.seen[player], seen), (self.spotted[player], spotted)):
+            last = -1
+            for i in cells:
+                c = i >> CHUNK_BITS
+                if c != last:
+                    chunk = counts.writable(c)
+                    last = c
+                j = i & CHUNK_MASK
+                before = chunk[j]
+                chunk[j] = before + delta
+                if before == 0 or before + delta == 0:
+                    changed.add(i)